@@ -0,0 +1,15 @@
+"""
+Benchmarks of the rainfall request path.
+
+Load scenarios run a benchmark application (see :mod:`benchmarks.app`)
+in a separate process and drive it with the asyncio load generator
+(:mod:`benchmarks.loadgen`), microbenchmarks time single functions
+(:mod:`benchmarks.micro`)::
+
+    python -m benchmarks load --duration 5 --connections 32
+    python -m benchmarks micro
+    python -m benchmarks all --json before.json
+    python -m benchmarks all --compare before.json
+
+See docs/features.rst, Benchmarks.
+"""
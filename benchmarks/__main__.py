@@ -0,0 +1,110 @@
+import sys
+import json
+import argparse
+import functools
+import platform
+
+from . import micro
+from .app import make_app
+from .loadgen import run_scenario
+from .scenarios import SCENARIOS, BY_NAME
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description='Rainfall benchmarks'
+    )
+    parser.add_argument('suite', nargs='?', default='all', choices=('load', 'micro', 'all'))
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(BY_NAME),
+                        help='load scenario to run, may be repeated, all by default')
+    parser.add_argument('-c', '--connections', type=int, default=32)
+    parser.add_argument('-d', '--duration', type=float, default=5.0,
+                        help='seconds measured per scenario')
+    parser.add_argument('--warmup', type=float, default=1.0,
+                        help='seconds of load before measuring')
+    parser.add_argument('--workers', type=int, default=1, help='server processes')
+    parser.add_argument('--uvloop', action='store_true', help='run the server on uvloop')
+    parser.add_argument('--number', type=int, default=20000,
+                        help='calls per microbenchmark run')
+    parser.add_argument('--json', help='save results to this file')
+    parser.add_argument('--compare', help='results saved with --json to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression')
+    return parser.parse_args(argv)
+
+
+def run_load(args):
+    results = {}
+    scenarios = [BY_NAME[name] for name in args.scenario] if args.scenario else SCENARIOS
+    print('{:<14} {:>10} {:>9} {:>9} {:>8} {:>7}'.format(
+        'scenario', 'req/s', 'p50 ms', 'p99 ms', 'rss MB', 'errors'
+    ))
+    for scenario in scenarios:
+        result = run_scenario(
+            scenario, functools.partial(make_app, uvloop=args.uvloop),
+            args.connections, args.duration, args.warmup, workers=args.workers,
+        ).as_dict()
+        results[scenario.name] = result
+        print('{:<14} {:>10.1f} {:>9.3f} {:>9.3f} {:>8} {:>7}'.format(
+            scenario.name, result['rps'], result['p50_ms'], result['p99_ms'],
+            result['rss_mb'] if result['rss_mb'] is not None else '-', result['errors'],
+        ))
+    return results
+
+
+def run_micro(args):
+    results = micro.run(number=args.number)
+    print('{:<28} {:>10}'.format('microbenchmark', 'us/call'))
+    for name, value in results.items():
+        print('{:<28} {:>10.3f}'.format(name, value))
+    return {name: round(value, 4) for name, value in results.items()}
+
+
+def compare(results, baseline, threshold):
+    """
+    :rtype: list of regression descriptions
+    """
+    regressions = []
+    for name, result in results.get('load', {}).items():
+        before = baseline.get('load', {}).get(name)
+        if before and before['rps'] and result['rps'] < before['rps'] * (1 - threshold):
+            regressions.append('{}: {:.1f} req/s, was {:.1f}'.format(
+                name, result['rps'], before['rps']
+            ))
+    for name, value in results.get('micro', {}).items():
+        before = baseline.get('micro', {}).get(name)
+        if before and value > before * (1 + threshold):
+            regressions.append('{}: {:.3f} us, was {:.3f}'.format(name, value, before))
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'loop': 'uvloop' if args.uvloop else 'asyncio',
+    }
+    if args.suite in ('load', 'all'):
+        results['load'] = run_load(args)
+    if args.suite in ('micro', 'all'):
+        results['micro'] = run_micro(args)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            print('\nRegressions:')
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+        print('\nNo regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import os
+import asyncio
+
+from rainfall.web import Application, HTTPHandler, WSHandler
+
+
+# routes added to the benchmark app to see how lookup scales
+ROUTES_NUMBER = 200
+
+ITEMS = [
+    {'id': number, 'name': 'Item {}'.format(number), 'price': number * 3}
+    for number in range(50)
+]
+
+
+class HelloHandler(HTTPHandler):
+
+    use_etag = False
+
+    def handle(self, request):
+        return 'Hello, world!'
+
+
+class TemplateHandler(HTTPHandler):
+
+    use_etag = False
+
+    def handle(self, request):
+        return self.render('page.html', title='Items', items=ITEMS)
+
+
+class EtagHandler(HTTPHandler):
+
+    use_etag = True
+    payload = 'Hello, world! ' * 100
+
+    def handle(self, request):
+        return self.payload
+
+
+class ParamHandler(HTTPHandler):
+
+    use_etag = False
+
+    def handle(self, request, number):
+        return number
+
+
+class FormHandler(HTTPHandler):
+
+    use_etag = False
+
+    def handle(self, request):
+        return ', '.join('{}={}'.format(name, value) for name, value in sorted(request.POST.items()))
+
+
+class RouteHandler(HTTPHandler):
+
+    use_etag = False
+
+    def handle(self, request, **kwargs):
+        return request.path
+
+
+class EchoWSHandler(WSHandler):
+
+    @asyncio.coroutine
+    def on_message(self, message):
+        yield from self.send_message(message)
+
+
+def routes(number=ROUTES_NUMBER):
+    """
+    Url patterns of many-routes scenario, one dynamic route per section
+    """
+    return {
+        r'^/section{}/(?P<item>\d+)$'.format(index): RouteHandler
+        for index in range(number)
+    }
+
+
+def handlers():
+    result = {
+        r'^/$': HelloHandler,
+        r'^/template$': TemplateHandler,
+        r'^/etag$': EtagHandler,
+        r'^/param/(?P<number>\d+)$': ParamHandler,
+        r'^/form$': FormHandler,
+        r'^/ws$': EchoWSHandler,
+    }
+    result.update(routes())
+    return result
+
+
+def make_app(host='127.0.0.1', port='8888', **settings):
+
+    app_settings = {
+        'host': host,
+        'port': str(port),
+        'template_path': os.path.join(os.path.dirname(__file__), 'templates'),
+        # measuring the server, not the terminal
+        'access_log_path': os.devnull,
+        'metrics_loop_interval': None,
+    }
+    app_settings.update(settings)
+    return Application(handlers(), settings=app_settings)
@@ -0,0 +1,429 @@
+import os
+import socket
+import base64
+import asyncio
+import itertools
+import multiprocessing
+
+from rainfall.websocket import encode_frame, apply_mask
+
+
+OP_TEXT = 0x01
+OP_CLOSE = 0x08
+OP_PING = 0x09
+OP_PONG = 0x0a
+
+
+class Result(object):
+    """
+    Outcome of one load scenario
+
+    :param latencies: seconds per request (or websocket round trip),
+        of the measured period only
+    :param duration: seconds the measured period took
+    :param rss: peak resident memory of the server process (the sum over
+        the workers with several), bytes (None if unknown)
+    """
+
+    def __init__(self, name, latencies, errors, duration, rss=None):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.duration = duration
+        self.rss = rss
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def rps(self):
+        return self.requests / self.duration if self.duration else 0.0
+
+    def percentile(self, p):
+        """
+        :param p: 0..100
+        :rtype: seconds
+        """
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(round(p / 100 * (len(self.latencies) - 1))))
+        return self.latencies[index]
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'rps': round(self.rps, 1),
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'rss_mb': round(self.rss / 2 ** 20, 1) if self.rss is not None else None,
+        }
+
+
+class Scenario(object):
+    """
+    HTTP requests of a load scenario.
+
+    :param requests: callable returning an iterator of raw requests (bytes),
+        every connection gets its own
+    :param status: status code every response must have
+    """
+
+    websocket = False
+
+    def __init__(self, name, requests, status=200, description=''):
+        self.name = name
+        self.requests = requests
+        self.status = status
+        self.description = description
+
+    @asyncio.coroutine
+    def prepare(self, host, port, loop=None):
+        """
+        Is called once before the load, e.g. to get a value from the server
+        """
+
+
+class ETagScenario(Scenario):
+    """
+    Conditional GET: the ETag is fetched first, then every request
+    sends it in If-None-Match and gets 304
+    """
+
+    def __init__(self, name, path, description=''):
+        super().__init__(name, None, 304, description)
+        self.path = path
+
+    @asyncio.coroutine
+    def prepare(self, host, port, loop=None):
+        reader, writer = yield from asyncio.open_connection(host, port, loop=loop)
+        writer.write(get(self.path))
+        status, headers, _ = yield from read_response(reader)
+        writer.close()
+        etag = headers.get('etag')
+        if status != 200 or not etag:
+            raise RuntimeError('{} has no ETag'.format(self.path))
+        request = get(self.path, {'If-None-Match': etag})
+        self.requests = lambda: itertools.repeat(request)
+
+
+class WSScenario(Scenario):
+    """
+    Websocket echo: every connection sends a text message
+    and waits for it to come back
+    """
+
+    websocket = True
+
+    def __init__(self, name, path, message, description=''):
+        super().__init__(name, None, 101, description)
+        self.path = path
+        self.message = message
+
+
+def get(path, headers=None):
+    return request('GET', path, headers)
+
+
+def request(method, path, headers=None, body=b''):
+    lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: localhost']
+    for name, value in (headers or {}).items():
+        lines.append('{}: {}'.format(name, value))
+    if body:
+        lines.append('Content-Length: {}'.format(len(body)))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+@asyncio.coroutine
+def read_response(reader):
+    """
+    Reads one HTTP/1.1 response.
+
+    :rtype: (status code, dict of lowercase headers, body bytes)
+    """
+    head = yield from reader.readuntil(b'\r\n\r\n')
+    lines = head[:-4].decode('latin-1').split('\r\n')
+    status = int(lines[0].split(None, 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if status in (204, 304) or status < 200:
+        body = b''
+    elif 'chunked' in headers.get('transfer-encoding', ''):
+        chunks = []
+        while True:
+            size = int((yield from reader.readline()).split(b';')[0], 16)
+            chunk = yield from reader.readexactly(size + 2)
+            if not size:
+                break
+            chunks.append(chunk[:-2])
+        body = b''.join(chunks)
+    else:
+        body = yield from reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+def client_frame(opcode, data, mask=None):
+    """
+    Masked (client) websocket frame
+    """
+    mask = mask or os.urandom(4)
+    frame = bytearray(encode_frame(opcode, apply_mask(data, mask)))
+    frame[1] |= 0x80
+    header_length = len(frame) - len(data)
+    return bytes(frame[:header_length]) + mask + bytes(frame[header_length:])
+
+
+@asyncio.coroutine
+def read_frame(reader):
+    """
+    Reads an unmasked (server) websocket frame
+
+    :rtype: (opcode, data)
+    """
+    head = yield from reader.readexactly(2)
+    length = head[1] & 0x7f
+    if length == 126:
+        length = int.from_bytes((yield from reader.readexactly(2)), 'big')
+    elif length == 127:
+        length = int.from_bytes((yield from reader.readexactly(8)), 'big')
+    data = yield from reader.readexactly(length)
+    return head[0] & 0x0f, data
+
+
+class LoadGenerator(object):
+    """
+    Keeps `connections` keep-alive connections to the server busy
+    for `warmup` + `duration` seconds, one request in flight per connection.
+    Only the requests started after the warmup are measured.
+    """
+
+    def __init__(self, host, port, connections=32, duration=5.0, warmup=1.0):
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.duration = duration
+        self.warmup = warmup
+
+    def run(self, scenario, loop=None):
+        """
+        :param loop: event loop to run on, by default a new one
+            every run, so that scenarios don't inherit each other's state
+        :rtype: (latencies, errors, measured duration)
+        """
+        own_loop = loop is None
+        self._loop = loop = loop or asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(scenario.prepare(self.host, self.port, loop))
+
+            now = loop.time()
+            self._measure_from = now + self.warmup
+            self._deadline = self._measure_from + self.duration
+            latencies = []
+            errors = [0]
+            worker = self.ws_worker if scenario.websocket else self.http_worker
+            loop.run_until_complete(asyncio.gather(*[
+                worker(scenario, latencies, errors) for _ in range(self.connections)
+            ], loop=loop))
+        finally:
+            if own_loop:
+                loop.close()
+        return latencies, errors[0], self.duration
+
+    @asyncio.coroutine
+    def connect(self):
+        reader, writer = yield from asyncio.open_connection(self.host, self.port, loop=self._loop)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+    @asyncio.coroutine
+    def http_worker(self, scenario, latencies, errors):
+        loop = self._loop
+        requests = scenario.requests()
+        writer = None
+        try:
+            while loop.time() < self._deadline:
+                if writer is None:
+                    reader, writer = yield from self.connect()
+                started = loop.time()
+                writer.write(next(requests))
+                try:
+                    status, headers, _ = yield from read_response(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    errors[0] += 1
+                    writer.close()
+                    writer = None
+                    continue
+                finished = loop.time()
+                if status != scenario.status:
+                    errors[0] += 1
+                elif started >= self._measure_from and finished <= self._deadline:
+                    latencies.append(finished - started)
+                if headers.get('connection') == 'close':
+                    writer.close()
+                    writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+
+    @asyncio.coroutine
+    def ws_worker(self, scenario, latencies, errors):
+        loop = self._loop
+        reader, writer = yield from self.connect()
+        writer.write(get(scenario.path, {
+            'Upgrade': 'websocket',
+            'Connection': 'Upgrade',
+            'Sec-WebSocket-Key': base64.b64encode(os.urandom(16)).decode(),
+            'Sec-WebSocket-Version': '13',
+        }))
+        status, _, _ = yield from read_response(reader)
+        if status != 101:
+            errors[0] += 1
+            writer.close()
+            return
+
+        message = scenario.message.encode('utf-8')
+        frame = client_frame(OP_TEXT, message)
+        try:
+            while loop.time() < self._deadline:
+                started = loop.time()
+                writer.write(frame)
+                while True:
+                    opcode, data = yield from read_frame(reader)
+                    if opcode == OP_PING:
+                        writer.write(client_frame(OP_PONG, data))
+                    elif opcode == OP_CLOSE:
+                        raise ConnectionResetError('closed by the server')
+                    else:
+                        break
+                finished = loop.time()
+                if data != message:
+                    errors[0] += 1
+                elif started >= self._measure_from and finished <= self._deadline:
+                    latencies.append(finished - started)
+            writer.write(client_frame(OP_CLOSE, (1000).to_bytes(2, 'big')))
+            while (yield from read_frame(reader))[0] != OP_CLOSE:
+                pass
+        except (asyncio.IncompleteReadError, ConnectionError):
+            errors[0] += 1
+        finally:
+            writer.close()
+
+
+def free_port(host='127.0.0.1'):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss(pid):
+    """
+    Peak resident memory of a process in bytes, None where /proc isn't available
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    """
+    Pids of the children of a process, empty where /proc isn't available
+    """
+    children = []
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return children
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as stat:
+                # the command in parentheses may contain spaces
+                fields = stat.read().rpartition(')')[2].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(name))
+    return children
+
+
+def serve(app, kwargs):
+    """
+    Runs the application in the child process on a new event loop:
+    the forked default loop of the parent shares its selector
+    with the parent and the previous scenarios.
+    """
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    app.run(**kwargs)
+
+
+class Server(object):
+    """
+    Runs an application in a child process, like
+    :class:`rainfall.unittest.RainfallTestCase` does::
+
+        with Server(make_app(port=port)):
+            ...
+    """
+
+    def __init__(self, app, **run_kwargs):
+        self.app = app
+        self.run_kwargs = run_kwargs
+        self.process = None
+
+    def __enter__(self):
+        queue = multiprocessing.Queue()
+        kwargs = dict(self.run_kwargs, process_queue=queue, greeting=False)
+        self.process = multiprocessing.Process(target=serve, args=(self.app, kwargs))
+        self.process.start()
+        queue.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    @property
+    def workers(self):
+        return self.run_kwargs.get('workers') or self.app.settings['workers']
+
+    @property
+    def rss(self):
+        """
+        Peak RSS of the server, summed over the workers when there are
+        several (the supervisor itself only waits for them)
+        """
+        pids = [self.process.pid]
+        if self.workers > 1:
+            pids = child_pids(self.process.pid)
+            if not pids:
+                return None
+        rss = [peak_rss(pid) for pid in pids]
+        if None in rss:
+            return None
+        return sum(rss)
+
+
+def run_scenario(scenario, app_factory, connections=32, duration=5.0, warmup=1.0,
+                 host='127.0.0.1', **run_kwargs):
+    """
+    Starts a fresh server for the scenario and puts load on it.
+
+    :param app_factory: callable(host, port) returning :class:`rainfall.web.Application`
+    :rtype: :class:`Result`
+    """
+    port = free_port(host)
+    with Server(app_factory(host=host, port=port), **run_kwargs) as server:
+        generator = LoadGenerator(host, port, connections, duration, warmup)
+        latencies, errors, measured = generator.run(scenario)
+        rss = server.rss
+    return Result(scenario.name, latencies, errors, measured, rss)
@@ -0,0 +1,171 @@
+import asyncio
+import timeit
+
+from rainfall.http import HTTPRequest, HTTPResponse, read_request
+from rainfall.utils import match_dict_regexp, NotModified
+from rainfall.routing import Router
+from rainfall.handlers import HTTPHandler
+
+from .app import HelloHandler, EtagHandler, handlers, make_app
+
+
+REQUEST = (
+    b'GET /section150/42?page=2 HTTP/1.1\r\n'
+    b'Host: localhost:8888\r\n'
+    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:60.0) Gecko/20100101 Firefox/60.0\r\n'
+    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+    b'Accept-Language: en-US,en;q=0.5\r\n'
+    b'Accept-Encoding: gzip, deflate\r\n'
+    b'Cookie: session=0123456789abcdef; theme=dark\r\n'
+    b'Connection: keep-alive\r\n'
+    b'\r\n'
+)
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine that never waits, without an event loop in the way
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as exc:
+        return exc.value
+    raise RuntimeError('The coroutine is waiting for something')
+
+
+def bench_read_request(number):
+    reader = asyncio.StreamReader()
+
+    def read():
+        # fed one by one, a long buffer would be moved on every read
+        reader.feed_data(REQUEST)
+        run_sync(read_request(reader))
+    return read
+
+
+def _routes():
+    return {url: handler for url, handler in handlers().items() if issubclass(handler, HTTPHandler)}
+
+
+def bench_match_dict_regexp(number):
+    routes = _routes()
+    return lambda: match_dict_regexp(routes, '/section150/42')
+
+
+def bench_router_resolve(number):
+    router = Router(_routes(), cache_size=0)
+    return lambda: router.resolve('/section150/42')
+
+
+def bench_router_match(number):
+    router = Router(_routes())
+    return lambda: router.match('/section150/42')
+
+
+def bench_compose(number):
+    def compose():
+        response = HTTPResponse(body='Hello, world!', headers={'ETag': '"abc"'})
+        response.keep_alive = True
+        response.compose()
+    return compose
+
+
+def bench_handler_call(number):
+    settings = make_app().settings
+    request = HTTPRequest('GET', '/', {'Host': 'localhost'})
+
+    def call():
+        run_sync(HelloHandler(settings)(request))
+    return call
+
+
+def bench_handler_call_singleton(number):
+    settings = make_app().settings
+    handler = HelloHandler(settings)
+    handler._shared = True
+
+    def call():
+        request = HTTPRequest('GET', '/', {'Host': 'localhost'})
+        run_sync(handler(request))
+    return call
+
+
+def bench_handler_call_per_request(number):
+    settings = make_app().settings
+
+    def call():
+        request = HTTPRequest('GET', '/', {'Host': 'localhost'})
+        run_sync(HelloHandler(settings)(request))
+    return call
+
+
+def bench_handler_call_etag(number):
+    settings = make_app().settings
+    request = HTTPRequest('GET', '/etag', {'Host': 'localhost'})
+
+    def call():
+        run_sync(EtagHandler(settings)(request))
+    return call
+
+
+def bench_handler_call_304(number):
+    settings = make_app().settings
+    handler = EtagHandler(settings)
+    etag = run_sync(handler(HTTPRequest('GET', '/etag', {})))[1]['ETag']
+    request = HTTPRequest('GET', '/etag', {'If-None-Match': etag})
+
+    def call():
+        try:
+            run_sync(EtagHandler(settings)(request))
+        except NotModified:
+            pass
+    return call
+
+
+class VersionedHandler(EtagHandler):
+
+    def get_etag(self, request):
+        return 'v1'
+
+
+def bench_handler_call_weak_304(number):
+    settings = make_app().settings
+    request = HTTPRequest('GET', '/etag', {'If-None-Match': 'W/"v1"'})
+
+    def call():
+        try:
+            run_sync(VersionedHandler(settings)(request))
+        except NotModified:
+            pass
+    return call
+
+
+# name -> factory(number) returning the function to time
+BENCHMARKS = [
+    ('read_request', bench_read_request),
+    ('match_dict_regexp', bench_match_dict_regexp),
+    ('Router.resolve', bench_router_resolve),
+    ('Router.match', bench_router_match),
+    ('HTTPResponse.compose', bench_compose),
+    ('HTTPHandler.__call__', bench_handler_call),
+    ('HTTPHandler.__call__ request', bench_handler_call_per_request),
+    ('HTTPHandler.__call__ singleton', bench_handler_call_singleton),
+    ('HTTPHandler.__call__ etag', bench_handler_call_etag),
+    ('HTTPHandler.__call__ 304', bench_handler_call_304),
+    ('HTTPHandler.__call__ get_etag 304', bench_handler_call_weak_304),
+]
+
+
+def run(names=None, number=20000, repeat=5):
+    """
+    :rtype: dict, name -> microseconds per call, the best of `repeat` runs
+    """
+    results = {}
+    for name, factory in BENCHMARKS:
+        if names and name not in names:
+            continue
+        best = min(
+            timeit.Timer(factory(number)).timeit(number) for _ in range(repeat)
+        )
+        results[name] = best / number * 1e6
+    return results
@@ -0,0 +1,45 @@
+import random
+import itertools
+
+from urllib.parse import urlencode
+
+from .app import ROUTES_NUMBER
+from .loadgen import Scenario, ETagScenario, WSScenario, get, request
+
+
+def _cycle(requests):
+    return lambda: itertools.cycle(requests)
+
+
+def _param_requests():
+    return _cycle([get('/param/{}'.format(number)) for number in range(100)])
+
+
+def _form_requests():
+    body = urlencode({'name': 'rainfall', 'version': '0.8.4', 'text': 'x' * 200}).encode()
+    return _cycle([request('POST', '/form', {
+        'Content-Type': 'application/x-www-form-urlencoded'
+    }, body)])
+
+
+def _many_routes_requests():
+    # random sections and items, most paths miss the router cache
+    rnd = random.Random(0)
+    return _cycle([
+        get('/section{}/{}'.format(rnd.randrange(ROUTES_NUMBER), rnd.randrange(10 ** 6)))
+        for _ in range(10000)
+    ])
+
+
+SCENARIOS = [
+    Scenario('hello', _cycle([get('/')]), description='plain text response'),
+    Scenario('template', _cycle([get('/template')]), description='jinja2 page with a loop'),
+    ETagScenario('etag', '/etag', description='If-None-Match, 304 responses'),
+    Scenario('param', _param_requests(), description='url with a named group'),
+    Scenario('post_form', _form_requests(), description='urlencoded POST body'),
+    Scenario('many_routes', _many_routes_requests(),
+             description='{} dynamic routes'.format(ROUTES_NUMBER)),
+    WSScenario('ws_echo', '/ws', 'Hello, websocket!', description='websocket round trip'),
+]
+
+BY_NAME = {scenario.name: scenario for scenario in SCENARIOS}
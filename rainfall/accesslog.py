@@ -0,0 +1,166 @@
+import sys
+import json
+import time
+import queue
+import random
+import logging
+
+from logging.handlers import QueueListener
+
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+# fields of an access log entry, in order
+FIELDS = ('created', 'method', 'path', 'code', 'duration', 'bytes_sent', 'remote')
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line with the fields of an access log entry
+    """
+
+    def format(self, record):
+        return json.dumps({
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'method': record.method,
+            'path': record.path,
+            'code': record.code,
+            'duration_ms': round(record.duration * 1000, 3),
+            'bytes': record.bytes_sent,
+            'remote': record.remote,
+        }, separators=(',', ':'))
+
+
+class BatchQueueListener(QueueListener):
+    """
+    QueueListener that takes up to `batch_size` entries at once and writes
+    them to stream handlers with a single write() and flush().
+
+    Entries are plain tuples of :data:`FIELDS`, LogRecords are made here,
+    out of the event loop thread.
+    """
+
+    def __init__(self, queue, *handlers, batch_size=256):
+        super().__init__(queue, *handlers)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        # the queue may be full, the entries in it have to be written anyway
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = self._sentinel in batch
+            records = [self.make_record(entry) for entry in batch if entry is not self._sentinel]
+            if records:
+                self.handle_batch(records)
+            if stop:
+                return
+
+    def make_record(self, entry):
+        fields = dict(zip(FIELDS, entry))
+        record = logging.makeLogRecord(fields)
+        record.name = 'rainfall.access'
+        record.levelno = logging.ERROR if entry[3] >= 500 else logging.INFO
+        record.levelname = logging.getLevelName(record.levelno)
+        record.msg = '{} {} {} {:.1f}ms'.format(
+            record.method, record.path, record.code, record.duration * 1000
+        )
+        return record
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            if isinstance(handler, logging.StreamHandler):
+                lines = ''.join(
+                    handler.format(record) + handler.terminator for record in records
+                )
+                handler.acquire()
+                try:
+                    handler.stream.write(lines)
+                    handler.flush()
+                except Exception:
+                    handler.handleError(records[0])
+                finally:
+                    handler.release()
+            else:
+                for record in records:
+                    handler.handle(record)
+
+
+class AccessLog(object):
+    """
+    Access log that doesn't write on the event loop thread.
+
+    :meth:`log` puts a tuple to a bounded queue and returns, a thread
+    (:class:`BatchQueueListener`) formats and writes entries in batches.
+    When the queue is full, entries are dropped (and counted) instead
+    of blocking the loop.
+
+    :param handlers: logging handlers to write to
+    :param sample: fraction of requests to log, 5xx responses are always logged
+    :param queue_size: max number of entries waiting for the thread
+    :param batch_size: max number of entries written at once
+    """
+
+    def __init__(self, handlers, sample=1.0, queue_size=10000, batch_size=256):
+        self.handlers = handlers
+        self.sample = sample
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.listener = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Creates the access log of :class:`rainfall.web.Application`
+        """
+        path = settings['access_log_path'] or settings.get('logfile_path')
+        handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+        if settings['access_log_format'] == 'json':
+            handler.setFormatter(JSONFormatter())
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', DATE_FORMAT))
+        return cls(
+            [handler], settings['access_log_sample'],
+            settings['access_log_queue_size'], settings['access_log_batch_size'],
+        )
+
+    def start(self):
+        """
+        Starts the writing thread, is called in the serving process
+        (after workers are forked)
+        """
+        if self.listener is None:
+            self.listener = BatchQueueListener(
+                self.queue, *self.handlers, batch_size=self.batch_size
+            )
+            self.listener.start()
+
+    def stop(self):
+        """
+        Writes what is queued and stops the thread
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self.dropped:
+            logger.warning('{} access log entries were dropped'.format(self.dropped))
+
+    def log(self, method, path, code, duration, bytes_sent=0, remote=None):
+        if self.sample < 1 and code < 500 and random.random() >= self.sample:
+            return
+        try:
+            self.queue.put_nowait((time.time(), method, path, code, duration, bytes_sent, remote))
+        except queue.Full:
+            self.dropped += 1
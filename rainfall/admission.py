@@ -0,0 +1,126 @@
+import asyncio
+
+from collections import deque
+
+
+class Limiter(object):
+    """
+    Lets at most `limit` requests in at once. Up to `queue_size` more
+    wait for a place in order of arrival, for `timeout` seconds at most;
+    the others are turned away at once.
+
+    :param limit: max number of requests in flight
+    :param queue_size: max number of waiting requests, 0 to wait for nothing
+    :param timeout: seconds to wait, None to wait as long as it takes
+    """
+
+    def __init__(self, limit, queue_size=0, timeout=None):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    @asyncio.coroutine
+    def acquire(self):
+        """
+        :rtype: bool, False if there was no place for the request
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.Future()
+        self._waiters.append(waiter)
+        try:
+            yield from asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # the place was given right when the time was over
+                return True
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+        return True
+
+    def release(self):
+        # the place goes to the next waiter, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class Admission(object):
+    """
+    Admission control of :class:`rainfall.web.RainfallProtocol`:
+    a request gets a place in the global limit (`max_requests_in_flight`
+    setting) and in the limit of its handler (`max_in_flight` attribute
+    of :class:`rainfall.handlers.HTTPHandler`) before the handler is called.
+    Requests that don't get one in `request_queue_timeout` seconds,
+    or don't fit in the queue, get 503 with Retry-After.
+
+    :param max_in_flight: global limit, None for no limit
+    :param queue_size: requests waiting for each limit
+    :param timeout: seconds to wait for a place
+    """
+
+    def __init__(self, max_in_flight=None, queue_size=0, timeout=None):
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.limiter = None
+        if max_in_flight:
+            self.limiter = Limiter(max_in_flight, queue_size, timeout)
+        self.routes = {}  # handler class -> Limiter
+
+    def route_limiter(self, handler_cls):
+        limiter = self.routes.get(handler_cls)
+        if limiter is None and handler_cls.max_in_flight:
+            limiter = self.routes[handler_cls] = Limiter(
+                handler_cls.max_in_flight, self.queue_size, self.timeout
+            )
+        return limiter
+
+    @asyncio.coroutine
+    def acquire(self, handler_cls):
+        """
+        :rtype: tuple of limiters to release when the handler is done,
+            None if the request is rejected
+        """
+        acquired = []
+        # the narrower limit first, not to hold a global place while waiting for it
+        for limiter in (self.route_limiter(handler_cls), self.limiter):
+            if limiter is None:
+                continue
+            try:
+                admitted = yield from limiter.acquire()
+            except asyncio.CancelledError:
+                self.release(acquired)
+                raise
+            if not admitted:
+                self.release(acquired)
+                return None
+            acquired.append(limiter)
+        return tuple(acquired)
+
+    def release(self, limiters):
+        for limiter in limiters:
+            limiter.release()
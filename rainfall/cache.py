@@ -0,0 +1,139 @@
+import time
+import asyncio
+
+from collections import OrderedDict
+
+
+class CachedResponse(object):
+    """
+    What :class:`ResponseCache` keeps for a rendered page.
+
+    :param headers: dict of headers set by the handler, with ETag
+    :param body: encoded body, bytes
+    :param etag: ETag value or None
+    """
+
+    __slots__ = ('headers', 'body', 'etag')
+
+    def __init__(self, headers, body, etag=None):
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+
+
+class ResponseCache(object):
+    """
+    In-memory cache of rendered responses for a :class:`rainfall.web.HTTPHandler`,
+    with TTL and LRU eviction.
+
+    Only GET requests with a str result of handle() are cached. The cache key
+    is built from the path and the chosen query params and headers.
+
+    Concurrent misses of the same key don't render the page several times:
+    the first one renders, the others wait for its result.
+
+    :param ttl: seconds an entry is valid
+    :param max_size: max number of entries, the least recently used go first
+    :param query_params: names of GET params that change the response
+    :param headers: names of request headers that change the response
+    """
+
+    def __init__(self, ttl=60, max_size=1024, query_params=(), headers=()):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.query_params = tuple(query_params)
+        self.headers = tuple(headers)
+        self._entries = OrderedDict()  # key -> (expires, CachedResponse)
+        self._pending = {}  # key -> asyncio.Future of a render in progress
+
+    def key(self, request):
+        """
+        Cache key of :class:`rainfall.http.HTTPRequest`
+        """
+        key = [request.path.split('?')[0]]
+        if self.query_params:
+            params = request.GET
+            key.extend(params.get(name) for name in self.query_params)
+        for name in self.headers:
+            key.append(request.headers.get(name))
+        return tuple(key)
+
+    def get(self, key):
+        """
+        :rtype: :class:`CachedResponse` or None if missing or expired
+        """
+        try:
+            expires, entry = self._entries[key]
+        except KeyError:
+            return None
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        self._entries[key] = (time.monotonic() + self.ttl, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @asyncio.coroutine
+    def get_or_render(self, key, render):
+        """
+        Return the cached entry or call `render` coroutine to make one.
+        Only one render per key runs at a time, concurrent callers share its result.
+
+        :param render: coroutine function returning :class:`CachedResponse`,
+            or None if the result can't be cached
+        :rtype: :class:`CachedResponse` or None
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return (yield from asyncio.shield(pending))
+
+        future = self._pending[key] = asyncio.Future()
+        try:
+            entry = yield from render()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # waiters get it, don't warn if there are none
+            raise
+        finally:
+            del self._pending[key]
+
+        if entry is not None:
+            self.set(key, entry)
+        future.set_result(entry)
+        return entry
+
+
+def cache_response(ttl=60, max_size=1024, query_params=(), headers=()):
+    """
+    Class decorator, turns on :class:`ResponseCache` for a handler.
+    The same as setting response_cache class attribute.
+
+    Example::
+
+        @cache_response(ttl=30, query_params=('page',))
+        class NewsHandler(HTTPHandler):
+            def handle(self, request):
+                return self.render('news.html', news=load_news(request.GET.get('page')))
+    """
+    def decorator(handler_cls):
+        handler_cls.response_cache = ResponseCache(ttl, max_size, query_params, headers)
+        return handler_cls
+    return decorator
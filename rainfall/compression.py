@@ -0,0 +1,166 @@
+import zlib
+import asyncio
+
+from collections import OrderedDict
+
+from .etag import encoded_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# in order of preference
+ENCODINGS = ('br', 'gzip', 'deflate') if brotli is not None else ('gzip', 'deflate')
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+
+def choose_encoding(accept_encoding, encodings=ENCODINGS):
+    """
+    Picks the encoding for a response from Accept-Encoding header value.
+
+    :rtype: one of `encodings` or None for identity
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding, level=6):
+    """
+    :param body: bytes
+    :param encoding: 'gzip', 'deflate' or 'br'
+    :param level: zlib level, brotli quality
+    :rtype: compressed bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(level, 11))
+    if encoding == 'gzip':
+        # unlike gzip.compress, no mtime in the header: equal bodies give equal bytes
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(body) + compressor.flush()
+
+
+class Compressor(object):
+    """
+    Compresses response bodies for the clients that accept it,
+    see `compression` setting of :class:`rainfall.web.Application`.
+
+    Only str/bytes bodies of compressible content types, not smaller than
+    `min_size`, are compressed; streams and files are sent as they are.
+    Bodies larger than `executor_size` are compressed in the executor pool.
+
+    Compressed bodies of responses with ETag are kept in LRU cache by path
+    and ETag, so a hot page is compressed once and not on every request
+    (ETags from get_etag() of handlers may be shared by several urls).
+    The ETag of a compressed response gets the encoding suffix,
+    see :func:`rainfall.etag.encoded_etag`.
+
+    :param level: zlib compression level, also brotli quality
+    :param min_size: bytes, smaller bodies are not worth it
+    :param types: content type prefixes to compress
+    :param executor_size: bytes, larger bodies are compressed out of the loop
+    :param cache_size: how many compressed bodies to keep
+    :param executor_pool: :class:`rainfall.utils.ExecutorPool`
+    """
+
+    def __init__(self, level=6, min_size=1024, types=COMPRESSIBLE_TYPES,
+                 executor_size=64 * 1024, cache_size=256, executor_pool=None):
+        self.level = level
+        self.min_size = min_size
+        self.types = tuple(types)
+        self.executor_size = executor_size
+        self.cache_size = cache_size
+        self.executor_pool = executor_pool
+        self._cache = OrderedDict()  # (path, etag, encoding) -> compressed body
+
+    def compressible(self, response):
+        """
+        True if the response body may be compressed, whatever the client accepts
+        """
+        if response.code in (204, 304) or not isinstance(response.body, (str, bytes)):
+            return False
+        content_type = None
+        for name, value in response.headers.items():
+            name = name.lower()
+            if name == 'content-encoding':
+                return False
+            elif name == 'content-type':
+                content_type = value
+        if content_type is None:
+            content_type = response._default_headers['Content-Type']
+        return content_type.lower().startswith(self.types)
+
+    @asyncio.coroutine
+    def apply(self, request, response):
+        """
+        Replaces body of :class:`rainfall.http.HTTPResponse` with the compressed one
+        and sets Content-Encoding, if the response and the request allow it.
+        """
+        if not self.compressible(response):
+            return
+
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if len(body) < self.min_size:
+            return
+
+        vary = response.headers.get('Vary')
+        if not vary:
+            response.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            response.headers['Vary'] = vary + ', Accept-Encoding'
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding') or '')
+        if encoding is None:
+            return
+
+        etag = response.headers.get('ETag')
+        key = (request.path, etag, encoding)
+        compressed = self._cache.get(key) if etag else None
+        if compressed is None:
+            if self.executor_pool is not None and len(body) >= self.executor_size:
+                compressed = yield from self.executor_pool.run(
+                    compress, body, encoding, self.level
+                )
+            else:
+                compressed = compress(body, encoding, self.level)
+            if etag:
+                self._cache[key] = compressed
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # other bytes, another validator (RFC 7232, 2.1)
+            response.headers['ETag'] = encoded_etag(etag, encoding)
+        response.body = compressed
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,109 @@
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def xxhash64(data):
+    return xxhash.xxh64(data).hexdigest()
+
+
+def blake2b64(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+# name -> function(bytes) returning a hex digest, see etag_hash setting
+HASHES = {
+    'xxhash': xxhash64 if xxhash is not None else None,
+    'blake2b': blake2b64 if hasattr(hashlib, 'blake2b') else None,
+    'sha1': sha1,
+}
+
+# ETag endings of compressed representations, see encoded_etag()
+ENCODING_SUFFIXES = ('-gzip"', '-br"', '-deflate"')
+
+
+def get_hash(name='auto'):
+    """
+    :param name: key of :data:`HASHES`, 'auto' for the fastest available
+        (xxhash if it's installed, blake2b otherwise), or a function
+    :rtype: function(bytes) returning a hex digest
+    """
+    if callable(name):
+        return name
+    if name == 'auto':
+        return HASHES['xxhash'] or HASHES['blake2b'] or sha1
+    function = HASHES.get(name)
+    if function is None:
+        raise ValueError('{} hash is not available'.format(name))
+    return function
+
+
+def make_etag(body, hash=sha1):
+    """
+    Strong ETag of the body
+
+    :param body: bytes
+    :rtype: str, quoted hex digest
+    """
+    return '"' + hash(body) + '"'
+
+
+def weak_etag(value):
+    """
+    Weak ETag of a version, an mtime, anything identifying the content
+    but not the exact bytes (a quoted value is taken as is)
+
+    :rtype: str, W/"value"
+    """
+    value = str(value)
+    if value.startswith('W/'):
+        return value
+    if not value.startswith('"'):
+        value = '"' + value + '"'
+    return 'W/' + value
+
+
+def encoded_etag(etag, encoding):
+    """
+    ETag of a compressed representation: the bytes differ from
+    the identity ones, so the validator does as well::
+
+        encoded_etag('"abc"', 'gzip')  # '"abc-gzip"'
+        encoded_etag('W/"v1"', 'br')  # 'W/"v1-br"'
+    """
+    return etag[:-1] + '-' + encoding + '"'
+
+
+def _opaque(tag):
+    # weak comparison: without W/ and the suffix of encoded_etag()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison of If-None-Match (a list of ETags or *) with the ETag,
+    as RFC 7232 wants it for GET and HEAD. ETags of the compressed
+    representations (:func:`encoded_etag`) match as well.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match == etag:
+        return True
+    etag = _opaque(etag)
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or _opaque(tag) == etag:
+            return True
+    return False
@@ -0,0 +1,309 @@
+import tempfile
+
+from urllib import parse
+
+
+# file parts of multipart bodies larger than that go to disk, bytes
+SPOOL_SIZE = 1024 * 1024
+
+MAX_PART_HEADERS_SIZE = 16 * 1024
+
+
+class MultiDict(dict):
+    """
+    dict of the first value of every key, as query strings and forms
+    were read before. All the values of a repeated key are
+    returned by :meth:`get_all`::
+
+        # ?tag=a&tag=b
+        request.GET['tag']  # 'a'
+        request.GET.get_all('tag')  # ['a', 'b']
+    """
+
+    __slots__ = ('_lists',)
+
+    def __init__(self, pairs=()):
+        super().__init__()
+        self._lists = {}
+        for key, value in pairs:
+            self.add(key, value)
+
+    def add(self, key, value):
+        values = self._lists.get(key)
+        if values is None:
+            self._lists[key] = [value]
+            dict.__setitem__(self, key, value)
+        else:
+            values.append(value)
+
+    def get_all(self, key):
+        """
+        :rtype: list of all values of `key`, empty if there are none
+        """
+        return list(self._lists.get(key, ()))
+
+    def all_items(self):
+        """
+        :rtype: list of (key, value) with every value of repeated keys
+        """
+        return [(key, value) for key, values in self._lists.items() for value in values]
+
+    def __setitem__(self, key, value):
+        self._lists[key] = [value]
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        del self._lists[key]
+        dict.__delitem__(self, key)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.all_items())
+
+
+def parse_query(query):
+    """
+    :param query: str, urlencoded
+    :rtype: :class:`MultiDict`, blank values are kept
+    """
+    if not query:
+        return MultiDict()
+    return MultiDict(parse.parse_qsl(query, keep_blank_values=True))
+
+
+def parse_header_options(value):
+    """
+    Splits a header like Content-Type or Content-Disposition
+    into its value and parameters::
+
+        parse_header_options('form-data; name="file"; filename="a.txt"')
+        # ('form-data', {'name': 'file', 'filename': 'a.txt'})
+
+    :rtype: (lowercased value, dict of lowercased parameter -> value)
+    """
+    main, _, rest = value.partition(';')
+    options = {}
+    while rest:
+        name, sep, rest = rest.partition('=')
+        name = name.strip().lower()
+        rest = rest.lstrip()
+        if rest.startswith('"'):
+            # quoted-string, may contain ; and escaped quotes
+            chars = []
+            i = 1
+            while i < len(rest) and rest[i] != '"':
+                if rest[i] == '\\' and i + 1 < len(rest):
+                    i += 1
+                chars.append(rest[i])
+                i += 1
+            option = ''.join(chars)
+            rest = rest[i + 1:].partition(';')[2]
+        else:
+            option, _, rest = rest.partition(';')
+            option = option.strip()
+        if name and sep:
+            options[name] = option
+    return main.strip().lower(), options
+
+
+def parse_cookies(header):
+    """
+    :param header: Cookie header value
+    :rtype: dict, name -> value, the first of the same names wins
+    """
+    cookies = {}
+    if not header:
+        return cookies
+    for pair in header.split(';'):
+        name, sep, value = pair.partition('=')
+        name = name.strip()
+        if not sep or not name:
+            continue
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        cookies.setdefault(name, parse.unquote(value))
+    return cookies
+
+
+class UploadedFile(object):
+    """
+    File part of a multipart/form-data body, in :attr:`HTTPRequest.FILES`.
+
+    Its content is in `file`, a SpooledTemporaryFile: in memory up to
+    `multipart_spool_size` bytes, in a temporary file on disk beyond that.
+    The file is closed (and deleted) after the response is sent.
+    """
+
+    __slots__ = ('name', 'filename', 'content_type', 'file', 'size')
+
+    def __init__(self, name, filename, content_type, file):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.file = file
+        self.size = 0
+
+    def read(self, n=-1):
+        return self.file.read(n)
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return '<UploadedFile {!r} {} bytes>'.format(self.filename, self.size)
+
+
+class MultipartParser(object):
+    """
+    Incremental multipart/form-data parser: body chunks are fed
+    as they come from the connection, file parts are written to
+    spooled temporary files, so the body is never kept whole in memory.
+
+    Example::
+
+        parser = MultipartParser(boundary)
+        while True:
+            chunk = yield from request.stream.readchunk()
+            if not chunk:
+                break
+            parser.feed(chunk)
+        parser.close()
+        parser.form, parser.files
+
+    Malformed bodies raise ValueError.
+
+    :param boundary: bytes, boundary parameter of Content-Type
+    :param spool_size: bytes of a file part kept in memory
+    :param charset: of field values and file names
+    """
+
+    def __init__(self, boundary, spool_size=SPOOL_SIZE, charset='utf-8'):
+        if not boundary or len(boundary) > 70:
+            raise ValueError('Invalid multipart boundary')
+        self.delimiter = b'--' + boundary
+        self.spool_size = spool_size
+        self.charset = charset
+        self.form = MultiDict()
+        self.files = MultiDict()
+        self._buffer = bytearray()
+        self._step = self._preamble
+        self._part = None  # UploadedFile or bytearray of a field
+        self._name = None
+
+    def feed(self, data):
+        self._buffer += data
+        try:
+            while self._step():
+                pass
+        except ValueError:
+            self.discard()
+            raise
+
+    def close(self):
+        """
+        Checks the body is complete and rewinds the files
+        """
+        if self._step != self._epilogue:
+            self.discard()
+            raise ValueError('Multipart body is incomplete')
+        for upload in self.files.values():
+            upload.file.seek(0)
+
+    def discard(self):
+        """
+        Closes (and deletes) the files of the parts read so far,
+        when the body is malformed or isn't read to the end
+        """
+        if isinstance(self._part, UploadedFile):
+            self._part.close()
+        for _, upload in self.files.all_items():
+            upload.close()
+
+    def _preamble(self):
+        buffer = self._buffer
+        i = buffer.find(self.delimiter)
+        if i < 0:
+            del buffer[:max(len(buffer) - len(self.delimiter), 0)]
+            return False
+        return self._after_delimiter(i + len(self.delimiter))
+
+    def _after_delimiter(self, end):
+        tail = bytes(self._buffer[end:end + 2])
+        if len(tail) < 2:
+            return False
+        if tail == b'--':
+            self._step = self._epilogue
+        elif tail == b'\r\n':
+            self._step = self._headers
+        else:
+            raise ValueError('Invalid multipart delimiter')
+        del self._buffer[:end + 2]
+        return True
+
+    def _headers(self):
+        buffer = self._buffer
+        i = buffer.find(b'\r\n\r\n')
+        if i < 0:
+            if len(buffer) > MAX_PART_HEADERS_SIZE:
+                raise ValueError('Multipart headers too large')
+            return False
+
+        headers = {}
+        for line in bytes(buffer[:i]).decode(self.charset, 'replace').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise ValueError('Invalid multipart header line')
+            headers[name.strip().lower()] = value.strip()
+        del buffer[:i + 4]
+
+        disposition, options = parse_header_options(headers.get('content-disposition', ''))
+        if disposition != 'form-data' or 'name' not in options:
+            raise ValueError('Multipart part is not form-data')
+        self._name = options['name']
+        if 'filename' in options:
+            self._part = UploadedFile(
+                self._name, options['filename'],
+                headers.get('content-type', 'application/octet-stream'),
+                tempfile.SpooledTemporaryFile(max_size=self.spool_size),
+            )
+        else:
+            self._part = bytearray()
+        self._step = self._body
+        return True
+
+    def _body(self):
+        buffer = self._buffer
+        marker = b'\r\n' + self.delimiter
+        i = buffer.find(marker)
+        if i < 0:
+            # the end of buffer may be the start of the marker
+            self._write(len(buffer) - len(marker) + 1)
+            return False
+
+        self._write(i)
+        if len(buffer) < len(marker) + 2:
+            return False
+        self._finish_part()
+        return self._after_delimiter(len(marker))
+
+    def _write(self, size):
+        if size <= 0:
+            return
+        data = self._buffer[:size]
+        if isinstance(self._part, UploadedFile):
+            self._part.file.write(data)
+            self._part.size += size
+        else:
+            self._part += data
+        del self._buffer[:size]
+
+    def _finish_part(self):
+        if isinstance(self._part, UploadedFile):
+            self.files.add(self._name, self._part)
+        else:
+            self.form.add(self._name, self._part.decode(self.charset, 'replace'))
+        self._part = None
+
+    def _epilogue(self):
+        del self._buffer[:]
+        return False
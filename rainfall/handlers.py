@@ -6,7 +6,6 @@ import email
 import sys
 import signal
 import asyncio
-import hashlib
 import traceback
 import logging
 
@@ -16,8 +15,13 @@ from websockets.server import WebSocketServerProtocol
 from websockets.exceptions import InvalidHandshake
 from websockets.handshake import check_request, build_response
 
-from .utils import TerminalColors, RainfallException, NotModified, match_dict_regexp, maybe_yield
-from .http import HTTPResponse, HTTPRequest, HTTPError, read_request, USER_AGENT
+from .utils import (
+    TerminalColors, RainfallException, NotModified, match_dict_regexp, maybe_yield, awaitable_iter
+)
+from .cache import CachedResponse
+from .etag import get_hash, make_etag, weak_etag, etag_matches
+from .templates import buffered, AsyncBuffered
+from .http import HTTPResponse, HTTPRequest, HTTPError, read_request, is_iterable_body, USER_AGENT
 
 
 class HTTPHandler:
@@ -30,9 +34,57 @@ class HTTPHandler:
 
     use_etag = True
 
+    # function(bytes) returning a hex digest to make ETags of str bodies with,
+    # or a name of rainfall.etag.HASHES, None means settings['etag_hash']
+    etag_hash = None
+
+    # if True, request body is not read before handle() is called,
+    # read it with request.stream instead
+    stream_request_body = False
+
+    # rainfall.cache.ResponseCache to keep rendered GET responses in,
+    # see rainfall.cache.cache_response
+    response_cache = None
+
+    # run regular (not coroutine) handle() in the executor pool,
+    # None means settings['run_in_executor']
+    run_in_executor = None
+
+    # max number of requests handled at once, the others wait
+    # or get 503, see rainfall.admission
+    max_in_flight = None
+
+    # seconds, handle() is cancelled after that and 503 is sent,
+    # None means settings['handler_timeout']
+    timeout = None
+
+    # if True, one instance is made when the server starts and serves
+    # all requests, concurrent ones too. Per-request state must not be
+    # kept on it, headers are set with request.response.set_header().
+    # None means settings['singleton_handlers']
+    singleton = None
+
+    _shared = False  # True for the instance of a singleton handler, see Application
+
     def __init__(self, settings=None):
         self.settings = settings or {}
-        self._headers = {}
+        self._headers = None  # request.response.headers, per-request instances only
+
+    @classmethod
+    def setup(cls, settings):
+        """
+        Is called once in every serving process before it starts
+        accepting connections, with the settings of the application.
+        Makes resources shared by requests (connection pools, precomputed data),
+        keep them on the class. May be an asyncio.coroutine.
+        """
+
+    @classmethod
+    def teardown(cls, settings):
+        """
+        Is called once when the serving process stops, to release
+        what :meth:`setup` made. May be an asyncio.coroutine.
+        """
 
     @asyncio.coroutine
     def handle(self, request, **kwargs):
@@ -42,10 +94,26 @@ class HTTPHandler:
         :param request: :class:`rainfall.http.HTTPRequest`
         :param kwargs: arguments from url if any
 
-        :rtype: str (may be rendered with self.render()) or :class:`rainfall.http.HTTPError`
+        :rtype: str (may be rendered with self.render()),
+            an iterable of str/bytes chunks (iterator, generator, async iterator),
+            which is streamed with Transfer-Encoding: chunked,
+            or :class:`rainfall.http.HTTPError`
         """
         raise NotImplementedError
 
+    def get_etag(self, request, **kwargs):
+        """
+        Is called before handle() if use_etag is on. Return a version,
+        an mtime, anything that changes with the content: it is sent
+        as a weak ETag and the body isn't hashed. If the client has it
+        already (If-None-Match), handle() isn't called: GET and HEAD get
+        304, other methods get 412 Precondition Failed (RFC 7232, 3.2).
+
+        None (the default) means the ETag is a hash of the body.
+        May be an asyncio.coroutine.
+        """
+        return None
+
     def set_header(self, header_name, header_value=None):
         """
         Set (and unset) a particular header for response
@@ -53,6 +121,10 @@ class HTTPHandler:
         :param header_name: Name of header to set
         :param header_value: Value of header to set; If None, unsets header.
         """
+        if self._headers is None:
+            raise RainfallException(
+                'Singleton handlers set headers with request.response.set_header()'
+            )
         if header_value is not None:
             self._headers[header_name] = header_value
         elif header_name in self._headers:
@@ -71,35 +143,142 @@ class HTTPHandler:
         result = template.render(kwargs)
         return result
 
+    @asyncio.coroutine
+    def render_async(self, template_name, **kwargs):
+        """
+        The same as render(), for coroutine handlers: renders with jinja's
+        render_async() if template_async setting is on, in the executor pool
+        if run_in_executor is on, so the loop isn't blocked.
+
+        useage: body = yield from self.render_async('page.html', a=1)
+        """
+        env = self.settings['jinja_env']
+        if getattr(env, 'is_async', False):
+            template = env.get_template(template_name)
+            return (yield from awaitable_iter(template.render_async(kwargs)))
+        if self._offloaded():
+            return (yield from self.settings['executor_pool'].run(
+                self.render, template_name, **kwargs
+            ))
+        return self.render(template_name, **kwargs)
+
+    def render_stream(self, template_name, **kwargs):
+        """
+        Renders a template piece by piece, return the result from handle()
+        to stream it to the client while it is being rendered.
+
+        :rtype: iterator of str (async iterator with template_async setting)
+        """
+        env = self.settings['jinja_env']
+        template = env.get_template(template_name)
+        if getattr(env, 'is_async', False):
+            return AsyncBuffered(template.generate_async(kwargs))
+        return buffered(template.generate(kwargs))
+
+    def _offloaded(self):
+        offload = self.run_in_executor
+        if offload is None:
+            offload = self.settings.get('run_in_executor')
+        return offload and 'executor_pool' in self.settings
+
+    @asyncio.coroutine
+    def _call_handle(self, request, kwargs):
+        if self._offloaded() and not asyncio.tasks.iscoroutinefunction(self.handle):
+            return (yield from self.settings['executor_pool'].run(
+                self.handle, request, **kwargs
+            ))
+        return (yield from maybe_yield(self.handle, request, **kwargs))
+
+    def _etag_hash(self):
+        if self.etag_hash is not None:
+            return get_hash(self.etag_hash)
+        return self.settings.get('etag_hasher') or get_hash()
+
     @asyncio.coroutine
     def __call__(self, request, **kwargs):
         """
         Is called by :class:`rainfall.web.RainfallProtocol`
 
-        :rtype: (code, headers, body)
+        :rtype: (code, headers, body), str bodies with an ETag
+            come encoded, as bytes
         """
         code = 200
         body = ''
+        headers = request.response.headers
+        if not self._shared:
+            self._headers = headers
+
+        etag_value = None
+        safe = request.method in ('GET', 'HEAD')
+        if self.use_etag and type(self).get_etag is not HTTPHandler.get_etag:
+            version = yield from maybe_yield(self.get_etag, request, **kwargs)
+            if version is not None:
+                etag_value = headers['ETag'] = weak_etag(version)
+                if etag_matches(request.headers.get('If-None-Match'), etag_value):
+                    if safe:
+                        raise NotModified(headers)
+                    # the method mustn't be performed, RFC 7232, 3.2
+                    return client.PRECONDITION_FAILED, headers, ''
 
-        handler_result = yield from maybe_yield(self.handle, request, **kwargs)
+        if self.response_cache is not None and request.method == 'GET':
+            rendered = []
+            entry = yield from self.response_cache.get_or_render(
+                self.response_cache.key(request),
+                lambda: self._render_cacheable(request, kwargs, rendered)
+            )
+            if entry is not None:
+                headers.update(entry.headers)
+                if entry.etag and etag_matches(request.headers.get('If-None-Match'), entry.etag):
+                    raise NotModified(headers)
+                return code, headers, entry.body
+            elif rendered:
+                handler_result = rendered[0]
+            else:
+                # somebody else's render wasn't cacheable, doing our own
+                handler_result = yield from self._call_handle(request, kwargs)
+        else:
+            handler_result = yield from self._call_handle(request, kwargs)
 
         if isinstance(handler_result, HTTPError):
             code = handler_result.code
         elif isinstance(handler_result, str):
             body = handler_result
-            if self.use_etag:
-                etag_value = '"' + \
-                    hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
-                self.set_header('ETag', etag_value)
-                if request.headers.get('If-None-Match') == etag_value:
-                    raise NotModified(self._headers)
+            if self.use_etag and etag_value is None:
+                # encoded once, for the hash and for the response
+                body = body.encode('utf-8')
+                etag_value = headers['ETag'] = make_etag(body, self._etag_hash())
+                if safe and etag_matches(request.headers.get('If-None-Match'), etag_value):
+                    raise NotModified(headers)
+        elif is_iterable_body(handler_result):
+            # streamed as is, nothing to compute etag from
+            body = handler_result
         else:
             raise RainfallException(
-                "handle() result must be rainfall.http.HttpError or str, found {}".format(
+                "handle() result must be rainfall.http.HttpError, str or iterable, found {}".format(
                     type(handler_result)
                 )
             )
-        return code, self._headers, body
+        return code, headers, body
+
+    @asyncio.coroutine
+    def _render_cacheable(self, request, kwargs, rendered):
+        """
+        Calls handle() for :attr:`response_cache`.
+
+        Returns :class:`rainfall.cache.CachedResponse` for str results,
+        other results are put to `rendered` list.
+        """
+        handler_result = yield from self._call_handle(request, kwargs)
+        if not isinstance(handler_result, str):
+            rendered.append(handler_result)
+            return None
+
+        body = handler_result.encode('utf-8')
+        headers = request.response.headers
+        etag_value = headers.get('ETag')  # from get_etag()
+        if self.use_etag and etag_value is None:
+            etag_value = headers['ETag'] = make_etag(body, self._etag_hash())
+        return CachedResponse(dict(headers), body, etag_value)
 
 
 class WSHandler:
@@ -107,9 +286,33 @@ class WSHandler:
     Used by RainfallProtocol to react for websocket url pattern.
     """
 
+    # outbound queue of the connection for broadcasts,
+    # None means settings['ws_send_queue_size'] and settings['ws_slow_consumer_policy']
+    send_queue_size = None
+    slow_consumer_policy = None
+
     def __init__(self, protocol):
         self.protocol = protocol
 
+    @classmethod
+    def setup(cls, settings):
+        """
+        The same as :meth:`HTTPHandler.setup`
+        """
+
+    @classmethod
+    def teardown(cls, settings):
+        """
+        The same as :meth:`HTTPHandler.teardown`
+        """
+
+    @property
+    def hub(self):
+        """
+        :class:`rainfall.hub.Hub` of the application
+        """
+        return self.protocol.settings['ws_hub']
+
     @asyncio.coroutine
     def send_message(self, message):
         """
@@ -117,6 +320,24 @@ class WSHandler:
         """
         yield from self.protocol.send(message)
 
+    def join(self, channel):
+        """
+        Subscribe this websocket to the channel's broadcasts.
+        Subscriptions are dropped when the websocket is closed.
+        """
+        self.hub.join(
+            channel, self.protocol, self.send_queue_size, self.slow_consumer_policy
+        )
+
+    def leave(self, channel):
+        self.hub.leave(channel, self.protocol)
+
+    def broadcast(self, channel, message, key=None):
+        """
+        Send a message to all websockets in the channel, see :meth:`rainfall.hub.Hub.broadcast`
+        """
+        return self.hub.broadcast(channel, message, key)
+
     @asyncio.coroutine
     def on_open(self):
         """
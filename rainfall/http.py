@@ -1,105 +1,580 @@
-import io
-import email
+import time
 import asyncio
 
-from urllib import parse
 from email.utils import formatdate
 from http import client
 from websockets.http import read_line
 
 from .utils import RainfallException
+from .forms import (
+    SPOOL_SIZE, MultiDict, MultipartParser, parse_query, parse_header_options, parse_cookies
+)
 
 
 MAX_HEADERS = 256
+MAX_HEADER_SIZE = 64 * 1024
 USER_AGENT = 'rainfall/python'
 
+# of Content-Length and chunk sizes, int() takes more (signs, underscores)
+DIGITS = '0123456789'
+HEX_DIGITS = b'0123456789abcdefABCDEF'
+
+# responses to these codes must not carry a body
+NO_BODY_CODES = (client.NO_CONTENT, client.NOT_MODIFIED)
+
 @asyncio.coroutine
-def read_message(stream):
-    """
-    Read an HTTP message from `stream`.
-    Return `(start_line, headers, body)` where `start_line` is :class:`bytes`.
-    `headers` is a :class:`~email.message.Message` and body is :class:`str`.
-
-    Copy of websocket.http.read_message with body support.
-    """
-    start_line = yield from read_line(stream)
-    header_lines = io.BytesIO()
-    for num in range(MAX_HEADERS):
-        header_line = yield from read_line(stream)
-        header_lines.write(header_line)
-        if header_line == b'\r\n':
-            break
-    else:
+def read_message(stream, max_size=MAX_HEADER_SIZE):
+    """
+    Read an HTTP message head from `stream`.
+    Return `(start_line, headers)` where `start_line` is :class:`bytes`
+    without the CRLF and `headers` is :class:`Headers`.
+
+    The whole head is read at once and split with plain bytes operations.
+    The body is left in `stream` to be read by :class:`RequestStream`.
+
+    Raise ValueError if the head is longer than `max_size` bytes
+    or has more than MAX_HEADERS headers.
+    """
+    try:
+        head = yield from stream.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise ValueError("Headers too large")
+    if len(head) > max_size:
+        raise ValueError("Headers too large")
+
+    # empty lines before the request line are allowed by RFC 7230
+    lines = head.lstrip(b'\r\n')[:-4].split(b'\r\n')
+    if len(lines) > MAX_HEADERS + 1:
         raise ValueError("Too many headers")
-    header_lines.seek(0)
-    headers = email.parser.BytesHeaderParser().parse(header_lines)
+    return lines[0], parse_headers(lines[1:])
+
+
+def parse_headers(lines):
+    """
+    Parse header lines (bytes without CRLF) into :class:`Headers`.
+    """
+    headers = Headers()
+    name = None
+    for line in lines:
+        if line[:1] in (b' ', b'\t'):
+            # obsolete line folding, continues the previous value
+            if name is None:
+                raise ValueError("Invalid header line")
+            headers.extend_last(' ' + line.strip().decode('latin-1'))
+            continue
+        name, sep, value = line.partition(b':')
+        if not sep or not name or name != name.strip():
+            raise ValueError("Invalid header line")
+        headers.add(name.decode('latin-1'), value.strip().decode('latin-1'))
+    return headers
+
+
+class Headers(object):
+    """
+    Case-insensitive multi-dict of HTTP headers.
+
+    Mapping methods work with the first value of a header,
+    :meth:`get_all` returns all of them.
+    """
+
+    __slots__ = ('_items', '_values')
+
+    def __init__(self, items=None):
+        self._items = []  # (name, value) in the original case and order
+        self._values = {}  # lowercased name -> list of values
+        if items:
+            for name, value in (items.items() if hasattr(items, 'items') else items):
+                self.add(name, value)
+
+    def add(self, name, value):
+        self._items.append((name, value))
+        self._values.setdefault(name.lower(), []).append(value)
+
+    def extend_last(self, value):
+        name, last = self._items[-1]
+        self._items[-1] = (name, last + value)
+        values = self._values[name.lower()]
+        values[-1] += value
+
+    def get(self, name, default=None):
+        values = self._values.get(name.lower())
+        return values[0] if values else default
 
-    # there's not EOF in case of POST, so using read() here
-    content_length = int(headers.get('Content-Length', 0))
-    body = yield from stream.read(content_length)
-    body = body.decode("utf-8")
+    def get_all(self, name):
+        return list(self._values.get(name.lower(), ()))
 
-    return start_line, headers, body
+    def __getitem__(self, name):
+        values = self._values.get(name.lower())
+        if not values:
+            raise KeyError(name)
+        return values[0]
+
+    def __contains__(self, name):
+        return name.lower() in self._values
+
+    def __iter__(self):
+        return (name for name, _ in self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        return [name for name, _ in self._items]
+
+    def values(self):
+        return [value for _, value in self._items]
+
+    def items(self):
+        return list(self._items)
+
+    def __repr__(self):
+        return 'Headers({!r})'.format(self._items)
 
 
 @asyncio.coroutine
-def read_request(stream):
+def read_request(stream, max_body_size=None, max_header_size=MAX_HEADER_SIZE):
     """
-    Read an HTTP/1.1 request from `stream`.
+    Read an HTTP/1.1 request head from `stream`.
 
-    Return `(method, uri, headers, body)` `uri` isn't URL-decoded.
+    Return `(method, uri, version, headers, body_stream)` `uri` isn't URL-decoded,
+    `body_stream` is a :class:`RequestStream`.
 
     Raise an exception if the request isn't well formatted.
+    """
+    request_line, headers = yield from read_message(stream, max_header_size)
+    method, uri, version = request_line.decode('latin-1').split(None, 2)
+    return method, uri, version, headers, RequestStream(stream, headers, max_body_size)
+
+
+class RequestStream(object):
+    """
+    Request body, read incrementally from the connection.
+    Available in handlers as :attr:`HTTPRequest.stream`.
+
+    Supports both Content-Length and Transfer-Encoding: chunked bodies.
+    Reading more than `max_size` bytes raises :class:`HTTPError` 413.
+
+    Example::
+
+        while True:
+            chunk = yield from request.stream.readchunk()
+            if not chunk:
+                break
+            upload.write(chunk)
+
+    :param reader: asyncio.StreamReader of the connection
+    :param headers: request headers
+    :param max_size: max body size in bytes, None for no limit
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, reader, headers, max_size=None):
+        self.reader = reader
+        self.max_size = max_size
+        self.chunked = 'chunked' in (headers.get('Transfer-Encoding') or '').lower()
+        if self.chunked:
+            self.length = None
+        else:
+            length = (headers.get('Content-Length') or '0').strip()
+            if not length or length.strip(DIGITS):
+                raise HTTPError(client.BAD_REQUEST)
+            self.length = int(length)
+        self.bytes_read = 0
+        self.at_eof = not self.chunked and not self.length
+        self._chunk_left = 0  # bytes left in the current chunk
+
+    @property
+    def too_large(self):
+        """
+        True if Content-Length is known to exceed max_size,
+        checked before anything is read.
+        """
+        return self.max_size is not None and \
+            self.length is not None and self.length > self.max_size
+
+    @asyncio.coroutine
+    def readchunk(self):
+        """
+        Read the next piece of body as it comes from the connection.
+
+        :rtype: bytes, b'' at the end of body
+        """
+        return (yield from self._read_some(self.chunk_size))
+
+    @asyncio.coroutine
+    def read(self, n=-1):
+        """
+        Read up to `n` bytes of body, all of it if `n` is -1.
+
+        :rtype: bytes, b'' at the end of body
+        """
+        if not self.chunked and n < 0 and not self.at_eof:
+            # known length, no need to go chunk by chunk
+            size = self.length - self.bytes_read
+            self._count(size)
+            data = yield from self.reader.readexactly(size)
+            self.at_eof = True
+            return data
+
+        chunks = []
+        size = 0
+        while n < 0 or size < n:
+            limit = self.chunk_size if n < 0 else min(self.chunk_size, n - size)
+            data = yield from self._read_some(limit)
+            if not data:
+                break
+            chunks.append(data)
+            size += len(data)
+        return b''.join(chunks)
+
+    @asyncio.coroutine
+    def _read_some(self, limit):
+        if self.at_eof:
+            return b''
+
+        if self.chunked:
+            if not self._chunk_left:
+                yield from self._read_chunk_size()
+                if self.at_eof:
+                    return b''
+            data = yield from self.reader.read(min(self._chunk_left, limit))
+            self._chunk_left -= len(data)
+            if data and not self._chunk_left:
+                if (yield from self.reader.readexactly(2)) != b'\r\n':
+                    raise HTTPError(client.BAD_REQUEST)
+        else:
+            data = yield from self.reader.read(min(self.length - self.bytes_read, limit))
+            if self.bytes_read + len(data) == self.length:
+                self.at_eof = True
+
+        if not data:
+            raise ValueError("Connection closed before the end of body")
+        self._count(len(data))
+        return data
+
+    @asyncio.coroutine
+    def _read_chunk_size(self):
+        line = yield from read_line(self.reader)
+        size = line.split(b';', 1)[0].strip()
+        if not size or size.strip(HEX_DIGITS):
+            raise HTTPError(client.BAD_REQUEST)
+        size = int(size, 16)
+        if size:
+            self._chunk_left = size
+            return
+        # last chunk, skipping trailers
+        while (yield from read_line(self.reader)) != b'\r\n':
+            pass
+        self.at_eof = True
+
+    def _count(self, size):
+        self.bytes_read += size
+        if self.max_size is not None and self.bytes_read > self.max_size:
+            raise HTTPError(client.REQUEST_ENTITY_TOO_LARGE)
+
+
+def is_iterable_body(body):
+    """
+    True for iterators, generators and async iterators that are sent
+    chunk by chunk, see :class:`HTTPResponse`.
+    """
+    return hasattr(body, '__aiter__') or (
+        hasattr(body, '__iter__') and not isinstance(body, (str, bytes))
+    )
+
+
+class FileBody(object):
+    """
+    Response body sent from a file with sendfile(), see
+    :class:`rainfall.static.StaticFileHandler`.
+
+    :param path: file to send
+    :param offset: where to start
+    :param count: how many bytes to send
+    """
+
+    __slots__ = ('path', 'offset', 'count')
+
+    def __init__(self, path, offset, count):
+        self.path = path
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        # an empty file is still a body, not a missing one
+        return True
+
+
+def encode_chunk(chunk):
+    """
+    Frame `chunk` bytes for Transfer-Encoding: chunked.
+    """
+    return '{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n'
+
+
+LAST_CHUNK = b'0\r\n\r\n'
+
+
+def should_keep_alive(version, headers):
+    """
+    Decide whether the connection may be reused after the response,
+    following the `Connection` header semantics of HTTP/1.0 and HTTP/1.1.
+    """
+    connection = (headers.get('Connection') or '').lower()
+    if version == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+class ResponseContext(object):
+    """
+    Per-request state of the response, ``request.response``.
 
-    Copy of websocket.http.read_request with body support.
+    Handlers set headers here rather than on themselves,
+    so one handler instance can serve concurrent requests
+    (see :attr:`rainfall.handlers.HTTPHandler.singleton`).
     """
-    request_line, headers, body = yield from read_message(stream)
-    method, uri, version = request_line[:-2].decode().split(None, 2)
-    return method, uri, headers, body
+
+    __slots__ = ('headers',)
+
+    def __init__(self):
+        self.headers = {}
+
+    def set_header(self, header_name, header_value=None):
+        """
+        Set (and unset) a particular header for response
+
+        :param header_name: Name of header to set
+        :param header_value: Value of header to set; If None, unsets header.
+        """
+        if header_value is not None:
+            self.headers[header_name] = header_value
+        else:
+            self.headers.pop(header_name, None)
 
 
 class HTTPRequest(object):
     """
     Rainfall implementation of the http request.
 
-    :param raw: raw text of full http request
+    The query string, the form body and cookies are parsed
+    on first access, once.
+
+    :param method: str
+    :param path: request target, with the query string
+    :param headers: :class:`Headers` (or a dict)
+    :param body: str, decoded body, if it is already known
+    :param stream: :class:`RequestStream` of the body
     """
-    def __init__(self, method, path, headers=None, body=None):
+
+    __slots__ = (
+        'response', 'headers', 'method', 'path', 'version', 'stream', 'raw_body',
+        '_path_info', '_query_string', '_body', '_GET', '_POST', '_FILES', '_cookies',
+    )
+
+    def __init__(self, method, path, headers=None, body=None, version='HTTP/1.1',
+                 stream=None):
+        self.response = ResponseContext()
         self.headers = headers or {}
-        self.body = body or ''
         self.method = method or ''
         self.path = path or ''
-        self.__GET = {}
-        self.__POST = {}
+        self.version = version
+        self.stream = stream
+        self.raw_body = b''
+        self._path_info = None
+        self._query_string = None
+        self._body = body
+        self._GET = None
+        self._POST = None
+        self._FILES = None
+        self._cookies = None
 
     @property
-    def POST(self):
+    def path_info(self):
         """
-        :rtype: dict, POST arguments
+        :rtype: str, path without the query string
         """
-        if not self.__POST and self.method == 'POST':
-            self.__POST = parse.parse_qs(self.body)
-            for k, v in self.__POST.items():
-                self.__POST[k] = v[0]
-        return self.__POST
+        if self._path_info is None:
+            self._path_info, _, self._query_string = self.path.partition('?')
+        return self._path_info
+
+    @property
+    def query_string(self):
+        """
+        :rtype: str, what follows ? in the path, '' if nothing
+        """
+        if self._path_info is None:
+            self._path_info, _, self._query_string = self.path.partition('?')
+        return self._query_string
+
+    @property
+    def body(self):
+        """
+        :rtype: str, request body decoded on first access.
+            Raw bytes are in raw_body, unless the handler reads
+            request.stream itself (see HTTPHandler.stream_request_body)
+            or the body is multipart/form-data, read to :attr:`POST`
+            and :attr:`FILES`.
+        """
+        if self._body is None:
+            self._body = self.raw_body.decode('utf-8')
+        return self._body
 
     @property
     def GET(self):
         """
-        :rtype: dict, GET arguments
+        :rtype: :class:`rainfall.forms.MultiDict`, query string arguments,
+            of any method
+        """
+        if self._GET is None:
+            self._GET = parse_query(self.query_string)
+        return self._GET
+
+    @property
+    def POST(self):
+        """
+        :rtype: :class:`rainfall.forms.MultiDict`, form fields of the body
+            (application/x-www-form-urlencoded or multipart/form-data),
+            of any method
+        """
+        if self._POST is None:
+            self._parse_body()
+        return self._POST
+
+    @property
+    def FILES(self):
+        """
+        :rtype: :class:`rainfall.forms.MultiDict` of
+            :class:`rainfall.forms.UploadedFile`, file parts of multipart/form-data
+        """
+        if self._FILES is None:
+            self._parse_body()
+        return self._FILES
+
+    @property
+    def cookies(self):
+        """
+        :rtype: dict, cookies from the Cookie header
         """
-        if not self.__GET and self.method == 'GET' and len(self.path.split('?')) == 2:
-            self.__GET = parse.parse_qs(self.path.split('?')[1])
-            for k, v in self.__GET.items():
-                self.__GET[k] = v[0]
-        return self.__GET
+        if self._cookies is None:
+            self._cookies = parse_cookies(self.headers.get('Cookie'))
+        return self._cookies
+
+    def multipart_parser(self, spool_size=SPOOL_SIZE):
+        """
+        :rtype: :class:`rainfall.forms.MultipartParser` for the body,
+            None if it isn't multipart/form-data
+        :raises: HTTPError(400) if there is no boundary
+        """
+        content_type, options = parse_header_options(self.headers.get('Content-Type') or '')
+        if content_type != 'multipart/form-data':
+            return None
+        try:
+            return MultipartParser(options.get('boundary', '').encode('latin-1'), spool_size)
+        except (ValueError, UnicodeEncodeError):
+            raise HTTPError(client.BAD_REQUEST)
+
+    @asyncio.coroutine
+    def read_form(self, spool_size=SPOOL_SIZE):
+        """
+        Reads a multipart/form-data body from :attr:`stream` to :attr:`POST`
+        and :attr:`FILES` chunk by chunk, file parts go to spooled
+        temporary files. Is called before handle() unless the handler
+        streams the body itself (then it may call it).
+
+        :raises: HTTPError(400) if the body is malformed
+        """
+        parser = self.multipart_parser(spool_size)
+        if parser is None:
+            self.raw_body = yield from self.stream.read()
+            return
+        try:
+            while True:
+                chunk = yield from self.stream.readchunk()
+                if not chunk:
+                    break
+                parser.feed(chunk)
+            parser.close()
+        except BaseException as exc:
+            # the body is too large, the client has gone, etc.
+            parser.discard()
+            if isinstance(exc, ValueError):
+                raise HTTPError(client.BAD_REQUEST)
+            raise
+        self._POST, self._FILES = parser.form, parser.files
+
+    def _parse_body(self):
+        self._FILES = MultiDict()
+        parser = self.multipart_parser()
+        if parser is not None:
+            try:
+                parser.feed(self.raw_body)
+                parser.close()
+            except ValueError:
+                raise HTTPError(client.BAD_REQUEST)
+            self._POST, self._FILES = parser.form, parser.files
+            return
+        content_type = (self.headers.get('Content-Type') or '').partition(';')[0].strip().lower()
+        if content_type in ('', 'application/x-www-form-urlencoded'):
+            self._POST = parse_query(self.body)
+        else:
+            self._POST = MultiDict()
+
+    def close(self):
+        """
+        Closes uploaded files, is called when the response is sent
+        """
+        if self._FILES:
+            for _, upload in self._FILES.all_items():
+                upload.close()
+
+
+def status_line(code):
+    """
+    b'HTTP/1.1 200 OK\r\n' for 200, cached per code.
+    """
+    line = _status_lines.get(code)
+    if line is None:
+        line = _status_lines[code] = 'HTTP/1.1 {} {}\r\n'.format(
+            int(code), client.responses[code]
+        ).encode('latin-1')
+    return line
+
+_status_lines = {}
+
+
+def http_date():
+    """
+    Date header value, formatted once per second.
+    """
+    now = int(time.time())
+    if now != _date_cache[0]:
+        _date_cache[0] = now
+        _date_cache[1] = formatdate(timeval=now, localtime=False, usegmt=True).encode('latin-1')
+    return _date_cache[1]
+
+_date_cache = [0, b'']
+
+
+def encode_header(name, value):
+    return '{}: {}\r\n'.format(name, value).encode('latin-1')
 
 
 class HTTPResponse(object):
     """
     Rainfall implementation of the http response.
 
-    :param body: response body
+    Serialized to bytes: status line and default headers are prepared once,
+    Date header is formatted once per second. Content-Length is always set
+    for non-streaming responses.
+
+    :param body: response body, str, bytes or an iterable of str/bytes chunks
+        (iterator, generator, async iterator), which is sent with
+        Transfer-Encoding: chunked
     :param code: response code
     :param additional_headers:
     """
@@ -114,25 +589,114 @@ class HTTPResponse(object):
         self.code = code
         self.headers = headers or {}
         self.additional_headers = None
+        self.keep_alive = False
+        self.chunked = True
+        self.bytes_sent = 0
+
+    @property
+    def streaming(self):
+        """
+        True if the body is sent chunk by chunk
+        """
+        return is_iterable_body(self.body)
 
     def compose(self):
         """
         Composes http response from code, headers and body
 
-        :rtype: str, composed http response
+        :rtype: bytes, composed http response
         """
-        header = 'HTTP/1.1 {code} {name}\r\n'.format(
-            code=self.code, name=client.responses[self.code]
-        )
-        self.headers.update(self._default_headers)
-        self.headers.update(
-            Date=formatdate(timeval=None, localtime=False, usegmt=True)
-        )
+        return b''.join(self.compose_parts())
+
+    def compose_parts(self, head_only=False):
+        """
+        :param head_only: for HEAD requests, Content-Length is the one
+            of the body, but the body is b''
+        :rtype: (head, body) bytes, body is encoded with utf-8 if it's a str
+        """
+        body = b'' if self.code in NO_BODY_CODES else self.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        head = self.compose_head(len(body))
+        return head, b'' if head_only else body
+
+    def write(self, writer, head_only=False):
+        """
+        Writes the whole response to asyncio.StreamWriter at once,
+        only status line and headers with `head_only`
+        """
+        head, body = self.compose_parts(head_only)
+        writer.writelines((head, body))
+        self.bytes_sent = len(head) + len(body)
+
+    def compose_head(self, content_length=None):
+        """
+        Composes status line and headers, for streaming responses
+        the body is written separately.
+
+        :param content_length: body length in bytes, None for streaming responses
+        :rtype: bytes
+        """
+        headers = self.headers
         if self.additional_headers:
-            self.headers.update(self.additional_headers)
-        for head, value in self.headers.items():
-            header += '{}: {}\r\n'.format(head, value)
-        return '{}\r\n{}'.format(header, self.body)
+            headers = dict(headers, **self.additional_headers)
+
+        parts = [status_line(self.code)]
+        names = set()
+        for name, value in headers.items():
+            parts.append(encode_header(name, value))
+            names.add(name.lower())
+
+        if names.isdisjoint(self._default_names()):
+            parts.append(self._default_head())
+        else:
+            # headers set by the handler win, whatever their case
+            for name, value in self._default_headers.items():
+                if name.lower() not in names:
+                    parts.append(encode_header(name, value))
+
+        parts.append(b'Date: ' + http_date() + b'\r\n')
+
+        if self.code in NO_BODY_CODES:
+            pass
+        elif content_length is not None:
+            parts.append(b'Content-Length: ' + str(content_length).encode() + b'\r\n')
+        elif self.chunked:
+            parts.append(b'Transfer-Encoding: chunked\r\n')
+
+        parts.append(
+            b'Connection: keep-alive\r\n\r\n' if self.keep_alive else b'Connection: close\r\n\r\n'
+        )
+        return b''.join(parts)
+
+    def check_headers(self):
+        """
+        Raises ValueError (UnicodeEncodeError) if a header can't be sent:
+        header lines are latin-1
+        """
+        for name, value in self.headers.items():
+            encode_header(name, value)
+
+    @classmethod
+    def _default_names(cls):
+        # lowercased, cached per class like _default_head()
+        names = cls.__dict__.get('_default_names_set')
+        if names is None:
+            names = cls._default_names_set = frozenset(
+                name.lower() for name in cls._default_headers
+            )
+        return names
+
+    @classmethod
+    def _default_head(cls):
+        # cached per class, subclasses may have their own _default_headers
+        head = cls.__dict__.get('_default_head_bytes')
+        if head is None:
+            head = b''.join(
+                encode_header(name, value) for name, value in cls._default_headers.items()
+            )
+            cls._default_head_bytes = head
+        return head
 
 
 class HTTPError(RainfallException):
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+
+from collections import deque
+from websockets.framing import OP_TEXT, OP_BINARY
+
+from .websocket import encode_frame as _encode_frame
+
+
+logger = logging.getLogger(__name__)
+
+DROP = 'drop'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP, COALESCE, DISCONNECT)
+
+
+def encode_frame(message):
+    """
+    Serializes a message to a server (unmasked) websocket frame,
+    ready to be written to any number of connections.
+    It's never compressed, permessage-deflate allows that.
+
+    :param message: str for a text frame, bytes for a binary one
+    :rtype: bytes
+    """
+    if isinstance(message, str):
+        return _encode_frame(OP_TEXT, message.encode('utf-8'))
+    elif isinstance(message, bytes):
+        return _encode_frame(OP_BINARY, message)
+    raise TypeError("message must be bytes or str")
+
+
+class Subscriber(object):
+    """
+    Outbound queue of one websocket connection.
+
+    Frames are written by a task of its own, so a slow client holds back
+    nobody but itself. When `max_size` frames are waiting, `policy` decides:
+
+    * drop - new frames are dropped
+    * coalesce - a frame replaces the queued one with the same key,
+      without a key (or a queued match) the oldest queued frame is dropped
+    * disconnect - the connection is closed with 1008
+
+    :param protocol: :class:`rainfall.web.RainfallProtocol`
+    """
+
+    def __init__(self, protocol, max_size=64, policy=DROP):
+        if policy not in POLICIES:
+            raise ValueError('Unknown slow consumer policy: {}'.format(policy))
+        self.protocol = protocol
+        self.max_size = max_size
+        self.policy = policy
+        self.channels = set()
+        self.queue = deque()  # (key, frame bytes)
+        self.dropped = 0
+        self.disconnecting = False
+        self._task = None
+
+    def put(self, frame, key=None):
+        """
+        Queues an encoded frame, returns False if it was dropped
+        """
+        if self.protocol.state != 'OPEN' or self.disconnecting:
+            return False
+
+        if key is not None and self.policy == COALESCE:
+            for i, (queued_key, _) in enumerate(self.queue):
+                if queued_key == key:
+                    self.queue[i] = (key, frame)
+                    self.dropped += 1
+                    return True
+
+        if len(self.queue) >= self.max_size:
+            self.dropped += 1
+            if self.policy == DROP:
+                return False
+            elif self.policy == COALESCE:
+                self.queue.popleft()
+            else:
+                self.queue.clear()
+                self.disconnecting = True
+                logger.info('Disconnecting slow websocket consumer')
+                asyncio.ensure_future(self.protocol.fail_connection(1008, 'slow consumer'))
+                return False
+
+        self.queue.append((key, frame))
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._write())
+        return True
+
+    @asyncio.coroutine
+    def _write(self):
+        writer = self.protocol.writer
+        try:
+            while self.queue and self.protocol.state == 'OPEN':
+                _, frame = self.queue.popleft()
+                writer.write(frame)
+                yield from writer.drain()
+        except ConnectionResetError:
+            self.queue.clear()
+        finally:
+            self._task = None
+
+
+class Hub(object):
+    """
+    Registry of websocket connections subscribed to named channels.
+
+    :meth:`broadcast` encodes a message once and queues the same frame
+    to every subscriber, see :class:`Subscriber` for what happens
+    when a client doesn't keep up.
+
+    One hub is created by :class:`rainfall.web.Application` as `ws_hub` setting,
+    it only knows about the connections of its own process.
+
+    :param max_size: default size of a subscriber queue
+    :param policy: default slow consumer policy
+    """
+
+    def __init__(self, max_size=64, policy=DROP):
+        self.max_size = max_size
+        self.policy = policy
+        self.channels = {}  # channel -> set of Subscriber
+        self.subscribers = {}  # protocol -> Subscriber
+
+    def join(self, channel, protocol, max_size=None, policy=None):
+        """
+        Subscribes the connection to the channel. Queue size and policy
+        are taken on the first join of the connection.
+        """
+        subscriber = self.subscribers.get(protocol)
+        if subscriber is None:
+            subscriber = self.subscribers[protocol] = Subscriber(
+                protocol,
+                self.max_size if max_size is None else max_size,
+                policy or self.policy,
+            )
+        subscriber.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def leave(self, channel, protocol):
+        subscriber = self.subscribers.get(protocol)
+        if subscriber is None or channel not in subscriber.channels:
+            return
+        subscriber.channels.discard(channel)
+        self._discard(channel, subscriber)
+        if not subscriber.channels:
+            del self.subscribers[protocol]
+
+    def leave_all(self, protocol):
+        """
+        Unsubscribes the connection from everything, is called when it's closed
+        """
+        subscriber = self.subscribers.pop(protocol, None)
+        if subscriber is None:
+            return
+        for channel in subscriber.channels:
+            self._discard(channel, subscriber)
+        subscriber.channels.clear()
+
+    def broadcast(self, channel, message, key=None):
+        """
+        Sends message to all subscribers of the channel without waiting for them.
+
+        :param message: str or bytes
+        :param key: messages with the same key replace each other
+            in the queues of coalescing subscribers
+        :rtype: number of subscribers the message was queued to
+        """
+        subscribers = self.channels.get(channel)
+        if not subscribers:
+            return 0
+        frame = encode_frame(message)
+        return sum(subscriber.put(frame, key) for subscriber in list(subscribers))
+
+    def count(self, channel):
+        """
+        Number of subscribers of the channel
+        """
+        return len(self.channels.get(channel, ()))
+
+    def _discard(self, channel, subscriber):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[channel]
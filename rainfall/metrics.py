@@ -0,0 +1,166 @@
+import asyncio
+
+from bisect import bisect_left
+
+from .handlers import HTTPHandler
+
+
+# seconds, the same as prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, cumulative counts are
+    computed only when the histogram is exposed.
+
+    :param buckets: sorted upper bounds, +Inf is implied
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :rtype: list of (upper bound str, cumulative count)
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append(('+Inf' if bound == float('inf') else repr(float(bound)), total))
+        return result
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """
+    Request and connection metrics of one process, exposed in Prometheus
+    text format by :class:`MetricsHandler`.
+
+    Requests are recorded by :class:`rainfall.web.RainfallProtocol`, labelled
+    with the url pattern of the route (not the path, the number of series
+    must not depend on the clients).
+
+    :param buckets: latency histogram buckets, seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.requests = {}  # (route, method, code) -> count
+        self.latency = {}  # route -> Histogram
+        self.bytes_in = {}  # route -> bytes
+        self.bytes_out = {}  # route -> bytes
+        self.http_connections = 0
+        self.ws_connections = 0
+        self.requests_in_flight = 0
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+
+    def observe_request(self, route, method, code, duration, bytes_in, bytes_out):
+        key = (route, method, code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = Histogram(self.buckets)
+        histogram.observe(duration)
+
+        self.bytes_in[route] = self.bytes_in.get(route, 0) + bytes_in
+        self.bytes_out[route] = self.bytes_out.get(route, 0) + bytes_out
+
+    @asyncio.coroutine
+    def watch_loop(self, interval=1):
+        """
+        Measures how late the loop wakes up a sleeping coroutine,
+        i.e. how long callbacks block it.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            yield from asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+    def render(self):
+        """
+        :rtype: str, metrics in Prometheus text format 0.0.4
+        """
+        lines = []
+        add = lines.append
+
+        add('# HELP rainfall_http_requests_total HTTP requests by route, method and status code.')
+        add('# TYPE rainfall_http_requests_total counter')
+        for (route, method, code), count in sorted(self.requests.items()):
+            add('rainfall_http_requests_total{{route="{}",method="{}",code="{}"}} {}'.format(
+                escape_label(route), escape_label(method), code, count
+            ))
+
+        add('# HELP rainfall_http_request_duration_seconds Time from the request head to the response sent.')
+        add('# TYPE rainfall_http_request_duration_seconds histogram')
+        for route, histogram in sorted(self.latency.items()):
+            self._histogram(add, 'rainfall_http_request_duration_seconds', histogram,
+                            'route="{}",'.format(escape_label(route)))
+
+        for name, help_text, values in (
+            ('rainfall_http_request_body_bytes_total', 'Request body bytes read.', self.bytes_in),
+            ('rainfall_http_response_bytes_total', 'Response bytes written.', self.bytes_out),
+        ):
+            add('# HELP {} {}'.format(name, help_text))
+            add('# TYPE {} counter'.format(name))
+            for route, value in sorted(values.items()):
+                add('{}{{route="{}"}} {}'.format(name, escape_label(route), value))
+
+        for name, help_text, value in (
+            ('rainfall_http_connections', 'Open HTTP connections.', self.http_connections),
+            ('rainfall_ws_connections', 'Open websocket connections.', self.ws_connections),
+            ('rainfall_http_requests_in_flight', 'Requests being handled.', self.requests_in_flight),
+        ):
+            add('# HELP {} {}'.format(name, help_text))
+            add('# TYPE {} gauge'.format(name))
+            add('{} {}'.format(name, value))
+
+        add('# HELP rainfall_event_loop_lag_seconds How late the event loop runs scheduled callbacks.')
+        add('# TYPE rainfall_event_loop_lag_seconds histogram')
+        self._histogram(add, 'rainfall_event_loop_lag_seconds', self.loop_lag)
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, add, name, histogram, labels=''):
+        for bound, count in histogram.cumulative():
+            add('{}_bucket{{{}le="{}"}} {}'.format(name, labels, bound, count))
+        labels = '{' + labels.rstrip(',') + '}' if labels else ''
+        add('{}_sum{} {}'.format(name, labels, repr(histogram.sum)))
+        add('{}_count{} {}'.format(name, labels, histogram.count))
+
+
+class MetricsHandler(HTTPHandler):
+    """
+    Exposes :class:`Metrics` of the process for Prometheus::
+
+        app = Application({
+            r'^/metrics$': MetricsHandler,
+        })
+    """
+
+    use_etag = False
+    singleton = True
+
+    def handle(self, request):
+        request.response.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        metrics = self.settings.get('metrics_registry')
+        if metrics is None:
+            return ''
+        return metrics.render()
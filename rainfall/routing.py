@@ -0,0 +1,130 @@
+import re
+from collections import OrderedDict
+
+
+REGEXP_CHARS = set('.^$*+?{}[]\\|()')
+
+
+def split_pattern(pattern):
+    """
+    Split url pattern into its literal prefix and the rest.
+
+    Return (prefix, is_static), is_static is True when the whole pattern
+    is a literal anchored with ^ and $, so it matches exactly one path.
+    """
+    if '|' in pattern:
+        # alternatives may start with anything
+        return '', False
+
+    body = pattern[1:] if pattern.startswith('^') else pattern
+    anchored = body.endswith('$') and not body.endswith('\\$')
+    if anchored:
+        body = body[:-1]
+
+    prefix = []
+    for char in body:
+        if char in REGEXP_CHARS:
+            # a quantifier applies to the previous char, it is not literal
+            if char in '*+?{' and prefix:
+                prefix.pop()
+            return ''.join(prefix), False
+        prefix.append(char)
+    return body, anchored
+
+
+def first_segment(path):
+    """
+    '/param/2' -> '/param'
+    """
+    end = path.find('/', 1)
+    return path if end == -1 else path[:end]
+
+
+class Router(object):
+    """
+    Maps url patterns to handlers, is built once by
+    :class:`rainfall.web.Application`.
+
+    Patterns are regular expressions matched with re.match, like before.
+    Literal patterns (e.g. ``r'^/about$'``) are found by a dict lookup,
+    the others are indexed by the first segment of their literal prefix,
+    so a path is only checked against the patterns that may match it.
+
+    Precedence is deterministic and doesn't depend on the dict order:
+    literal patterns first, then patterns with a longer literal prefix,
+    then the pattern text itself.
+
+    :param handlers: dict with url patterns as keys
+    :param cache_size: how many resolved paths to remember
+    """
+
+    def __init__(self, handlers, cache_size=1024):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._static = {}
+        self._segments = {}
+        self._fallback = []
+
+        dynamic = []
+        for pattern, handler in handlers.items():
+            regexp = re.compile(pattern)
+            prefix, is_static = split_pattern(pattern)
+            if is_static and prefix not in self._static:
+                self._static[prefix] = (handler, regexp)
+            else:
+                dynamic.append((-len(prefix), pattern, prefix, regexp, handler))
+
+        for _, pattern, prefix, regexp, handler in sorted(dynamic, key=lambda r: r[:2]):
+            segment = first_segment(prefix)
+            if prefix.startswith('/') and len(segment) < len(prefix):
+                # prefix holds the whole first segment, so does every
+                # path the pattern matches
+                self._segments.setdefault(segment, []).append((regexp, handler))
+            else:
+                self._fallback.append((regexp, handler))
+
+    def match(self, path):
+        """
+        The same as :func:`rainfall.utils.match_dict_regexp`.
+
+        Return (handler, match_result) or (None, None) if nothing matches.
+        """
+        try:
+            result = self._cache[path]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(path)
+            return result
+
+        result = self.resolve(path)
+        if self.cache_size:
+            self._cache[path] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def resolve(self, path):
+        """
+        Uncached version of :meth:`match`.
+        """
+        static = self._static.get(path)
+        if static is not None:
+            handler, regexp = static
+            return handler, regexp.match(path)
+
+        for regexp, handler in self._segments.get(first_segment(path), ()):
+            result = regexp.match(path)
+            if result:
+                return handler, result
+
+        for regexp, handler in self._fallback:
+            result = regexp.match(path)
+            if result:
+                return handler, result
+        return None, None
+
+    def __len__(self):
+        return len(self._static) + len(self._fallback) + sum(
+            len(routes) for routes in self._segments.values()
+        )
@@ -0,0 +1,253 @@
+import os
+import stat
+import time
+import asyncio
+import mimetypes
+
+from http import client
+from urllib import parse
+from email.utils import formatdate, parsedate_to_datetime
+
+from .handlers import HTTPHandler
+from .http import FileBody, HTTPError
+from .utils import NotModified
+from .etag import etag_matches
+from .compression import choose_encoding
+
+
+# pre-compressed siblings, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class FileInfo(object):
+    """
+    What :class:`StatCache` knows about a file.
+
+    ETag and Last-Modified are built from mtime and size,
+    the file content is never read to make them.
+    """
+
+    __slots__ = ('path', 'size', 'mtime', 'etag', 'last_modified', 'content_type', 'encoded')
+
+    def __init__(self, path, st, content_type):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.etag = '"{:x}-{:x}"'.format(self.mtime, self.size)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.content_type = content_type
+        self.encoded = {}  # encoding -> FileInfo of a pre-compressed sibling
+
+
+class StatCache(object):
+    """
+    Keeps stat() results and headers of static files for `ttl` seconds,
+    so that a hot file costs no system calls but sendfile().
+
+    :param ttl: seconds a stat() result is trusted
+    :param max_size: max number of files, the cache is cleared when it's full
+    """
+
+    def __init__(self, ttl=1, max_size=4096):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}  # path -> (checked_at, FileInfo or None)
+
+    def get(self, path):
+        """
+        :rtype: :class:`FileInfo` or None if there is no such regular file
+        """
+        now = time.monotonic()
+        entry = self._entries.get(path)
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry[1]
+
+        info = self._stat(path)
+        if info is not None:
+            for encoding, suffix in ENCODINGS:
+                sibling = self._stat(path + suffix, info.content_type)
+                if sibling is not None:
+                    # a stale sibling is worse than none
+                    if sibling.mtime >= info.mtime:
+                        info.encoded[encoding] = sibling
+
+        if len(self._entries) >= self.max_size:
+            self._entries.clear()
+        self._entries[path] = (now, info)
+        return info
+
+    def clear(self):
+        self._entries.clear()
+
+    def _stat(self, path, content_type=None):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if content_type is None:
+            content_type, _ = mimetypes.guess_type(path)
+            content_type = content_type or 'application/octet-stream'
+            if content_type.startswith('text/') or content_type == 'application/javascript':
+                content_type += '; charset=utf-8'
+        return FileInfo(path, st, content_type)
+
+
+def parse_range(header, size):
+    """
+    Parses a single byte range of Range header.
+
+    :rtype: (start, end) with end not included, None if the header is not
+        a single byte range and should be ignored
+    :raises: ValueError if the range is not satisfiable
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        # multipart/byteranges are not supported, the whole file is sent
+        return None
+    first, sep, last = (part.strip() for part in ranges.partition('-'))
+    if not sep or not (first + last).isdigit():
+        return None  # garbage is ignored
+    if not first:
+        # the last N bytes
+        if not int(last):
+            raise ValueError('Empty suffix range')
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last) + 1, size) if last else size
+    if start >= size:
+        raise ValueError('Range starts after the end of file')
+    return start, end
+
+
+class StaticFileHandler(HTTPHandler):
+    """
+    Serves files from `root` (or `static_path` setting) with sendfile().
+
+    Supports conditional GET by mtime and size, single range Range requests
+    and pre-compressed .br/.gz siblings of the files.
+
+    The url pattern must have a `path` group::
+
+        app = Application({
+            r'^/static/(?P<path>.*)$': StaticFileHandler,
+        }, settings={'static_path': '/var/www/static'})
+    """
+
+    # directory to serve, None means settings['static_path']
+    root = None
+
+    # Cache-Control max-age, seconds, None for no header
+    max_age = None
+
+    # shared by all StaticFileHandler subclasses, see static_stat_ttl setting
+    stat_cache = None
+
+    # keeps no per-request state
+    singleton = True
+
+    def get_root(self):
+        return os.path.abspath(self.root or self.settings['static_path'])
+
+    def get_stat_cache(self):
+        cls = type(self)
+        if cls.stat_cache is None:
+            StaticFileHandler.stat_cache = StatCache(self.settings.get('static_stat_ttl', 1))
+        return cls.stat_cache
+
+    def resolve(self, path):
+        """
+        :param path: as it came in the url, percent-encoded
+        :rtype: absolute path of the requested file
+        :raises: HTTPError(404) if it's outside of the root
+        """
+        # decoded before the check, so that %2e%2e is seen as ..
+        path = parse.unquote(path)
+        if '\x00' in path:
+            raise HTTPError(client.NOT_FOUND)
+        root = self.get_root()
+        full_path = os.path.abspath(os.path.join(root, path.lstrip('/')))
+        if full_path != root and not full_path.startswith(root + os.sep):
+            raise HTTPError(client.NOT_FOUND)
+        return full_path
+
+    def handle(self, request, path=''):
+        info = self.get_stat_cache().get(self.resolve(path))
+        if info is None:
+            raise HTTPError(client.NOT_FOUND)
+
+        response = request.response
+        range_header = request.headers.get('Range')
+        if info.encoded:
+            response.set_header('Vary', 'Accept-Encoding')
+            # Range requests are answered from the original file only
+            if not range_header:
+                encoding = choose_encoding(
+                    request.headers.get('Accept-Encoding') or '',
+                    [encoding for encoding, _ in ENCODINGS if encoding in info.encoded],
+                )
+                if encoding is not None:
+                    response.set_header('Content-Encoding', encoding)
+                    info = info.encoded[encoding]
+
+        response.set_header('Content-Type', info.content_type)
+        response.set_header('ETag', info.etag)
+        response.set_header('Last-Modified', info.last_modified)
+        response.set_header('Accept-Ranges', 'bytes')
+        if self.max_age is not None:
+            response.set_header('Cache-Control', 'max-age={}'.format(self.max_age))
+
+        if self.not_modified(request, info):
+            raise NotModified(response.headers)
+
+        if range_header and self.if_range(request, info):
+            try:
+                byte_range = parse_range(range_header, info.size)
+            except ValueError:
+                response.set_header('Content-Range', 'bytes */{}'.format(info.size))
+                return client.REQUESTED_RANGE_NOT_SATISFIABLE, None
+            if byte_range is not None:
+                start, end = byte_range
+                response.set_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, info.size))
+                return client.PARTIAL_CONTENT, FileBody(info.path, start, end - start)
+
+        return client.OK, FileBody(info.path, 0, info.size)
+
+    def not_modified(self, request, info):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag_matches(if_none_match, info.etag)
+
+        if_modified_since = request.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return info.mtime <= since
+        return False
+
+    def if_range(self, request, info):
+        """
+        False if If-Range says the client has another version of the file
+        """
+        if_range = request.headers.get('If-Range')
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == info.etag
+        return if_range == info.last_modified
+
+    @asyncio.coroutine
+    def __call__(self, request, path='', **kwargs):
+        """
+        :rtype: (code, headers, :class:`rainfall.http.FileBody` or None)
+        """
+        if request.method not in ('GET', 'HEAD'):
+            raise HTTPError(client.METHOD_NOT_ALLOWED)
+        code, body = self.handle(request, path)
+        return code, request.response.headers, body
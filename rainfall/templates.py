@@ -0,0 +1,111 @@
+import asyncio
+import logging
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+from .utils import awaitable_iter
+
+
+logger = logging.getLogger(__name__)
+
+# streamed templates are sent in pieces of about this size
+STREAM_BUFFER_SIZE = 8 * 1024
+
+
+def create_environment(settings):
+    """
+    Creates jinja2 Environment from Application settings:
+
+    * template_path - where templates are
+    * template_cache_path - directory for the compiled templates bytecode,
+      so that workers don't compile templates on every start
+    * template_auto_reload - check templates mtime and reload changed ones,
+      turn it off in production
+    * template_async - enable_async, for :meth:`rainfall.web.HTTPHandler.render_async`
+    * template_precompile - compile all templates with template_extensions at startup
+    """
+    options = {
+        'loader': FileSystemLoader(settings.get('template_path') or ''),
+        'auto_reload': settings['template_auto_reload'],
+        # templates are precompiled, keep them all
+        'cache_size': -1,
+    }
+    if settings['template_cache_path']:
+        options['bytecode_cache'] = FileSystemBytecodeCache(settings['template_cache_path'])
+    if settings['template_async']:
+        # only jinja2 >= 2.9 knows about it
+        options['enable_async'] = True
+
+    env = Environment(**options)
+    if settings.get('template_path') and settings['template_precompile']:
+        precompile(env, settings['template_extensions'])
+    return env
+
+
+def precompile(env, extensions=None):
+    """
+    Loads (and compiles) every template of env, so that the first
+    requests don't pay for it. Returns the number of templates.
+    """
+    names = env.list_templates(extensions=extensions)
+    for name in names:
+        env.get_template(name)
+    logger.debug('{} templates precompiled'.format(len(names)))
+    return len(names)
+
+
+def buffered(chunks, size=STREAM_BUFFER_SIZE):
+    """
+    Joins small chunks of Template.generate() into pieces of about `size`,
+    so that a streamed response isn't sent by a few bytes at a time.
+    """
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class AsyncBuffered(object):
+    """
+    :func:`buffered` for Template.generate_async()
+    """
+
+    def __init__(self, chunks, size=STREAM_BUFFER_SIZE):
+        self.chunks = chunks.__aiter__()
+        self.size = size
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+
+        buffer = []
+        length = 0
+        while length < self.size:
+            try:
+                chunk = yield from awaitable_iter(self.chunks.__anext__())
+            except StopAsyncIteration:
+                self.done = True
+                break
+            buffer.append(chunk)
+            length += len(chunk)
+
+        if not buffer:
+            raise StopAsyncIteration
+        return ''.join(buffer)
+
+    @asyncio.coroutine
+    def aclose(self):
+        if hasattr(self.chunks, 'aclose'):
+            yield from awaitable_iter(self.chunks.aclose())
@@ -1,8 +1,12 @@
 import os
 import asyncio
+import threading
 
 from rainfall.web import Application, HTTPHandler, WSHandler
 from rainfall.http import HTTPError
+from rainfall.cache import cache_response
+from rainfall.static import StaticFileHandler
+from rainfall.metrics import MetricsHandler
 
 
 class HelloHandler(HTTPHandler):
@@ -17,6 +21,12 @@ class TemplateHandler(HTTPHandler):
         return self.render('base.html', text='Rendered')
 
 
+class StreamTemplateHandler(HTTPHandler):
+
+    def handle(self, request):
+        return self.render_stream('base.html', text='Streamed')
+
+
 class HTTPErrorHandler(HTTPHandler):
 
     def handle(self, request):
@@ -37,6 +47,32 @@ class SleepHandler(HTTPHandler):
         return 'Done'
 
 
+class PidHandler(HTTPHandler):
+
+    def handle(self, request):
+        return str(os.getpid())
+
+
+class LimitedHandler(HTTPHandler):
+
+    max_in_flight = 1
+
+    @asyncio.coroutine
+    def handle(self, request):
+        yield from asyncio.sleep(0.3)
+        return 'Done'
+
+
+class TimeoutHandler(HTTPHandler):
+
+    timeout = 0.05
+
+    @asyncio.coroutine
+    def handle(self, request):
+        yield from asyncio.sleep(10)
+        return 'Done'
+
+
 class ParamHandler(HTTPHandler):
 
     def handle(self, request, number):
@@ -61,6 +97,16 @@ class PostFormHandler(HTTPHandler):
         return self.render('form.html', method='POST', data=data)
 
 
+class MultipartHandler(HTTPHandler):
+
+    def handle(self, request):
+        upload = request.FILES['upload']
+        return '{} {} {} {}'.format(
+            request.POST['name'], ','.join(request.POST.get_all('tag')),
+            upload.filename, len(upload.read()),
+        )
+
+
 class EtagHandler(HTTPHandler):
 
     use_etag = True
@@ -70,6 +116,128 @@ class EtagHandler(HTTPHandler):
         return self.payload
 
 
+class VersionedHandler(HTTPHandler):
+
+    version = 'v2'
+    renders = 0
+
+    def get_etag(self, request):
+        return self.version
+
+    def handle(self, request):
+        VersionedHandler.renders += 1
+        return 'Render {}'.format(VersionedHandler.renders)
+
+
+class ReleaseHandler(HTTPHandler):
+    """
+    Pages with the version of the release as ETag
+    """
+
+    def get_etag(self, request, page):
+        return 'release-1'
+
+    def handle(self, request, page):
+        return 'Page {} '.format(page) * 50
+
+
+class StreamHandler(HTTPHandler):
+
+    def handle(self, request):
+        for number in range(3):
+            yield 'chunk {}\n'.format(number)
+
+
+class AsyncChunks:
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        yield from asyncio.sleep(0)
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncStreamHandler(HTTPHandler):
+
+    @asyncio.coroutine
+    def handle(self, request):
+        return AsyncChunks([b'async ', 'chunks'])
+
+
+class UploadHandler(HTTPHandler):
+
+    stream_request_body = True
+
+    @asyncio.coroutine
+    def handle(self, request):
+        size = 0
+        while True:
+            chunk = yield from request.stream.readchunk()
+            if not chunk:
+                break
+            size += len(chunk)
+        return str(size)
+
+
+@cache_response(ttl=60, query_params=('page',))
+class CachedHandler(HTTPHandler):
+
+    renders = 0
+
+    def handle(self, request):
+        CachedHandler.renders += 1
+        return 'Render {}'.format(CachedHandler.renders)
+
+
+class BlockingHandler(HTTPHandler):
+
+    run_in_executor = True
+
+    def handle(self, request):
+        if threading.current_thread() is threading.main_thread():
+            return 'Main thread'
+        return self.render('base.html', text='Offloaded')
+
+
+class SingletonHandler(HTTPHandler):
+
+    singleton = True
+    greeting = None
+
+    @classmethod
+    def setup(cls, settings):
+        cls.greeting = 'Set up once'
+
+    @asyncio.coroutine
+    def handle(self, request):
+        request.response.set_header('X-Instance', str(id(self)))
+        yield from asyncio.sleep(0.05)
+        return self.greeting
+
+
+class LowercaseHeaderHandler(HTTPHandler):
+
+    def handle(self, request):
+        self.set_header('content-type', 'text/plain')
+        return 'Plain'
+
+
+class UnicodeHeaderHandler(HTTPHandler):
+
+    def handle(self, request):
+        # not latin-1
+        self.set_header('X-Name', '\u0410\u043d\u0442\u043e\u043d')
+        return 'Unicode'
+
+
 class EchoWSHandler(WSHandler):
 
     @asyncio.coroutine
@@ -79,6 +247,12 @@ class EchoWSHandler(WSHandler):
 
 settings = {
     'template_path': os.path.join(os.path.dirname(__file__), "templates"),
+    'static_path': os.path.join(os.path.dirname(__file__), "static"),
+    'compression': True,
+    'compression_min_size': 100,
+    'ws_deflate': True,
+    'ws_max_message_size': 64 * 1024,
+    'request_queue_timeout': 0.1,
     'host': '127.0.0.1',
 }
 
@@ -86,18 +260,41 @@ app = Application(
     {
         r'^/$': HelloHandler,
         r'^/template$': TemplateHandler,
+        r'^/template/stream$': StreamTemplateHandler,
 
         r'^/http_error$': HTTPErrorHandler,
         r'^/exc_error$': ExceptionHandler,
 
         r'^/sleep$': SleepHandler,
+        r'^/pid$': PidHandler,
+        r'^/headers/lowercase$': LowercaseHeaderHandler,
+        r'^/headers/unicode$': UnicodeHeaderHandler,
+        r'^/limited$': LimitedHandler,
+        r'^/timeout$': TimeoutHandler,
 
         r'^/param/(?P<number>\d+)$': ParamHandler,
 
         r'^/forms/get$': GetFormHandler,
         r'^/forms/post$': PostFormHandler,
+        r'^/forms/multipart$': MultipartHandler,
 
         r'^/etag$': EtagHandler,
+        r'^/etag/versioned$': VersionedHandler,
+        r'^/release/(?P<page>\w+)$': ReleaseHandler,
+
+        r'^/stream$': StreamHandler,
+        r'^/stream/async$': AsyncStreamHandler,
+
+        r'^/upload$': UploadHandler,
+
+        r'^/cached$': CachedHandler,
+
+        r'^/blocking$': BlockingHandler,
+        r'^/singleton$': SingletonHandler,
+
+        r'^/static/(?P<path>.*)$': StaticFileHandler,
+
+        r'^/metrics$': MetricsHandler,
 
         r'^/ws$': EchoWSHandler,
     },
@@ -2,6 +2,19 @@ import unittest
 
 from test_http import *
 from test_ws import *
+from test_routing import *
+from test_parser import *
+from test_cache import *
+from test_compression import *
+from test_hub import *
+from test_websocket import *
+from test_accesslog import *
+from test_loop import *
+from test_admission import *
+from test_forms import *
+from test_etag import *
+from test_memory import *
+from test_workers import *
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,62 @@
+import io
+import json
+import logging
+import unittest
+
+from rainfall.accesslog import AccessLog, JSONFormatter
+
+
+class AccessLogTestCase(unittest.TestCase):
+
+    def make_log(self, formatter=None, **kwargs):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(formatter or logging.Formatter('%(levelname)s %(message)s'))
+        return AccessLog([handler], **kwargs), stream
+
+    def test_text(self):
+        log, stream = self.make_log()
+        log.start()
+        log.log('GET', '/', 200, 0.0015, 5, '127.0.0.1')
+        log.log('POST', '/form', 500, 0.25)
+        log.stop()
+        self.assertEqual(stream.getvalue().splitlines(), [
+            'INFO GET / 200 1.5ms',
+            'ERROR POST /form 500 250.0ms',
+        ])
+
+    def test_json(self):
+        log, stream = self.make_log(JSONFormatter())
+        log.start()
+        log.log('GET', '/param/1', 404, 0.002, 120, '10.0.0.1')
+        log.stop()
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['method'], 'GET')
+        self.assertEqual(entry['path'], '/param/1')
+        self.assertEqual(entry['code'], 404)
+        self.assertEqual(entry['duration_ms'], 2.0)
+        self.assertEqual(entry['bytes'], 120)
+        self.assertEqual(entry['remote'], '10.0.0.1')
+        self.assertIn('time', entry)
+
+    def test_sample(self):
+        log, stream = self.make_log(sample=0)
+        log.start()
+        for _ in range(10):
+            log.log('GET', '/', 200, 0.001)
+        log.log('GET', '/', 503, 0.001)
+        log.stop()
+        self.assertEqual(stream.getvalue().splitlines(), ['ERROR GET / 503 1.0ms'])
+
+    def test_full_queue(self):
+        log, stream = self.make_log(queue_size=3, batch_size=2)
+        for i in range(5):
+            log.log('GET', '/{}'.format(i), 200, 0.001)
+        self.assertEqual(log.dropped, 2)
+
+        # queued entries are written when the thread is running
+        log.start()
+        with self.assertLogs('rainfall.accesslog', 'WARNING') as logs:
+            log.stop()
+        self.assertEqual(len(stream.getvalue().splitlines()), 3)
+        self.assertIn('2 access log entries were dropped', logs.output[0])
@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+
+from rainfall.admission import Limiter, Admission
+
+
+class LimitedHandler(object):
+    max_in_flight = 1
+
+
+class FreeHandler(object):
+    max_in_flight = None
+
+
+class AdmissionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def test_limiter(self):
+        limiter = Limiter(1, queue_size=1, timeout=1)
+        self.assertTrue(self.loop.run_until_complete(limiter.acquire()))
+
+        waiting = asyncio.ensure_future(limiter.acquire())
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(limiter.waiting, 1)
+
+        # the queue is full
+        self.assertFalse(self.loop.run_until_complete(limiter.acquire()))
+        self.assertEqual(limiter.rejected, 1)
+
+        limiter.release()
+        self.assertTrue(self.loop.run_until_complete(waiting))
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertEqual(limiter.waiting, 0)
+
+        limiter.release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_limiter_timeout(self):
+        limiter = Limiter(1, queue_size=10, timeout=0.01)
+        self.assertTrue(self.loop.run_until_complete(limiter.acquire()))
+        self.assertFalse(self.loop.run_until_complete(limiter.acquire()))
+        self.assertEqual(limiter.rejected, 1)
+        self.assertEqual(limiter.waiting, 0)
+
+        limiter.release()
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_admission(self):
+        admission = Admission(max_in_flight=2, queue_size=0)
+        first = self.loop.run_until_complete(admission.acquire(LimitedHandler))
+        self.assertEqual(len(first), 2)
+
+        # the route is full
+        self.assertIsNone(self.loop.run_until_complete(admission.acquire(LimitedHandler)))
+        # the global place isn't kept by the rejected request
+        second = self.loop.run_until_complete(admission.acquire(FreeHandler))
+        self.assertEqual(second, (admission.limiter,))
+        self.assertIsNone(self.loop.run_until_complete(admission.acquire(FreeHandler)))
+
+        admission.release(first)
+        admission.release(second)
+        self.assertEqual(admission.limiter.in_flight, 0)
+        self.assertEqual(admission.routes[LimitedHandler].in_flight, 0)
@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+
+from rainfall.cache import ResponseCache, CachedResponse
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def test_lru(self):
+        cache = ResponseCache(max_size=2)
+        for key in ('a', 'b'):
+            cache.set(key, CachedResponse({}, key.encode()))
+        cache.get('a')
+        cache.set('c', CachedResponse({}, b'c'))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').body, b'a')
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=-1)
+        cache.set('a', CachedResponse({}, b'a'))
+        self.assertIsNone(cache.get('a'))
+
+    def test_single_render(self):
+        cache = ResponseCache()
+        renders = []
+
+        @asyncio.coroutine
+        def render():
+            renders.append(1)
+            yield from asyncio.sleep(0.01)
+            return CachedResponse({}, b'page')
+
+        results = self.loop.run_until_complete(asyncio.gather(
+            *[cache.get_or_render('key', render) for _ in range(5)]
+        ))
+        self.assertEqual(len(renders), 1)
+        self.assertEqual([entry.body for entry in results], [b'page'] * 5)
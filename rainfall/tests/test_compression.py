@@ -0,0 +1,71 @@
+import gzip
+import zlib
+import asyncio
+import unittest
+
+from rainfall.http import HTTPRequest, HTTPResponse
+from rainfall.compression import Compressor, choose_encoding, compress
+
+
+class CompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def apply(self, compressor, response, accept='gzip', path='/'):
+        request = HTTPRequest('GET', path, headers={'Accept-Encoding': accept})
+        self.loop.run_until_complete(compressor.apply(request, response))
+        return response
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding('gzip, deflate', ('gzip', 'deflate')), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0, deflate', ('gzip', 'deflate')), 'deflate')
+        self.assertEqual(choose_encoding('*', ('gzip', 'deflate')), 'gzip')
+        self.assertIsNone(choose_encoding('identity', ('gzip', 'deflate')))
+        self.assertIsNone(choose_encoding('', ('gzip', 'deflate')))
+
+    def test_compress(self):
+        body = b'abc' * 1000
+        self.assertEqual(gzip.decompress(compress(body, 'gzip')), body)
+        self.assertEqual(zlib.decompress(compress(body, 'deflate')), body)
+        self.assertEqual(compress(body, 'gzip'), compress(body, 'gzip'))
+
+    def test_apply(self):
+        response = self.apply(Compressor(), HTTPResponse(200, {}, 'a' * 2000))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.body), b'a' * 2000)
+
+    def test_skipped(self):
+        compressor = Compressor(min_size=100)
+        small = self.apply(compressor, HTTPResponse(200, {}, 'a' * 10))
+        self.assertEqual(small.body, 'a' * 10)
+
+        image = self.apply(compressor, HTTPResponse(200, {'Content-Type': 'image/png'}, b'a' * 200))
+        self.assertNotIn('Content-Encoding', image.headers)
+
+        identity = self.apply(compressor, HTTPResponse(200, {}, 'a' * 200), accept='identity')
+        self.assertNotIn('Content-Encoding', identity.headers)
+        self.assertEqual(identity.headers['Vary'], 'Accept-Encoding')
+
+        stream = self.apply(compressor, HTTPResponse(200, {}, iter(['a' * 200])))
+        self.assertNotIn('Content-Encoding', stream.headers)
+
+    def test_cache_by_etag(self):
+        compressor = Compressor(cache_size=1)
+        for _ in range(2):
+            self.apply(compressor, HTTPResponse(200, {'ETag': '"1"'}, 'a' * 2000))
+        self.assertEqual(len(compressor), 1)
+        response = self.apply(compressor, HTTPResponse(200, {'ETag': '"2"'}, 'b' * 2000))
+        self.assertEqual(len(compressor), 1)
+        self.assertEqual(gzip.decompress(response.body), b'b' * 2000)
+        self.assertEqual(response.headers['ETag'], '"2-gzip"')
+
+    def test_cache_by_path(self):
+        # the same version on two urls
+        compressor = Compressor()
+        self.apply(compressor, HTTPResponse(200, {'ETag': 'W/"v1"'}, 'a' * 2000), path='/a')
+        response = self.apply(
+            compressor, HTTPResponse(200, {'ETag': 'W/"v1"'}, 'b' * 2000), path='/b'
+        )
+        self.assertEqual(gzip.decompress(response.body), b'b' * 2000)
@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+import unittest
+
+from rainfall.etag import get_hash, make_etag, weak_etag, encoded_etag, etag_matches, sha1
+from rainfall.handlers import HTTPHandler
+from rainfall.http import HTTPRequest
+from rainfall.utils import NotModified
+
+
+class PageHandler(HTTPHandler):
+
+    etag_hash = 'sha1'
+
+    def handle(self, request):
+        return 'Page'
+
+
+class ETagTestCase(unittest.TestCase):
+
+    def test_hashes(self):
+        self.assertIs(get_hash('sha1'), sha1)
+        self.assertIs(get_hash(sha1), sha1)
+        self.assertIsNotNone(get_hash())
+        with self.assertRaises(ValueError):
+            get_hash('md4')
+        self.assertEqual(make_etag(b'body'), '"' + hashlib.sha1(b'body').hexdigest() + '"')
+
+    def test_weak(self):
+        self.assertEqual(weak_etag(42), 'W/"42"')
+        self.assertEqual(weak_etag('"v1"'), 'W/"v1"')
+        self.assertEqual(weak_etag('W/"v1"'), 'W/"v1"')
+
+    def test_matches(self):
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('"b", W/"a"', '"a"'))
+        self.assertTrue(etag_matches('"a"', 'W/"a"'))
+        self.assertTrue(etag_matches('*', '"a"'))
+        self.assertFalse(etag_matches('"b"', '"a"'))
+        self.assertFalse(etag_matches(None, '"a"'))
+
+    def test_encoded(self):
+        self.assertEqual(encoded_etag('"a"', 'gzip'), '"a-gzip"')
+        self.assertEqual(encoded_etag('W/"v1"', 'br'), 'W/"v1-br"')
+        self.assertTrue(etag_matches('"a-gzip"', '"a"'))
+        self.assertTrue(etag_matches('"a"', '"a-br"'))
+        self.assertFalse(etag_matches('"b-gzip"', '"a"'))
+
+    def test_handler(self):
+        loop = asyncio.get_event_loop()
+        code, headers, body = loop.run_until_complete(PageHandler()(HTTPRequest('GET', '/')))
+        # encoded once, for the hash and the response
+        self.assertEqual(body, b'Page')
+        self.assertEqual(headers['ETag'], make_etag(b'Page', sha1))
+
+        request = HTTPRequest('GET', '/', {'If-None-Match': headers['ETag']})
+        with self.assertRaises(NotModified):
+            loop.run_until_complete(PageHandler()(request))
+
+    def test_unsafe_methods(self):
+        loop = asyncio.get_event_loop()
+        _, headers, _ = loop.run_until_complete(PageHandler()(HTTPRequest('GET', '/')))
+
+        # the body is sent, not 304
+        request = HTTPRequest('POST', '/', {'If-None-Match': headers['ETag']})
+        code, _, body = loop.run_until_complete(PageHandler()(request))
+        self.assertEqual((code, body), (200, b'Page'))
@@ -0,0 +1,133 @@
+import unittest
+
+from rainfall.http import HTTPRequest, HTTPError
+from rainfall.forms import MultiDict, MultipartParser, parse_header_options, parse_cookies
+
+
+BOUNDARY = b'----rainfallboundary'
+
+MULTIPART = (
+    b'preamble\r\n'
+    b'------rainfallboundary\r\n'
+    b'Content-Disposition: form-data; name="name"\r\n'
+    b'\r\n'
+    b'Anton\r\n'
+    b'------rainfallboundary\r\n'
+    b'Content-Disposition: form-data; name="tag"\r\n'
+    b'\r\n'
+    b'a\r\n'
+    b'------rainfallboundary\r\n'
+    b'Content-Disposition: form-data; name="tag"\r\n'
+    b'\r\n'
+    b'b\r\n'
+    b'------rainfallboundary\r\n'
+    b'Content-Disposition: form-data; name="upload"; filename="data.bin"\r\n'
+    b'Content-Type: application/octet-stream\r\n'
+    b'\r\n'
+) + b'\r\n--\x00' * 1000 + (
+    b'\r\n'
+    b'------rainfallboundary--\r\n'
+)
+
+
+class FormsTestCase(unittest.TestCase):
+
+    def test_multidict(self):
+        d = MultiDict([('a', '1'), ('b', '2'), ('a', '3')])
+        self.assertEqual(d['a'], '1')
+        self.assertEqual(d.get_all('a'), ['1', '3'])
+        self.assertEqual(d.get_all('c'), [])
+        self.assertEqual(dict(d), {'a': '1', 'b': '2'})
+        d['a'] = '4'
+        self.assertEqual(d.get_all('a'), ['4'])
+
+    def test_header_options(self):
+        self.assertEqual(
+            parse_header_options('form-data; name="a;b"; filename="x \\"y\\".txt"'),
+            ('form-data', {'name': 'a;b', 'filename': 'x "y".txt'})
+        )
+        self.assertEqual(
+            parse_header_options('Multipart/Form-Data; boundary=xyz'),
+            ('multipart/form-data', {'boundary': 'xyz'})
+        )
+
+    def test_cookies(self):
+        self.assertEqual(
+            parse_cookies('session=abc; theme="dark"; broken; session=other'),
+            {'session': 'abc', 'theme': 'dark'}
+        )
+
+    def test_multipart(self):
+        for chunk_size in (1, 7, len(MULTIPART)):
+            parser = MultipartParser(BOUNDARY, spool_size=100)
+            for i in range(0, len(MULTIPART), chunk_size):
+                parser.feed(MULTIPART[i:i + chunk_size])
+            parser.close()
+            self.assertEqual(parser.form['name'], 'Anton')
+            self.assertEqual(parser.form.get_all('tag'), ['a', 'b'])
+            upload = parser.files['upload']
+            self.assertEqual(upload.filename, 'data.bin')
+            self.assertEqual(upload.size, 5000)
+            # over spool_size, on disk
+            self.assertTrue(upload.file._rolled)
+            self.assertEqual(upload.read(), b'\r\n--\x00' * 1000)
+            upload.close()
+
+    def test_multipart_incomplete(self):
+        parser = MultipartParser(BOUNDARY)
+        parser.feed(MULTIPART[:-30])
+        with self.assertRaises(ValueError):
+            parser.close()
+
+    def test_multipart_malformed(self):
+        # the file part is done, the next one is broken
+        body = MULTIPART[:-len(b'--\r\n')] + b'\r\nNo colon\r\n\r\n'
+        parser = MultipartParser(BOUNDARY)
+        with self.assertRaises(ValueError):
+            parser.feed(body)
+        self.assertTrue(parser.files['upload'].file.closed)
+
+
+class HTTPRequestTestCase(unittest.TestCase):
+
+    def test_query(self):
+        request = HTTPRequest('POST', '/path?tag=a&tag=b&empty=', {})
+        self.assertEqual(request.path_info, '/path')
+        self.assertEqual(request.GET['tag'], 'a')
+        self.assertEqual(request.GET.get_all('tag'), ['a', 'b'])
+        self.assertEqual(request.GET['empty'], '')
+        self.assertIs(request.GET, request.GET)
+
+        request = HTTPRequest('GET', '/path', {})
+        self.assertEqual(request.query_string, '')
+        self.assertEqual(request.GET, {})
+
+    def test_form(self):
+        request = HTTPRequest('PUT', '/', {'Content-Type': 'application/x-www-form-urlencoded'})
+        request.raw_body = b'name=Anton&number=42'
+        self.assertEqual(request.POST, {'name': 'Anton', 'number': '42'})
+        self.assertEqual(request.FILES, {})
+
+        request = HTTPRequest('POST', '/', {'Content-Type': 'application/json'})
+        request.raw_body = b'{"name": "Anton"}'
+        self.assertEqual(request.POST, {})
+
+    def test_multipart_body(self):
+        request = HTTPRequest('POST', '/', {
+            'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY.decode()
+        })
+        request.raw_body = MULTIPART
+        self.assertEqual(request.POST['name'], 'Anton')
+        self.assertEqual(request.FILES['upload'].size, 5000)
+        request.close()
+        self.assertTrue(request.FILES['upload'].file.closed)
+
+        request = HTTPRequest('POST', '/', {'Content-Type': 'multipart/form-data'})
+        with self.assertRaises(HTTPError):
+            request.POST
+
+    def test_slots(self):
+        request = HTTPRequest('GET', '/', {'Cookie': 'a=1'})
+        self.assertEqual(request.cookies, {'a': '1'})
+        with self.assertRaises(AttributeError):
+            request.anything = 1
@@ -1,8 +1,17 @@
 import time
-import hashlib
+import socket
+import http.client
+import gzip
 
+from concurrent.futures import ProcessPoolExecutor
+
+from rainfall.web import Application
+from rainfall.utils import RainfallException
 from rainfall.unittest import RainfallTestCase
-from app import app, EtagHandler
+from rainfall.etag import make_etag, get_hash
+
+from app import app, EtagHandler, VersionedHandler
+from test_forms import BOUNDARY, MULTIPART
 
 
 class HTTPTestCase(RainfallTestCase):
@@ -18,6 +27,16 @@ class HTTPTestCase(RainfallTestCase):
         self.assertEqual(r.status, 200)
         self.assertTrue('<b>Rendered</b>' in r.body)
 
+    def test_stream_template(self):
+        r = self.client.query('/template/stream')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertTrue('<b>Streamed</b>' in r.body)
+
+    def test_templates_precompiled(self):
+        env = self.app.settings['jinja_env']
+        self.assertEqual(len(env.cache), len(env.list_templates()))
+
     def test_http_error(self):
         r = self.client.query('/http_error')
         self.assertEqual(r.status, 403)
@@ -59,8 +78,17 @@ class HTTPTestCase(RainfallTestCase):
         self.assertTrue('Name: Anton' in r.body)
         self.assertTrue('Number: 42' in r.body)
 
+    def test_form_multipart(self):
+        connection = self.client.http_connection
+        connection.request('POST', '/forms/multipart', MULTIPART, {
+            'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY.decode(),
+        })
+        r = connection.getresponse()
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.read(), b'Anton a,b data.bin 5000')
+
     def test_etag_wo_ifnonematch(self):
-        etag_awaiting = '"' + hashlib.sha1(EtagHandler.payload.encode('utf-8')).hexdigest() + '"'
+        etag_awaiting = make_etag(EtagHandler.payload.encode('utf-8'), get_hash())
         r = self.client.query(
             '/etag', method='GET'
         )
@@ -68,7 +96,7 @@ class HTTPTestCase(RainfallTestCase):
         self.assertEqual(etag_awaiting, r.headers.get('ETag'))
 
     def test_etag_with_ifnonematch(self):
-        etag_awaiting = '"' + hashlib.sha1(EtagHandler.payload.encode('utf-8')).hexdigest() + '"'
+        etag_awaiting = make_etag(EtagHandler.payload.encode('utf-8'), get_hash())
         r = self.client.query(
             '/etag', method='GET',
             headers={
@@ -78,3 +106,336 @@ class HTTPTestCase(RainfallTestCase):
         self.assertEqual(r.status, 304)
         self.assertEqual(r.body, '')
         self.assertEqual(etag_awaiting, r.headers.get('ETag'))
+
+    def test_weak_etag(self):
+        r = self.client.query('/etag/versioned')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('ETag'), 'W/"v2"')
+
+        r = self.client.query('/etag/versioned', headers={'If-None-Match': 'W/"v1", W/"v2"'})
+        self.assertEqual(r.status, 304)
+        # 304 without rendering
+        r = self.client.query('/etag/versioned')
+        self.assertEqual(r.body, 'Render 2')
+
+    def test_etag_unsafe_methods(self):
+        etag = make_etag(EtagHandler.payload.encode('utf-8'), get_hash())
+        r = self.client.query('/etag', method='POST', headers={'If-None-Match': etag})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, EtagHandler.payload)
+
+        renders = VersionedHandler.renders
+        r = self.client.query('/etag/versioned', method='POST', headers={'If-None-Match': 'W/"v2"'})
+        self.assertEqual(r.status, 412)
+        # not performed
+        self.assertEqual(VersionedHandler.renders, renders)
+
+        r = self.client.query('/etag/versioned', method='HEAD', headers={'If-None-Match': 'W/"v2"'})
+        self.assertEqual(r.status, 304)
+
+    def test_header_case(self):
+        r = self.client.query('/headers/lowercase')
+        self.assertEqual(r.msg.get_all('Content-Type'), ['text/plain'])
+        self.assertEqual(r.body, 'Plain')
+
+    def test_header_not_latin1(self):
+        r = self.client.query('/headers/unicode')
+        self.assertEqual(r.status, 500)
+        # the connection is still there
+        r = self.client.query('/')
+        self.assertEqual(r.body, 'Hello!')
+
+    def test_head_keep_alive(self):
+        sock = socket.create_connection((self.app.settings['host'], int(self.app.settings['port'])))
+        sock.settimeout(2)
+        reader = sock.makefile('rb')
+
+        def read_head():
+            lines = []
+            while True:
+                line = reader.readline().decode().strip()
+                if not line:
+                    return lines
+                lines.append(line)
+
+        heads = {}
+        for path in ('/', '/stream', '/static/hello.txt'):
+            sock.sendall('HEAD {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+            head = heads[path] = read_head()
+            self.assertEqual(head[0], 'HTTP/1.1 200 OK')
+            self.assertIn('Connection: keep-alive', head)
+        # the length of the body that would be sent to GET
+        self.assertIn('Content-Length: 6', heads['/'])
+
+        # no body was sent, the next response comes right after the headers
+        sock.sendall(b'GET /param/7 HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        head = read_head()
+        self.assertEqual(head[0], 'HTTP/1.1 200 OK')
+        self.assertEqual(reader.read(1), b'7')
+        sock.close()
+
+    def test_keep_alive(self):
+        r = self.client.query('/')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('Connection'), 'keep-alive')
+        self.assertEqual(r.headers.get('Content-Length'), '6')
+        sock = self.client.http_connection.sock
+
+        r = self.client.query('/param/3')
+        self.assertEqual(r.body, '3')
+        self.assertIs(sock, self.client.http_connection.sock)
+
+    def test_connection_close(self):
+        r = self.client.query('/', headers={'Connection': 'close'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('Connection'), 'close')
+        self.assertEqual(r.body, 'Hello!')
+
+    def test_graceful_shutdown(self):
+        # an idle keep-alive connection and a request in flight
+        r = self.client.query('/')
+        self.assertEqual(r.status, 200)
+        idle_sock = self.client.http_connection.sock
+
+        busy = http.client.HTTPConnection(self.app.settings['host'], self.app.settings['port'])
+        busy.request('GET', '/sleep')
+        time.sleep(0.05)
+        self.server_process.terminate()
+
+        r = busy.getresponse()
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.read(), b'Done')
+        self.assertEqual(r.headers.get('Connection'), 'close')
+        self.assertEqual(idle_sock.recv(1), b'')
+
+        self.server_process.join(2)
+        self.assertEqual(self.server_process.exitcode, 0)
+
+    def test_handler_limit(self):
+        first = http.client.HTTPConnection(self.app.settings['host'], self.app.settings['port'])
+        first.request('GET', '/limited')
+        time.sleep(0.05)
+
+        # waits for the first one for request_queue_timeout and gives up
+        r = self.client.query('/limited')
+        self.assertEqual(r.status, 503)
+        self.assertEqual(r.headers.get('Retry-After'), '1')
+        self.assertEqual(r.headers.get('Connection'), 'close')
+
+        r = first.getresponse()
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.read(), b'Done')
+
+        # not limited
+        r = self.client.query('/')
+        self.assertEqual(r.status, 200)
+
+    def test_handler_timeout(self):
+        started = time.monotonic()
+        r = self.client.query('/timeout')
+        self.assertEqual(r.status, 503)
+        self.assertEqual(r.headers.get('Retry-After'), '1')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_pipelining(self):
+        sock = socket.create_connection((self.app.settings['host'], int(self.app.settings['port'])))
+        started = time.monotonic()
+        sock.sendall(
+            b'GET /sleep HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'GET /sleep HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'GET /param/1 HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'HEAD /sleep HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'HEAD /stream HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            b'POST /forms/post HTTP/1.1\r\nHost: localhost\r\nContent-Length: 8\r\n\r\nname=tst'
+            b'GET /param/2 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+        )
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+
+        responses = data.split(b'HTTP/1.1 ')[1:]
+        self.assertEqual(len(responses), 7)
+        self.assertTrue(all(r.startswith(b'200 OK') for r in responses))
+        self.assertTrue(responses[0].endswith(b'Done'))
+        self.assertTrue(responses[1].endswith(b'Done'))
+        self.assertTrue(responses[2].endswith(b'\r\n\r\n1'))
+        # HEAD responses end with the headers
+        self.assertIn(b'Content-Length: 4\r\n', responses[3])
+        self.assertTrue(responses[3].endswith(b'\r\n\r\n'))
+        self.assertTrue(responses[4].endswith(b'\r\n\r\n'))
+        self.assertIn(b'Name: tst', responses[5])
+        self.assertTrue(responses[6].endswith(b'\r\n\r\n2'))
+        # the sleeps at once
+        self.assertLess(time.monotonic() - started, 0.19)
+
+    def test_stream(self):
+        r = self.client.query('/stream')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertEqual(r.headers.get('Content-Length'), None)
+        self.assertEqual(r.body, 'chunk 0\nchunk 1\nchunk 2\n')
+
+        # connection is still usable
+        r = self.client.query('/')
+        self.assertEqual(r.body, 'Hello!')
+
+    def test_stream_async(self):
+        r = self.client.query('/stream/async')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, 'async chunks')
+
+    def test_upload_stream(self):
+        r = self.client.query('/upload', method='POST', params={'data': 'x' * 100000})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, str(len('data=') + 100000))
+
+    def test_chunked_request(self):
+        connection = self.client.http_connection
+        connection.putrequest('POST', '/forms/post')
+        connection.putheader('Content-Type', 'application/x-www-form-urlencoded')
+        connection.putheader('Transfer-Encoding', 'chunked')
+        connection.endheaders()
+        for chunk in (b'name=An', b'ton&number=42'):
+            connection.send('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+        connection.send(b'0\r\n\r\n')
+        r = connection.getresponse()
+        body = r.read().decode('utf-8')
+        self.assertEqual(r.status, 200)
+        self.assertTrue('Name: Anton' in body)
+        self.assertTrue('Number: 42' in body)
+
+    def test_body_too_large(self):
+        connection = self.client.http_connection
+        connection.putrequest('POST', '/forms/post')
+        connection.putheader('Content-Length', str(10 ** 9))
+        connection.endheaders()
+        r = connection.getresponse()
+        self.assertEqual(r.status, 413)
+        self.assertEqual(r.headers.get('Connection'), 'close')
+
+    def test_static_file(self):
+        r = self.client.query('/static/hello.txt')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, 'Hello, static world!\n')
+        self.assertEqual(r.headers.get('Content-Length'), '21')
+        self.assertEqual(r.headers.get('Content-Type'), 'text/plain; charset=utf-8')
+        self.assertEqual(r.headers.get('Vary'), 'Accept-Encoding')
+        self.assertTrue(r.headers.get('Last-Modified'))
+        etag = r.headers.get('ETag')
+
+        r = self.client.query('/static/hello.txt', headers={'If-None-Match': etag})
+        self.assertEqual(r.status, 304)
+        self.assertEqual(r.body, '')
+
+        r = self.client.query('/static/missing.txt')
+        self.assertEqual(r.status, 404)
+        r = self.client.query('/static/../app.py')
+        self.assertEqual(r.status, 404)
+        r = self.client.query('/static/%2e%2e/app.py')
+        self.assertEqual(r.status, 404)
+
+    def test_static_encoded_name(self):
+        r = self.client.query('/static/hello%20world.txt')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, 'Hello, spaced world!\n')
+
+    def test_static_range(self):
+        r = self.client.query('/static/hello.txt', headers={'Range': 'bytes=7-12'})
+        self.assertEqual(r.status, 206)
+        self.assertEqual(r.body, 'static')
+        self.assertEqual(r.headers.get('Content-Range'), 'bytes 7-12/21')
+
+        r = self.client.query('/static/hello.txt', headers={'Range': 'bytes=-6'})
+        self.assertEqual(r.body, 'world!\n'[1:])
+
+        r = self.client.query('/static/hello.txt', headers={'Range': 'bytes=100-'})
+        self.assertEqual(r.status, 416)
+        self.assertEqual(r.headers.get('Content-Range'), 'bytes */21')
+
+    def test_static_precompressed(self):
+        r = self.client.query('/static/hello.txt', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(r.headers.get('Content-Type'), 'text/plain; charset=utf-8')
+        self.assertEqual(gzip.decompress(r.raw_body), b'Hello, static world!\n')
+
+        # refused with q=0
+        r = self.client.query('/static/hello.txt', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertIsNone(r.headers.get('Content-Encoding'))
+        self.assertEqual(r.body, 'Hello, static world!\n')
+
+    def test_compression(self):
+        r = self.client.query('/template', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(r.headers.get('Vary'), 'Accept-Encoding')
+        self.assertTrue(b'<b>Rendered</b>' in gzip.decompress(r.raw_body))
+
+        r = self.client.query('/')
+        self.assertEqual(r.headers.get('Content-Encoding'), None)
+        self.assertEqual(r.body, 'Hello!')
+
+    def test_metrics(self):
+        self.client.query('/param/1')
+        self.client.query('/param/2')
+        self.client.query('/http_error')
+        r = self.client.query('/metrics')
+        self.assertEqual(r.status, 200)
+        self.assertTrue(r.headers.get('Content-Type').startswith('text/plain; version=0.0.4'))
+        self.assertIn(
+            'rainfall_http_requests_total{route="^/param/(?P<number>\\\\d+)$",method="GET",code="200"} 2',
+            r.body
+        )
+        self.assertIn(
+            'rainfall_http_requests_total{route="^/http_error$",method="GET",code="403"} 1', r.body
+        )
+        self.assertIn(
+            'rainfall_http_request_duration_seconds_count{route="^/param/(?P<number>\\\\d+)$"} 2', r.body
+        )
+        self.assertIn('rainfall_http_connections 1', r.body)
+        self.assertIn('rainfall_http_requests_in_flight 1', r.body)
+
+    def test_response_cache(self):
+        r = self.client.query('/cached')
+        self.assertEqual(r.body, 'Render 1')
+        etag = r.headers.get('ETag')
+
+        r = self.client.query('/cached?other=1')
+        self.assertEqual(r.body, 'Render 1')
+        self.assertEqual(r.headers.get('ETag'), etag)
+
+        r = self.client.query('/cached', headers={'If-None-Match': etag})
+        self.assertEqual(r.status, 304)
+
+        r = self.client.query('/cached?page=2')
+        self.assertEqual(r.body, 'Render 2')
+
+    def test_run_in_executor(self):
+        r = self.client.query('/blocking')
+        self.assertEqual(r.status, 200)
+        self.assertTrue('<b>Offloaded</b>' in r.body)
+
+    def test_process_executor(self):
+        executor = ProcessPoolExecutor(1)
+        try:
+            with self.assertRaises(RainfallException):
+                Application({}, settings={'executor': executor})
+        finally:
+            executor.shutdown()
+
+    def test_singleton_handler(self):
+        connections = [
+            http.client.HTTPConnection(self.app.settings['host'], self.app.settings['port'])
+            for _ in range(4)
+        ]
+        for connection in connections:
+            connection.request('GET', '/singleton')
+        responses = [connection.getresponse() for connection in connections]
+        self.assertEqual([r.read() for r in responses], [b'Set up once'] * 4)
+        # concurrent requests, one instance, headers of their own
+        self.assertEqual(len({r.getheader('X-Instance') for r in responses}), 1)
+        self.assertTrue(all(r.getheader('ETag') for r in responses))
@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+
+from rainfall.hub import Hub, encode_frame
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.frames = []
+        self.blocked = asyncio.Event()
+        self.blocked.set()
+
+    def write(self, data):
+        self.frames.append(data)
+
+    @asyncio.coroutine
+    def drain(self):
+        yield from self.blocked.wait()
+
+
+class FakeProtocol(object):
+
+    def __init__(self):
+        self.state = 'OPEN'
+        self.writer = FakeWriter()
+        self.close_code = None
+
+    @asyncio.coroutine
+    def fail_connection(self, code=1011, reason=''):
+        self.close_code = code
+        self.state = 'CLOSED'
+
+
+class HubTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def flush(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_encode_frame(self):
+        self.assertEqual(encode_frame('hi'), b'\x81\x02hi')
+        self.assertEqual(encode_frame(b'\x00'), b'\x82\x01\x00')
+
+    def test_broadcast(self):
+        hub = Hub()
+        first, second = FakeProtocol(), FakeProtocol()
+        hub.join('news', first)
+        hub.join('news', second)
+        hub.join('other', second)
+        self.assertEqual(hub.broadcast('news', 'hi'), 2)
+        self.flush()
+        self.assertEqual(first.writer.frames, [b'\x81\x02hi'])
+        # encoded once, shared by all subscribers
+        self.assertIs(first.writer.frames[0], second.writer.frames[0])
+
+        hub.leave('news', first)
+        self.assertEqual(hub.count('news'), 1)
+        hub.leave_all(second)
+        self.assertEqual(hub.count('news'), 0)
+        self.assertEqual(hub.broadcast('news', 'hi'), 0)
+        self.assertEqual(hub.subscribers, {})
+
+    def test_slow_consumer_drop(self):
+        hub = Hub(max_size=2, policy='drop')
+        slow, fast = FakeProtocol(), FakeProtocol()
+        slow.writer.blocked.clear()
+        hub.join('feed', slow)
+        hub.join('feed', fast)
+        for number in range(5):
+            hub.broadcast('feed', str(number))
+            self.flush()
+        self.assertEqual(len(fast.writer.frames), 5)
+        # one frame is being written, two are queued
+        self.assertEqual(len(slow.writer.frames), 1)
+        self.assertEqual(len(hub.subscribers[slow].queue), 2)
+        self.assertEqual(hub.subscribers[slow].dropped, 2)
+
+        slow.writer.blocked.set()
+        self.flush()
+        self.assertEqual(len(slow.writer.frames), 3)
+
+    def test_slow_consumer_coalesce(self):
+        hub = Hub(max_size=2, policy='coalesce')
+        slow = FakeProtocol()
+        slow.writer.blocked.clear()
+        hub.join('prices', slow)
+        hub.broadcast('prices', 'first')
+        self.flush()
+        hub.broadcast('prices', 'a=1', key='a')
+        hub.broadcast('prices', 'b=1', key='b')
+        hub.broadcast('prices', 'a=2', key='a')
+        queue = hub.subscribers[slow].queue
+        self.assertEqual([frame for _, frame in queue], [encode_frame('a=2'), encode_frame('b=1')])
+        hub.broadcast('prices', 'c=1', key='c')
+        self.assertEqual([key for key, _ in queue], ['b', 'c'])
+        slow.writer.blocked.set()
+        self.flush()
+
+    def test_slow_consumer_disconnect(self):
+        hub = Hub(max_size=1, policy='disconnect')
+        slow = FakeProtocol()
+        slow.writer.blocked.clear()
+        hub.join('feed', slow)
+        for number in range(3):
+            hub.broadcast('feed', str(number))
+        self.flush()
+        self.assertEqual(slow.close_code, 1008)
+        slow.writer.blocked.set()
+        self.flush()
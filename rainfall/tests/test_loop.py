@@ -0,0 +1,35 @@
+import socket
+import asyncio
+import unittest
+
+from rainfall import web
+from rainfall.web import install_uvloop, loop_name, set_buffer_sizes
+
+
+class LoopTestCase(unittest.TestCase):
+
+    def test_install_uvloop(self):
+        policy = asyncio.get_event_loop_policy()
+        if web.uvloop is not None:
+            self.assertTrue(install_uvloop())
+            self.assertIsInstance(asyncio.get_event_loop_policy(), web.uvloop.EventLoopPolicy)
+            asyncio.set_event_loop_policy(policy)
+        else:
+            with self.assertLogs('rainfall.web', 'WARNING'):
+                self.assertFalse(install_uvloop())
+            self.assertIs(asyncio.get_event_loop_policy(), policy)
+
+    def test_loop_name(self):
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertIn('EventLoop', loop_name(loop))
+            self.assertTrue(loop_name(loop).startswith('asyncio.'))
+        finally:
+            loop.close()
+
+    def test_buffer_sizes(self):
+        with socket.socket() as sock:
+            set_buffer_sizes(sock, 256 * 1024, 128 * 1024)
+            # linux doubles the value for bookkeeping
+            self.assertGreaterEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF), 256 * 1024)
+            self.assertGreaterEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), 128 * 1024)
@@ -0,0 +1,160 @@
+import gzip
+import asyncio
+
+from rainfall.web import RainfallProtocol
+from rainfall.http import Headers, RequestStream
+from rainfall.unittest import RainfallTestCase
+from rainfall.etag import make_etag, get_hash
+
+from app import app, EtagHandler
+from test_forms import BOUNDARY, MULTIPART
+
+
+class FailingCompressor(object):
+
+    @asyncio.coroutine
+    def apply(self, request, response):
+        raise RuntimeError('Compression failed')
+
+
+class MemoryHTTPTestCase(RainfallTestCase):
+    app = app
+    in_memory = True
+
+    def test_basic(self):
+        r = self.client.query('/')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, 'Hello!')
+        self.assertEqual(r.headers.get('Connection'), 'keep-alive')
+
+        r = self.client.query('/template')
+        self.assertTrue('<b>Rendered</b>' in r.body)
+
+        r = self.client.query('/nowhere')
+        self.assertEqual(r.status, 404)
+
+    def test_max_header_size(self):
+        settings = RainfallProtocol.settings
+        # above the 64 KiB of the default StreamReader limit
+        RainfallProtocol.settings = dict(settings, max_header_size=128 * 1024)
+        try:
+            r = self.client.query('/', headers={'X-Large': 'a' * 100 * 1024})
+            self.assertEqual(r.status, 200)
+            self.assertEqual(r.body, 'Hello!')
+        finally:
+            RainfallProtocol.settings = settings
+
+    def test_idle_first_request(self):
+        connection = self.client.connect()
+        # before the handler has started
+        protocol = connection.server_protocol
+        protocol.settings = dict(protocol.settings, keep_alive_timeout=0.05)
+        self.client.loop.run_until_complete(asyncio.sleep(0.2, loop=self.client.loop))
+        self.assertTrue(connection.closed)
+
+    def test_in_flight_on_error(self):
+        connection = self.client.connect()
+        protocol = connection.server_protocol
+        protocol.settings = dict(protocol.settings, compressor=FailingCompressor())
+        stream = RequestStream(protocol.reader, Headers())
+        with self.assertRaises(RuntimeError):
+            self.client.loop.run_until_complete(
+                protocol.process_http('GET', '/', 'HTTP/1.1', Headers(), stream)
+            )
+        self.assertEqual(protocol.in_flight, 0)
+        self.assertEqual(self.app.metrics.requests_in_flight, 0)
+
+    def test_bad_request(self):
+        for head in (b'POST /forms/post HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+                     b'POST /forms/post HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n'):
+            connection = self.client.connect()
+            connection.send(head)
+            r = self.client.loop.run_until_complete(connection.read_response())
+            self.assertEqual(r.status, 400)
+            self.assertEqual(r.headers.get('Connection'), 'close')
+
+    def test_keep_alive(self):
+        self.client.query('/')
+        connection = self.client.connection
+        self.client.query('/param/3')
+        self.assertIs(self.client.connection, connection)
+        self.assertEqual(len(self.client.connections), 1)
+
+    def test_forms(self):
+        r = self.client.query('/forms/get?name=Anton&number=42')
+        self.assertTrue('Name: Anton' in r.body)
+
+        r = self.client.query('/forms/post', method='POST', params={'name': 'Anton', 'number': 42})
+        self.assertTrue('Number: 42' in r.body)
+
+        r = self.client.loop.run_until_complete(self.client.request(
+            '/forms/multipart', 'POST', MULTIPART,
+            {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY.decode()},
+        ))
+        self.assertEqual(r.body, 'Anton a,b data.bin 5000')
+
+    def test_etag(self):
+        etag = make_etag(EtagHandler.payload.encode('utf-8'), get_hash())
+        r = self.client.query('/etag', headers={'If-None-Match': etag})
+        self.assertEqual(r.status, 304)
+        self.assertEqual(r.getheader('ETag'), etag)
+
+    def test_shared_etag_compressed(self):
+        for page in ('a', 'b'):
+            r = self.client.query('/release/' + page, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(r.getheader('ETag'), 'W/"release-1-gzip"')
+            self.assertEqual(r.getheader('Content-Encoding'), 'gzip')
+            self.assertEqual(gzip.decompress(r.raw_body).decode(), 'Page {} '.format(page) * 50)
+
+    def test_compressed_etag(self):
+        r = self.client.query('/release/a')
+        self.assertEqual(r.getheader('ETag'), 'W/"release-1"')
+
+        # the validator of the gzip bytes is another one, both are accepted back
+        r = self.client.query('/release/a', headers={'Accept-Encoding': 'gzip'})
+        etag = r.getheader('ETag')
+        self.assertEqual(etag, 'W/"release-1-gzip"')
+        r = self.client.query('/release/a', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(r.status, 304)
+        r = self.client.query('/release/a', headers={'If-None-Match': etag})
+        self.assertEqual(r.status, 304)
+
+    def test_stream(self):
+        r = self.client.query('/stream')
+        self.assertEqual(r.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertEqual(r.body, 'chunk 0\nchunk 1\nchunk 2\n')
+
+    def test_static_file(self):
+        r = self.client.query('/static/hello.txt')
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.body, 'Hello, static world!\n')
+
+    def test_pipelining(self):
+        connection = self.client.connect()
+        connection.send(b''.join(
+            'GET /param/{} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(i).encode()
+            for i in range(3)
+        ))
+        bodies = [
+            self.client.loop.run_until_complete(connection.read_response()).body
+            for _ in range(3)
+        ]
+        self.assertEqual(bodies, ['0', '1', '2'])
+
+    def test_concurrent(self):
+        loop = self.client.loop
+        connections = [self.client.connect() for _ in range(4)]
+        for connection in connections:
+            connection.send(b'GET /singleton HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        started = loop.time()
+        responses = loop.run_until_complete(asyncio.gather(
+            *[connection.read_response() for connection in connections]
+        ))
+        # the handler sleeps 0.05 s, the requests are handled at once
+        self.assertLess(loop.time() - started, 0.15)
+        self.assertEqual([r.body for r in responses], ['Set up once'] * 4)
+
+    def test_ws_echo(self):
+        self.client.ws_connect('/ws')
+        self.client.ws_send('/ws', 'hello')
+        self.assertEqual(self.client.ws_recv('/ws'), 'hello')
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from rainfall.http import read_request, Headers, HTTPError, MAX_HEADERS
+
+
+class ParserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def read(self, data, **kwargs):
+        reader = asyncio.StreamReader(loop=self.loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        return self.loop.run_until_complete(read_request(reader, **kwargs))
+
+    def test_request(self):
+        method, uri, version, headers, stream = self.read(
+            b'\r\nPOST /forms/post?a=1 HTTP/1.1\r\n'
+            b'Host: localhost\r\n'
+            b'set-cookie: a=1\r\n'
+            b'Set-Cookie: b=2\r\n'
+            b'X-Folded: first\r\n'
+            b'  second\r\n'
+            b'Content-Length: 4\r\n\r\nbody'
+        )
+        self.assertEqual((method, uri, version), ('POST', '/forms/post?a=1', 'HTTP/1.1'))
+        self.assertEqual(headers['host'], 'localhost')
+        self.assertEqual(headers.get('SET-COOKIE'), 'a=1')
+        self.assertEqual(headers.get_all('Set-Cookie'), ['a=1', 'b=2'])
+        self.assertEqual(headers.get('X-Folded'), 'first second')
+        self.assertEqual(headers.get('Missing', ''), '')
+        self.assertFalse('Missing' in headers)
+        self.assertEqual(self.loop.run_until_complete(stream.read()), b'body')
+
+    def test_chunked_body(self):
+        *_, stream = self.read(
+            b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n'
+        )
+        self.assertEqual(self.loop.run_until_complete(stream.read(3)), b'hel')
+        self.assertEqual(self.loop.run_until_complete(stream.read()), b'lo world')
+        self.assertTrue(stream.at_eof)
+
+    def test_malformed_body_framing(self):
+        for length in (b'abc', b'-1', b'+4', b'1_0'):
+            with self.assertRaises(HTTPError) as e:
+                self.read(b'POST / HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\nbody')
+            self.assertEqual(e.exception.code, 400)
+
+        for chunks in (b'zz\r\nhello\r\n0\r\n\r\n', b'-5\r\nhello\r\n0\r\n\r\n',
+                       b'5\r\nhelloXX0\r\n\r\n'):
+            *_, stream = self.read(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n' + chunks)
+            with self.assertRaises(HTTPError) as e:
+                self.loop.run_until_complete(stream.read())
+            self.assertEqual(e.exception.code, 400)
+
+    def test_too_many_headers(self):
+        head = b'GET / HTTP/1.1\r\n' + b'X: 1\r\n' * (MAX_HEADERS + 1) + b'\r\n'
+        with self.assertRaises(ValueError):
+            self.read(head)
+
+    def test_headers_too_large(self):
+        with self.assertRaises(ValueError):
+            self.read(b'GET / HTTP/1.1\r\nX: ' + b'1' * 100 + b'\r\n\r\n', max_header_size=64)
+
+    def test_invalid_header(self):
+        with self.assertRaises(ValueError):
+            self.read(b'GET / HTTP/1.1\r\nNo colon here\r\n\r\n')
+
+    def test_headers_dict(self):
+        headers = Headers({'Content-Type': 'text/plain'})
+        self.assertEqual(headers['content-type'], 'text/plain')
+        self.assertEqual(headers.items(), [('Content-Type', 'text/plain')])
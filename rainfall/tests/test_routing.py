@@ -0,0 +1,42 @@
+import unittest
+
+from rainfall.routing import Router
+
+
+class RouterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router({
+            r'^/$': 'index',
+            r'^/param/(?P<number>\d+)$': 'param',
+            r'^/param/.*': 'param_any',
+            r'^/pa.*': 'pa',
+            r'^/a|^/b': 'alternative',
+            r'^/bb$': 'bb',
+        })
+
+    def test_static(self):
+        handler, match = self.router.match('/')
+        self.assertEqual(handler, 'index')
+        self.assertEqual(match.group(0), '/')
+
+    def test_params(self):
+        handler, match = self.router.match('/param/42')
+        self.assertEqual(handler, 'param')
+        self.assertEqual(match.groupdict(), {'number': '42'})
+
+    def test_precedence(self):
+        self.assertEqual(self.router.match('/param/x')[0], 'param_any')
+        self.assertEqual(self.router.match('/pax')[0], 'pa')
+        self.assertEqual(self.router.match('/bb')[0], 'bb')
+        self.assertEqual(self.router.match('/b')[0], 'alternative')
+
+    def test_not_found(self):
+        self.assertEqual(self.router.match('/nothing'), (None, None))
+
+    def test_cache(self):
+        router = Router({r'^/param/(?P<number>\d+)$': 'param'}, cache_size=2)
+        for number in range(5):
+            handler, match = router.match('/param/{}'.format(number))
+            self.assertEqual(match.groupdict(), {'number': str(number)})
+        self.assertEqual(len(router._cache), 2)
@@ -0,0 +1,99 @@
+import zlib
+import asyncio
+import unittest
+
+from websockets.exceptions import WebSocketProtocolError
+from rainfall.websocket import (
+    apply_mask, encode_frame, read_frame, parse_extensions, PerMessageDeflate, PayloadTooBig
+)
+
+
+def client_frame(opcode, data, rsv1=False, mask=b'\x01\x02\x03\x04'):
+    frame = bytearray(encode_frame(opcode, apply_mask(data, mask), rsv1))
+    # set MASK bit and insert the mask after the length
+    frame[1] |= 0x80
+    header_length = len(frame) - len(data)
+    return bytes(frame[:header_length]) + mask + bytes(frame[header_length:])
+
+
+class WebsocketFramingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+
+    def read(self, data, **kwargs):
+        reader = asyncio.StreamReader(loop=self.loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        return self.loop.run_until_complete(read_frame(reader.readexactly, True, **kwargs))
+
+    def test_mask(self):
+        data = b'some data to mask'
+        mask = b'\xaa\x01\x7f\x00'
+        self.assertEqual(apply_mask(data, mask), bytes(b ^ mask[i % 4] for i, b in enumerate(data)))
+        self.assertEqual(apply_mask(b'', mask), b'')
+
+    def test_read_frame(self):
+        for data in (b'x', b'y' * 200, b'z' * 70000):
+            frame, rsv1 = self.read(client_frame(1, data))
+            self.assertEqual(frame.data, data)
+            self.assertTrue(frame.fin)
+            self.assertFalse(rsv1)
+
+    def test_rsv1(self):
+        with self.assertRaises(WebSocketProtocolError):
+            self.read(client_frame(1, b'x', rsv1=True))
+        frame, rsv1 = self.read(client_frame(1, b'x', rsv1=True), rsv1_allowed=True)
+        self.assertTrue(rsv1)
+
+    def test_max_size(self):
+        with self.assertRaises(PayloadTooBig):
+            self.read(client_frame(2, b'x' * 100), max_size=99)
+
+
+class PerMessageDeflateTestCase(unittest.TestCase):
+
+    def test_parse_extensions(self):
+        self.assertEqual(
+            parse_extensions(['permessage-deflate; client_max_window_bits, x-foo; a="1"']),
+            [('permessage-deflate', [('client_max_window_bits', None)]), ('x-foo', [('a', '1')])]
+        )
+
+    def test_negotiate(self):
+        deflate, response = PerMessageDeflate.negotiate(
+            ['permessage-deflate; client_max_window_bits']
+        )
+        self.assertEqual(response, 'permessage-deflate')
+
+        deflate, response = PerMessageDeflate.negotiate(
+            ['permessage-deflate; server_max_window_bits=10'], context_takeover=False
+        )
+        self.assertEqual(
+            response,
+            'permessage-deflate; server_no_context_takeover; '
+            'client_no_context_takeover; server_max_window_bits=10'
+        )
+        self.assertEqual(deflate.window_bits, 10)
+
+        self.assertEqual(PerMessageDeflate.negotiate(['x-webkit-deflate-frame']), (None, None))
+        # unknown params decline the offer, the next one is taken
+        deflate, response = PerMessageDeflate.negotiate(
+            ['permessage-deflate; foo, permessage-deflate; server_no_context_takeover']
+        )
+        self.assertEqual(response, 'permessage-deflate; server_no_context_takeover')
+
+    def test_roundtrip(self):
+        for takeover in (True, False):
+            server = PerMessageDeflate(not takeover, not takeover)
+            # the client side of the same connection
+            client = PerMessageDeflate(not takeover, not takeover)
+            for message in (b'hello' * 100, b'hello' * 100, b''):
+                compressed = server.compress(message)
+                self.assertEqual(client.decompress(compressed, True), message)
+            self.assertLess(len(server.compress(b'hello' * 100)), 100)
+
+    def test_decompress_limit(self):
+        data = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = data.compress(b'\x00' * 100000) + data.flush(zlib.Z_SYNC_FLUSH)
+        with self.assertRaises(PayloadTooBig):
+            PerMessageDeflate().decompress(compressed[:-4], True, 1000)
@@ -0,0 +1,118 @@
+import os
+import time
+import signal
+import unittest
+import multiprocessing
+
+from rainfall import workers
+from rainfall.unittest import TestClient
+
+from app import app, SingletonHandler
+
+
+def slow_setup(cls, settings):
+    time.sleep(0.1)
+    cls.greeting = 'Set up once'
+
+
+def worker_pids(pid):
+    """
+    Live (not zombie) children of a process
+    """
+    pids = set()
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as stat:
+                fields = stat.read().rpartition(')')[2].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid and fields[0] != 'Z':
+            pids.add(int(name))
+    return pids
+
+
+@unittest.skipUnless(os.path.isdir('/proc') and hasattr(os, 'fork'), 'requires /proc and fork')
+class SupervisorTestCase(unittest.TestCase):
+
+    reuse_port = False
+
+    def setUp(self):
+        if not app.settings.get('logfile_path'):
+            app.settings['logfile_path'] = os.path.join(os.path.dirname(__file__), 'tests.log')
+        self._reuse_port = app.settings['reuse_port']
+        app.settings['reuse_port'] = self.reuse_port
+        # no restart delay for the workers killed here
+        self._min_lifetime = workers.MIN_WORKER_LIFETIME
+        workers.MIN_WORKER_LIFETIME = 0
+        # workers take a while to start listening
+        self._setup = SingletonHandler.__dict__['setup']
+        SingletonHandler.setup = classmethod(slow_setup)
+
+        q = multiprocessing.Queue()
+        self.server_process = multiprocessing.Process(
+            target=app.run, kwargs={'process_queue': q, 'greeting': False, 'workers': 2}
+        )
+        self.server_process.start()
+        q.get()
+        # workers are listening when the supervisor says it's started
+        self.first_pid = self.query_pid()
+        self.pids = self.wait_for_workers(lambda pids: len(pids) == 2)
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        workers.MIN_WORKER_LIFETIME = self._min_lifetime
+        SingletonHandler.setup = self._setup
+        app.settings['reuse_port'] = self._reuse_port
+
+    def wait_for_workers(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            pids = worker_pids(self.server_process.pid)
+            if condition(pids):
+                return pids
+            time.sleep(0.05)
+        self.fail('workers are {}'.format(worker_pids(self.server_process.pid)))
+
+    def query_pid(self):
+        client = TestClient(app.settings['host'], app.settings['port'])
+        r = client.query('/pid', headers={'Connection': 'close'})
+        self.assertEqual(r.status, 200)
+        return int(r.body)
+
+    def test_serve(self):
+        self.assertIn(self.first_pid, self.pids)
+        self.assertIn(self.query_pid(), self.pids)
+
+    def test_restart(self):
+        dead = self.pids.pop()
+        os.kill(dead, signal.SIGKILL)
+        pids = self.wait_for_workers(lambda pids: len(pids) == 2 and dead not in pids)
+        self.assertTrue(self.pids < pids)
+        self.assertIn(self.query_pid(), pids)
+
+    def test_restart_all(self):
+        os.kill(self.server_process.pid, signal.SIGHUP)
+        # all replaced one by one
+        pids = self.wait_for_workers(lambda pids: not pids & self.pids and len(pids) == 2)
+        self.assertIn(self.query_pid(), pids)
+
+    def test_worker_ignores_hangup(self):
+        pid = min(self.pids)
+        os.kill(pid, signal.SIGHUP)
+        time.sleep(0.2)
+        self.assertEqual(worker_pids(self.server_process.pid), self.pids)
+
+    def test_stop(self):
+        os.kill(self.server_process.pid, signal.SIGTERM)
+        self.server_process.join(10)
+        self.assertEqual(self.server_process.exitcode, 0)
+        for pid in self.pids:
+            self.assertFalse(os.path.exists('/proc/{}'.format(pid)))
+
+
+class ReusePortSupervisorTestCase(SupervisorTestCase):
+    # every worker binds its own socket
+    reuse_port = True
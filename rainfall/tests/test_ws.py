@@ -1,5 +1,12 @@
+import base64
+import socket
+import struct
+
 from rainfall.unittest import RainfallTestCase
+from rainfall.websocket import PerMessageDeflate
 from app import app
+from test_websocket import client_frame
+
 
 class WSTestCase(RainfallTestCase):
     app = app
@@ -10,3 +17,69 @@ class WSTestCase(RainfallTestCase):
         res = yield from self.client.ws_recv('/ws')
         self.assertEqual(res, 'hello')
 
+    def connect(self, extensions=None):
+        sock = socket.create_connection((self.app.settings['host'], int(self.app.settings['port'])))
+        request = [
+            'GET /ws HTTP/1.1',
+            'Host: localhost',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Key: ' + base64.b64encode(b'0123456789abcdef').decode(),
+            'Sec-WebSocket-Version: 13',
+        ]
+        if extensions:
+            request.append('Sec-WebSocket-Extensions: ' + extensions)
+        sock.sendall('\r\n'.join(request + ['', '']).encode())
+        reader = sock.makefile('rb')
+        head = []
+        while True:
+            line = reader.readline().decode().strip()
+            if not line:
+                break
+            head.append(line)
+        return sock, reader, head
+
+    def read_frame(self, reader):
+        head1, head2 = struct.unpack('!BB', reader.read(2))
+        length = head2 & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', reader.read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', reader.read(8))
+        return head1, reader.read(length)
+
+    def test_ws_deflate(self):
+        sock, reader, head = self.connect('permessage-deflate; client_max_window_bits')
+        self.assertEqual(head[0], 'HTTP/1.1 101 Switching Protocols')
+        self.assertIn('Sec-WebSocket-Extensions: permessage-deflate', head)
+
+        client = PerMessageDeflate()
+        message = b'{"price": 42}' * 20
+        sock.sendall(client_frame(1, client.compress(message), rsv1=True))
+        head1, data = self.read_frame(reader)
+        # FIN, RSV1, text
+        self.assertEqual(head1, 0xc1)
+        self.assertLess(len(data), len(message))
+        self.assertEqual(client.decompress(data, True), message)
+        sock.close()
+
+    def test_ws_max_message_size(self):
+        sock, reader, head = self.connect()
+        self.assertNotIn('Sec-WebSocket-Extensions: permessage-deflate', head)
+        sock.sendall(client_frame(2, b'x' * (64 * 1024 + 1)))
+        head1, data = self.read_frame(reader)
+        self.assertEqual(head1, 0x88)
+        self.assertEqual(struct.unpack('!H', data[:2])[0], 1009)
+        sock.close()
+
+    def test_ws_shutdown(self):
+        sock, reader, head = self.connect()
+        self.assertEqual(head[0], 'HTTP/1.1 101 Switching Protocols')
+        self.server_process.terminate()
+        head1, data = self.read_frame(reader)
+        self.assertEqual(head1, 0x88)
+        self.assertEqual(struct.unpack('!H', data[:2])[0], 1001)
+        sock.sendall(client_frame(8, data[:2]))
+        self.server_process.join(2)
+        self.assertEqual(self.server_process.exitcode, 0)
+        sock.close()
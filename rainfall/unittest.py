@@ -1,4 +1,5 @@
 import os
+import io
 import asyncio
 import unittest
 import multiprocessing
@@ -6,6 +7,9 @@ import http.client
 import urllib.parse
 import websockets
 
+from websockets.client import WebSocketClientProtocol
+from websockets.uri import parse_uri
+
 from .utils import RainfallException
 
 
@@ -27,12 +31,14 @@ class TestClient(object):
         """
         Run a query using url and method.
         Returns response object with status, reason, body
+        and raw_body with the bytes as they came
         """
         if params:
             params = urllib.parse.urlencode(params)
         self.http_connection.request(method, url, params, headers=headers)
         r = self.http_connection.getresponse()
-        r.body = r.read().decode("utf-8")  # converting to unicode
+        r.raw_body = r.read()
+        r.body = r.raw_body.decode("utf-8", "replace")  # converting to unicode
         return r
 
     @asyncio.coroutine
@@ -52,6 +58,302 @@ class TestClient(object):
         res = self.loop.run_until_complete(self.ws_connections[url].recv())
         return res
 
+class MemoryTransport(asyncio.Transport):
+    """
+    One end of an in-memory connection: what is written to it is
+    received by the protocol on the other end, on the next loop iteration.
+    Flow control is ignored, there is no socket to wait for.
+    """
+
+    def __init__(self, loop, protocol, peername=('127.0.0.1', 50000)):
+        super().__init__({'peername': peername, 'sockname': ('127.0.0.1', 80), 'socket': None})
+        self._loop = loop
+        self._protocol = protocol
+        self._protocol_paused = False
+        self._closing = False
+        self._eof = False
+        self.peer = None
+
+    def get_protocol(self):
+        return self._protocol
+
+    def set_protocol(self, protocol):
+        self._protocol = protocol
+
+    def write(self, data):
+        if data and not (self._closing or self._eof):
+            self._loop.call_soon(self.peer._received, bytes(data))
+
+    def write_eof(self):
+        if not (self._closing or self._eof):
+            self._eof = True
+            self._loop.call_soon(self.peer._received_eof)
+
+    def can_write_eof(self):
+        return True
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.call_soon(self._protocol.connection_lost, None)
+        self._loop.call_soon(self.peer._peer_closed)
+
+    abort = close
+
+    def is_closing(self):
+        return self._closing
+
+    def is_reading(self):
+        return not self._closing
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def get_write_buffer_limits(self):
+        return 0, 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def _received(self, data):
+        if not self._closing:
+            self._protocol.data_received(data)
+
+    def _received_eof(self):
+        if not self._closing and not self._protocol.eof_received():
+            self.close()
+
+    def _peer_closed(self):
+        if not self._closing:
+            self._protocol.eof_received()
+            self.close()
+
+
+def memory_pipe(server_protocol, client_protocol, loop=None):
+    """
+    Connects two protocols in memory, as if the client connected to the server
+
+    :rtype: transport of the client
+    """
+    loop = loop or asyncio.get_event_loop()
+    server_transport = MemoryTransport(loop, server_protocol)
+    client_transport = MemoryTransport(loop, client_protocol, ('127.0.0.1', 80))
+    server_transport.peer, client_transport.peer = client_transport, server_transport
+    server_protocol.connection_made(server_transport)
+    client_protocol.connection_made(client_transport)
+    return client_transport
+
+
+class MemoryResponse(object):
+    """
+    Response read by :class:`MemoryClient`, like the one of :meth:`TestClient.query`:
+    status, reason, headers (http.client.HTTPMessage), raw_body and body
+    """
+
+    def __init__(self, status, reason, headers, raw_body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.raw_body = raw_body
+        self.body = raw_body.decode('utf-8', 'replace')
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self):
+        return self.raw_body
+
+
+@asyncio.coroutine
+def read_response(reader, method='GET'):
+    """
+    Reads one HTTP/1.1 response from asyncio.StreamReader
+
+    :rtype: :class:`MemoryResponse`
+    """
+    while True:
+        head = yield from reader.readuntil(b'\r\n\r\n')
+        status_line, _, header_lines = head.partition(b'\r\n')
+        _, status, reason = status_line.decode('latin-1').split(' ', 2)
+        status = int(status)
+        if status != 100:
+            break
+    headers = http.client.parse_headers(io.BytesIO(header_lines))
+
+    if method == 'HEAD' or status in (204, 304) or status < 200:
+        body = b''
+    elif 'chunked' in (headers.get('Transfer-Encoding') or '').lower():
+        chunks = []
+        while True:
+            size = int((yield from reader.readline()).split(b';')[0], 16)
+            chunk = yield from reader.readexactly(size + 2)
+            if not size:
+                break
+            chunks.append(chunk[:-2])
+        body = b''.join(chunks)
+    elif headers.get('Content-Length') is not None:
+        body = yield from reader.readexactly(int(headers['Content-Length']))
+    else:
+        # the end of body is the end of connection
+        body = yield from reader.read()
+    return MemoryResponse(status, reason.strip(), headers, body)
+
+
+class MemoryConnection(object):
+    """
+    Client end of an in-memory connection to :class:`rainfall.web.RainfallProtocol`,
+    made by :meth:`MemoryClient.connect`. Raw requests may be sent with it,
+    several at once (pipelined)::
+
+        connection.send(b'GET / HTTP/1.1\\r\\nHost: localhost\\r\\n\\r\\n')
+        response = yield from connection.read_response()
+    """
+
+    def __init__(self, server_protocol, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.server_protocol = server_protocol
+        self.reader = asyncio.StreamReader(loop=self.loop)
+        protocol = asyncio.StreamReaderProtocol(self.reader, loop=self.loop)
+        self.transport = memory_pipe(server_protocol, protocol, self.loop)
+        self.writer = asyncio.StreamWriter(self.transport, protocol, self.reader, self.loop)
+
+    @property
+    def closed(self):
+        return self.transport.is_closing() or self.reader.at_eof()
+
+    def send(self, data):
+        self.writer.write(data)
+
+    @asyncio.coroutine
+    def read_response(self, method='GET'):
+        return (yield from read_response(self.reader, method))
+
+    def close(self):
+        self.transport.close()
+
+
+class MemoryClient(object):
+    """
+    Test client that serves :class:`rainfall.web.Application` on the loop
+    of the test itself: requests are fed to :class:`rainfall.web.RainfallProtocol`
+    through in-memory transports, no process is started and no port is bound,
+    so test cases may run in parallel.
+
+    Has the methods of :class:`TestClient`, :meth:`request` and :meth:`websocket`
+    are their coroutine counterparts::
+
+        client = MemoryClient(app)
+        client.start()
+        r = client.query('/')
+        client.close()
+
+    :meth:`start` and :meth:`close` run the loop, call them while it isn't running.
+    """
+
+    def __init__(self, app, loop=None):
+        self.app = app
+        self.loop = loop or asyncio.get_event_loop()
+        self.connection = None  # keep-alive connection of query() and request()
+        self.connections = []
+        self.ws_connections = {}
+
+    def start(self):
+        self.app.start_services(self.loop)
+
+    def close(self):
+        """
+        Closes the connections and lets the server side finish
+        """
+        for protocol in self.ws_connections.values():
+            if protocol.open:
+                self.loop.run_until_complete(protocol.close())
+        for connection in self.connections:
+            connection.close()
+        closed = [connection.server_protocol.connection_closed for connection in self.connections]
+        closed += [protocol.connection_closed for protocol in self.ws_connections.values()]
+        if closed:
+            self.loop.run_until_complete(asyncio.wait(closed, timeout=1, loop=self.loop))
+        # a few iterations for handler tasks of the connections to see the end
+        for _ in range(3):
+            self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+        self.connections = []
+        self.ws_connections = {}
+        self.app.stop_services(self.loop)
+
+    def connect(self):
+        """
+        :rtype: :class:`MemoryConnection` to a new server protocol
+        """
+        from .web import RainfallProtocol
+        connection = MemoryConnection(RainfallProtocol(), self.loop)
+        self.connections.append(connection)
+        return connection
+
+    @asyncio.coroutine
+    def request(self, url, method='GET', body=None, headers=None):
+        """
+        Sends a request on the keep-alive connection of the client
+        (a new one if the server has closed it).
+
+        :param body: str or bytes
+        :rtype: :class:`MemoryResponse`
+        """
+        if self.connection is None or self.connection.closed:
+            self.connection = self.connect()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        lines = ['{} {} HTTP/1.1'.format(method, url)]
+        headers = dict(headers or {})
+        headers.setdefault('Host', 'localhost')
+        if body is not None and 'Transfer-Encoding' not in headers:
+            headers.setdefault('Content-Length', str(len(body)))
+        lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+        self.connection.send(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        return (yield from self.connection.read_response(method))
+
+    def query(self, url, method='GET', params=None, headers={}):
+        """
+        The same as :meth:`TestClient.query`
+        """
+        if params:
+            params = urllib.parse.urlencode(params)
+        return self.loop.run_until_complete(self.request(url, method, params, headers))
+
+    @asyncio.coroutine
+    def websocket(self, url):
+        """
+        Opens a websocket to the application
+
+        :rtype: websockets.client.WebSocketClientProtocol, with send() and recv()
+        """
+        from .web import RainfallProtocol
+        server_protocol = RainfallProtocol()
+        protocol = WebSocketClientProtocol(host='localhost', port=80, secure=False)
+        memory_pipe(server_protocol, protocol, self.loop)
+        yield from protocol.handshake(parse_uri('ws://localhost' + url))
+        return protocol
+
+    def ws_connect(self, url):
+        self.ws_connections[url] = self.loop.run_until_complete(self.websocket(url))
+
+    def ws_send(self, url, message):
+        if url not in self.ws_connections:
+            raise RainfallTestException('No connected websocket to {} found'.format(url))
+        self.loop.run_until_complete(self.ws_connections[url].send(message))
+
+    def ws_recv(self, url):
+        if url not in self.ws_connections:
+            raise RainfallTestException('No connected websocket to {} found'.format(url))
+        return self.loop.run_until_complete(self.ws_connections[url].recv())
+
+
 class RainfallTestCase(unittest.TestCase):
     """
     Use it for your rainfall test cases.
@@ -72,8 +374,13 @@ class RainfallTestCase(unittest.TestCase):
                 self.assertEqual(r.body, 'Hello!')
 
     Inside you can use TestClient's instance via self.client
+
+    With `in_memory = True` the app is served on the loop of the test
+    through :class:`MemoryClient` (self.client then), without a process
+    and a port. Tests that need real sockets keep the default.
     """
     app = None  # app to test, specify in your test case
+    in_memory = False
 
     def setUp(self):
         if not self.app.settings.get('logfile_path'):
@@ -81,6 +388,11 @@ class RainfallTestCase(unittest.TestCase):
                 os.path.dirname(__file__), 'tests.log'
             )
 
+        if self.in_memory:
+            self.client = MemoryClient(self.app)
+            self.client.start()
+            return
+
         q = multiprocessing.Queue()
         self.server_process = multiprocessing.Process(
             target=self.app.run,
@@ -94,4 +406,9 @@ class RainfallTestCase(unittest.TestCase):
         self.client = TestClient(self.app.settings['host'], self.app.settings['port'])
 
     def tearDown(self):
+        if self.in_memory:
+            self.client.close()
+            return
         self.server_process.terminate()
+        # the next test binds the same port
+        self.server_process.join()
@@ -1,5 +1,6 @@
 import re
 import asyncio
+import functools
 
 class TerminalColors:
     LIGHTBLUE = '\033[96m'
@@ -44,4 +45,54 @@ def maybe_yield(f, *args, **kwargs):
         res = yield from f(*args, **kwargs)
         return res
     else:
-        return f(*args, **kwargs)
\ No newline at end of file
+        return f(*args, **kwargs)
+
+
+def awaitable_iter(awaitable):
+    """
+    Make any awaitable usable with yield from: coroutines and futures
+    already are, other awaitables (e.g. what async iterators return
+    from __anext__) are turned into iterators.
+
+    useage: a = yield from awaitable_iter(aiterator.__anext__())
+    """
+    if hasattr(awaitable, '__await__') and not hasattr(awaitable, '__iter__'):
+        return awaitable.__await__()
+    return awaitable
+
+
+class ExecutorPool(object):
+    """
+    Runs blocking functions out of the event loop,
+    in a concurrent.futures executor.
+
+    Keeps track of how many calls are in flight, so the pool
+    can be tuned: queue_depth is the number of calls waiting
+    for a free worker.
+
+    :param executor: concurrent.futures.Executor running in threads
+    :param max_workers: number of workers of the executor
+    """
+
+    def __init__(self, executor, max_workers):
+        self.executor = executor
+        self.max_workers = max_workers
+        self.in_flight = 0
+
+    @property
+    def queue_depth(self):
+        return max(0, self.in_flight - self.max_workers)
+
+    @asyncio.coroutine
+    def run(self, f, *args, **kwargs):
+        """
+        useage: a = yield from pool.run(f, *args, **kwargs)
+        """
+        loop = asyncio.get_event_loop()
+        self.in_flight += 1
+        try:
+            return (yield from loop.run_in_executor(
+                self.executor, functools.partial(f, *args, **kwargs)
+            ))
+        finally:
+            self.in_flight -= 1
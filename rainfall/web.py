@@ -2,27 +2,94 @@
 import re
 import io
 import email
+import os
 import sys
+import time
 import signal
+import socket
 import asyncio
 import hashlib
 import traceback
 import logging
 
 from http import client
-from jinja2 import Environment, FileSystemLoader
+from collections import deque
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from websockets.server import WebSocketServerProtocol
-from websockets.exceptions import InvalidHandshake
+from websockets.exceptions import InvalidHandshake, InvalidState, WebSocketProtocolError
+from websockets.framing import OP_CONT, OP_TEXT, OP_BINARY
 from websockets.handshake import check_request, build_response
 
-from .utils import TerminalColors, RainfallException, NotModified, match_dict_regexp, maybe_yield
-from .http import HTTPResponse, HTTPRequest, HTTPError, read_request, USER_AGENT
+from .utils import (
+    TerminalColors, RainfallException, NotModified, ExecutorPool, maybe_yield, awaitable_iter
+)
+from .http import (
+    HTTPResponse, HTTPRequest, HTTPError, FileBody, read_request, should_keep_alive, encode_chunk,
+    LAST_CHUNK, USER_AGENT
+)
 from .handlers import HTTPHandler, WSHandler
+from .routing import Router
+from .workers import Supervisor
+from .templates import create_environment
+from .compression import Compressor, COMPRESSIBLE_TYPES
+from .hub import Hub
+from .accesslog import AccessLog
+from .admission import Admission
+from .etag import get_hash
+from .metrics import Metrics, DEFAULT_BUCKETS
+from .websocket import PerMessageDeflate, PayloadTooBig, read_frame, encode_frame
 
 
 logger = logging.getLogger(__name__)
 MAX_HEADERS = 256
 
+# safe methods, handled at once when pipelined (RFC 7230, 6.3.2)
+PIPELINED_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# sent to the connections over max_connections, before anything is read
+UNAVAILABLE = (
+    'HTTP/1.1 503 Service Unavailable\r\n'
+    'Retry-After: {}\r\n'
+    'Content-Length: 0\r\n'
+    'Connection: close\r\n\r\n'
+)
+
+
+def install_uvloop():
+    """
+    Makes uvloop the event loop of asyncio (see `uvloop` setting).
+
+    :rtype: bool, False if uvloop isn't installed and asyncio loop stays
+    """
+    if uvloop is None:
+        logger.warning('uvloop is not installed, using the asyncio event loop')
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def loop_name(loop):
+    """
+    'uvloop.Loop', 'asyncio.unix_events._UnixSelectorEventLoop', ...
+    """
+    return '{}.{}'.format(type(loop).__module__, type(loop).__name__)
+
+
+def set_buffer_sizes(sock, sndbuf=None, rcvbuf=None):
+    """
+    Sets buffer sizes of a listening socket, accepted connections inherit them
+    (and the TCP window scale is chosen with the receive buffer in mind).
+    """
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
 
 class RainfallProtocol(WebSocketServerProtocol):
 
@@ -32,55 +99,167 @@ class RainfallProtocol(WebSocketServerProtocol):
     use websockets, else - call HTTPHandler.
     """
 
-    _http_handlers = {}
-    _ws_handlers = {}
+    _http_router = Router({})
+    _ws_router = Router({})
     settings = {}
+    tcp_nodelay = None  # tcp_nodelay setting
+    connections = set()  # open connections of the process, see Application.shutdown
+    draining = False  # True while the server is shutting down
+    handler_instances = {}  # handler class -> instance of singleton handlers, see Application.setup_handlers
 
     def __init__(self):
         self._type = 'WS' # swithes to HTTP if needed
+        self.remote_addr = None
+        self.deflate = None  # rainfall.websocket.PerMessageDeflate if negotiated
+        self._rsv1 = False
+        self.in_flight = 0  # requests being handled
+        self._pipeline = deque()  # process_http tasks of pipelined requests, in order
+        self.refused = False  # closed at once, there were max_connections already
         super().__init__()
+        # the head is read with readuntil(), which stops at the limit
+        # of the reader (64 KiB by default) whatever max_header_size is
+        self._stream_reader._limit = self.settings['max_header_size']
+        # the reader waits when the handler doesn't keep up
+        self.messages = asyncio.Queue(maxsize=self.settings.get('ws_read_queue_size') or 0)
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        peername = transport.get_extra_info('peername')
+        self.remote_addr = peername[0] if isinstance(peername, tuple) else peername
+        if self.tcp_nodelay is not None:
+            sock = transport.get_extra_info('socket')
+            if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+        metrics = self.settings.get('metrics_registry')
+        if metrics is not None:
+            metrics.http_connections += 1
+        max_connections = self.settings.get('max_connections')
+        if max_connections and len(self.connections) >= max_connections:
+            self.refused = True
+            transport.write(UNAVAILABLE.format(self.settings['retry_after']).encode())
+            transport.close()
+            return
+        self.connections.add(self)
+
+    def connection_lost(self, exc):
+        self.connections.discard(self)
+        if not self.opening_handshake.done():
+            # HTTP connection, the websocket reader would wait for the handshake forever
+            self.worker.cancel()
+        metrics = self.settings.get('metrics_registry')
+        if metrics is not None:
+            if self._type == 'WS' and self.opening_handshake.done():
+                metrics.ws_connections -= 1
+            else:
+                metrics.http_connections -= 1
+        super().connection_lost(exc)
 
     @asyncio.coroutine
     def handler(self):
         """
         Presents the whole protocol flow.
         Copy of WebSocketServerProtocol.handler with HTTP flavour.
+
+        HTTP connections are persistent: requests are read and answered
+        one by one until the client asks to close, the connection stays
+        idle for keep_alive_timeout seconds or keep_alive_max_requests
+        requests were served.
+
+        Pipelined GET, HEAD and OPTIONS requests without a body, which are
+        in the read buffer already, are handled at once (up to pipeline_depth
+        of them), their responses are written in order of the requests.
         """
-        # try to figure out what we have, websockets or http.
-        # self._type in changed in self.handshake()
-        try:
-            method, url, headers, body = yield from self.general_handshake()
-        except Exception as exc:
-            logger.info("Exception in opening handshake: {}".format(traceback.format_exc()))
-            self.writer.write_eof()
-            self.writer.close()
-            return
+        requests_served = 0
+        depth = self.settings['pipeline_depth']
+        pipeline = self._pipeline
+        while True:
+            while pipeline and (len(pipeline) >= depth or not self._request_buffered()):
+                # nothing more to start now, waiting for the oldest response
+                if not (yield from self._kept_alive(pipeline.popleft())):
+                    yield from self._finish_pipeline()
+                    self.writer.write_eof()
+                    self.writer.close()
+                    return
+
+            # try to figure out what we have, websockets or http.
+            # self._type in changed in self.handshake()
+            try:
+                # the first request too: a connection that never sends one is idle as well
+                method, url, version, headers, stream = yield from asyncio.wait_for(
+                    self.general_handshake(), self.settings['keep_alive_timeout']
+                )
+            except Exception as exc:
+                if not requests_served and not (
+                        self.draining or self.refused or isinstance(exc, asyncio.TimeoutError)):
+                    # idle keep-alive connections are closed silently
+                    logger.info("Exception in opening handshake: {}".format(traceback.format_exc()))
+                yield from self._finish_pipeline()
+                if isinstance(exc, HTTPError) and exc.code == client.BAD_REQUEST:
+                    # a malformed head, there's no telling where the next request starts
+                    HTTPResponse(client.BAD_REQUEST, body='<h1>400 Bad Request</h1>').write(self.writer)
+                self.writer.write_eof()
+                self.writer.close()
+                return
+
+            if self._type != 'HTTP':
+                break
 
-        if self._type == 'HTTP':
             # falling to HTTP
-            yield from self.process_http(method, url, headers, body)
-            self.writer.write_eof()
-            self.writer.close()
-            return
+            requests_served += 1
+            keep_alive = should_keep_alive(version, headers) and \
+                requests_served < self.settings['keep_alive_max_requests']
+            if depth > 1 and method in PIPELINED_METHODS and stream.at_eof and \
+                    (pipeline or self._request_buffered()):
+                # a task only when there is something to do at the same time
+                pipeline.append(asyncio.ensure_future(self.process_http(
+                    method, url, version, headers, stream, keep_alive,
+                    pipeline[-1] if pipeline else None,
+                )))
+                if keep_alive:
+                    continue
+                # the last request of the connection
+                yield from self._finish_pipeline()
+                self.writer.write_eof()
+                self.writer.close()
+                return
+
+            # the body is read from the connection and unsafe methods are
+            # run in order, after the responses to the previous requests
+            if pipeline and not (yield from self._finish_pipeline()):
+                self.writer.write_eof()
+                self.writer.close()
+                return
+            keep_alive = yield from self.process_http(
+                method, url, version, headers, stream, keep_alive
+            )
+            if not keep_alive:
+                self.writer.write_eof()
+                self.writer.close()
+                return
 
         # continue with websockets
-        ws_handler_cls, _ = match_dict_regexp(self._ws_handlers, url)
+        ws_handler_cls, _ = self._ws_router.match(url.split('?')[0])
         if ws_handler_cls:
             ws_handler = ws_handler_cls(self)
         else:
             yield from self.fail_connection(1011, "No corresponding url found")
             return
 
-        yield from maybe_yield(ws_handler.on_open)
-
+        keepalive = asyncio.ensure_future(self.keepalive())
         try:
-            yield from ws_handler._check_messages()
-        except Exception:
-            logger.info("Exception in connection handler", exc_info=True)
-            yield from self.fail_connection(1011)
-            return
+            yield from maybe_yield(ws_handler.on_open)
 
-        yield from maybe_yield(ws_handler.on_close)
+            try:
+                yield from ws_handler._check_messages()
+            except Exception:
+                logger.info("Exception in connection handler", exc_info=True)
+                yield from self.fail_connection(1011)
+                return
+
+            yield from maybe_yield(ws_handler.on_close)
+        finally:
+            keepalive.cancel()
+            self.settings['ws_hub'].leave_all(self)
 
         try:
             yield from self.close()
@@ -95,13 +274,17 @@ class RainfallProtocol(WebSocketServerProtocol):
         Try to perform the server side of the opening websocket handshake.
         If it fails, switch self._type to HTTP and return.
 
-        Returns the (method, url, headers, body)
+        Returns the (method, url, version, headers, body_stream)
 
         Copy of WebSocketServerProtocol.handshake with HTTP flavour.
         """
         # Read handshake request.
         try:
-            method, url, headers, body = yield from read_request(self.reader)
+            method, url, version, headers, stream = yield from read_request(
+                self.reader, self.settings['max_body_size'], self.settings['max_header_size']
+            )
+        except HTTPError:
+            raise
         except Exception as exc:
             raise HTTPError(code=500) from exc
 
@@ -110,7 +293,11 @@ class RainfallProtocol(WebSocketServerProtocol):
             key = check_request(get_header)
         except InvalidHandshake:
             self._type = 'HTTP'  # switching to HTTP here
-            return (method, url, headers, body)
+            return (method, url, version, headers, stream)
+
+        if self._pipeline and not (yield from self._finish_pipeline()):
+            # pipelined before the upgrade, the connection is closed by now
+            raise HTTPError(code=500)
 
         # Send handshake response. Since the headers only contain ASCII
         # characters, we can keep this simple.
@@ -118,56 +305,504 @@ class RainfallProtocol(WebSocketServerProtocol):
         set_header = lambda k, v: response.append('{}: {}'.format(k, v))
         set_header('Server', USER_AGENT)
         build_response(set_header, key)
+        if self.settings['ws_deflate']:
+            self.deflate, extensions = PerMessageDeflate.negotiate(
+                headers.get_all('Sec-WebSocket-Extensions'),
+                self.settings['ws_deflate_context_takeover'],
+                self.settings['ws_deflate_window_bits'],
+                self.settings['ws_deflate_level'],
+            )
+            if extensions:
+                set_header('Sec-WebSocket-Extensions', extensions)
         response.append('\r\n')
         response = '\r\n'.join(response).encode()
         self.writer.write(response)
 
+        self._type = 'WS'  # may come after HTTP requests on a keep-alive connection
         self.state = 'OPEN'
         self.opening_handshake.set_result(True)
+        metrics = self.settings.get('metrics_registry')
+        if metrics is not None:
+            metrics.http_connections -= 1
+            metrics.ws_connections += 1
+
+        return ('GET', url, version, None, None)
 
-        return ('GET', url, None, None)
 
+    @asyncio.coroutine
+    def keepalive(self):
+        """
+        Pings the client every ws_ping_interval seconds and closes
+        the connection if there is no pong in ws_ping_timeout seconds.
+        """
+        interval = self.settings['ws_ping_interval']
+        if not interval:
+            return
+        timeout = self.settings['ws_ping_timeout']
+        try:
+            while self.state == 'OPEN':
+                yield from asyncio.sleep(interval)
+                pong = yield from self.ping()
+                try:
+                    yield from asyncio.wait_for(pong, timeout)
+                except asyncio.TimeoutError:
+                    logger.info('No pong in {} seconds, closing the websocket'.format(timeout))
+                    yield from self.fail_connection(1011, 'keepalive ping timeout')
+                    return
+        except InvalidState:
+            pass
 
     @asyncio.coroutine
-    def process_http(self, method, url, headers, body):
+    def recv(self):
+        """
+        WebSocketCommonProtocol.recv which doesn't leave the queue
+        getter pending when the connection is closed
+        """
+        try:
+            return self.messages.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+
+        next_message = asyncio.ensure_future(self.messages.get())
+        try:
+            done, _ = yield from asyncio.wait(
+                [next_message, self.worker], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            if not next_message.done():
+                next_message.cancel()
+        if next_message in done:
+            return next_message.result()
+
+    # websockets framing with permessage-deflate and message size limit
+
+    @asyncio.coroutine
+    def run(self):
+        # copy of WebSocketCommonProtocol.run waiting for a place in the messages queue
+        yield from self.opening_handshake
+        while not self.closing_handshake.done():
+            try:
+                msg = yield from self.read_message()
+                if msg is None:
+                    break
+                yield from self.messages.put(msg)
+            except asyncio.CancelledError:
+                break
+            except PayloadTooBig:
+                yield from self.fail_connection(1009)
+            except WebSocketProtocolError:
+                yield from self.fail_connection(1002)
+            except UnicodeDecodeError:
+                yield from self.fail_connection(1007)
+            except Exception:
+                yield from self.fail_connection(1011)
+                raise
+        yield from self.close_connection()
+
+    @asyncio.coroutine
+    def read_message(self):
+        # copy of WebSocketCommonProtocol.read_message with decompression
+        frame = yield from self.read_data_frame()
+        if frame is None:
+            return
+        if frame.opcode == OP_TEXT:
+            text = True
+        elif frame.opcode == OP_BINARY:
+            text = False
+        else:   # frame.opcode == OP_CONT
+            raise WebSocketProtocolError("Unexpected opcode")
+
+        compressed = self._rsv1
+        max_size = self.settings['ws_max_message_size']
+        chunks = []
+        size = 0
+        while True:
+            data = frame.data
+            if compressed:
+                data = self.deflate.decompress(
+                    data, frame.fin, max_size and max_size - size + 1
+                )
+            size += len(data)
+            if max_size and size > max_size:
+                raise PayloadTooBig("Message is too big")
+            chunks.append(data)
+            if frame.fin:
+                break
+
+            frame = yield from self.read_data_frame()
+            if frame is None:
+                raise WebSocketProtocolError("Incomplete fragmented message")
+            if frame.opcode != OP_CONT or self._rsv1:
+                raise WebSocketProtocolError("Unexpected opcode")
+
+        data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        return data.decode('utf-8') if text else data
+
+    @asyncio.coroutine
+    def read_frame(self):
+        frame, self._rsv1 = yield from read_frame(
+            self.reader.readexactly, True,
+            self.settings['ws_max_message_size'], self.deflate is not None
+        )
+        return frame
+
+    @asyncio.coroutine
+    def write_frame(self, opcode, data=b'', expected_state='OPEN'):
+        if self.state != expected_state:
+            raise InvalidState("Cannot write to a WebSocket "
+                               "in the {} state".format(self.state))
+        compressed = self.deflate is not None and opcode in (OP_TEXT, OP_BINARY)
+        if compressed:
+            data = self.deflate.compress(data)
+        self.writer.write(encode_frame(opcode, data, compressed))
+        try:
+            yield from self.writer.drain()
+        except ConnectionResetError:
+            pass
+
+    @asyncio.coroutine
+    def process_http(self, method, url, version, headers, stream, keep_alive=False,
+                     previous=None):
+        """
+        Runs the handler and writes the response.
+
+        :param previous: pipelined process_http task of the previous request,
+            the response is written after that one
+
+        Returns True if the connection may be used for the next request.
+        """
+        self.in_flight += 1
+        metrics = self.settings.get('metrics_registry')
+        if metrics is not None:
+            metrics.requests_in_flight += 1
+        try:
+            return (yield from self._process_http(
+                method, url, version, headers, stream, keep_alive, previous, metrics
+            ))
+        finally:
+            # admission and the gauge rely on it, whatever happens to the request
+            self.in_flight -= 1
+            if metrics is not None:
+                metrics.requests_in_flight -= 1
+
+    @asyncio.coroutine
+    def _process_http(self, method, url, version, headers, stream, keep_alive, previous,
+                      metrics):
+        started = time.monotonic()
         request = HTTPRequest(
             method=method, path=url,
-            headers=headers, body=body,
+            headers=headers, version=version, stream=stream,
         )
 
         response = None
-        path = request.path.split('?')[0]  # stripping GET params
+        path = request.path_info
         exc = None
 
-        http_handler_cls, match_result = match_dict_regexp(self._http_handlers, path)
-        if http_handler_cls:
+        http_handler_cls, match_result = self._http_router.match(path)
+        admission = self.settings.get('admission')
+        admitted = ()
+        if http_handler_cls and admission is not None:
+            admitted = yield from admission.acquire(http_handler_cls)
+
+        if admitted is None:
+            # shedding load, the body isn't even read
+            response = self.unavailable_response()
+            keep_alive = False
+        elif http_handler_cls:
             try:
-                http_handler = http_handler_cls(self.settings)
-                code, headers, body = yield from http_handler(
-                    request, **match_result.groupdict()
-                )
+                yield from self.prepare_body(request, http_handler_cls)
+                http_handler = self.handler_instances.get(http_handler_cls)
+                if http_handler is None:
+                    http_handler = http_handler_cls(self.settings)
+                call = http_handler(request, **match_result.groupdict())
+                timeout = http_handler_cls.timeout
+                if timeout is None:
+                    timeout = self.settings['handler_timeout']
+                if timeout:
+                    call = asyncio.wait_for(call, timeout)
+                code, headers, body = yield from call
                 response = HTTPResponse(code, headers, body)
+            except asyncio.TimeoutError:
+                logger.warning('{} {} timed out'.format(request.method, request.path))
+                response = self.unavailable_response()
             except NotModified as e:
                 response = HTTPResponse(304, e.args[0])
+            except HTTPError as e:
+                response = HTTPResponse(e.code)
             except Exception as e:
                 response = HTTPResponse(client.INTERNAL_SERVER_ERROR)
                 exc = sys.exc_info()
+            finally:
+                if admitted:
+                    admission.release(admitted)
         else:
             response = HTTPResponse(client.NOT_FOUND)
 
-        if response.code != 200:
+        try:
+            response.check_headers()
+        except ValueError:
+            response = HTTPResponse(client.INTERNAL_SERVER_ERROR)
+            exc = sys.exc_info()
+
+        if response.code != 200 and not response.body:
             response.body = "<h1>{} {}</h1>".format(
                 response.code, client.responses[response.code]
             )
 
-        self.writer.write(response.compose().encode())
-        logging.info('{} {} {}'.format(
-            request.method, request.path, response.code)
-        )
+        if self.settings.get('compressor') is not None:
+            yield from self.settings['compressor'].apply(request, response)
+
+        if not stream.at_eof or self.draining:
+            # the rest of body would be taken for the next request,
+            # or there will be no next request
+            keep_alive = False
+
+        if response.streaming and version != 'HTTP/1.1':
+            # no chunked encoding, the end of body is the end of connection
+            response.chunked = False
+            keep_alive = False
+
+        if previous is not None and not (yield from self._kept_alive(previous)):
+            # the connection is closed after the previous response
+            response.keep_alive = False
+        else:
+            response.keep_alive = keep_alive
+            head_only = request.method == 'HEAD'
+            if response.streaming:
+                response.keep_alive = yield from self.write_stream(response, head_only)
+            elif isinstance(response.body, FileBody):
+                response.keep_alive = yield from self.write_file(response, head_only)
+            else:
+                response.write(self.writer, head_only)
+                try:
+                    yield from self.writer.drain()
+                except ConnectionResetError:
+                    pass
+        request.close()
+        duration = time.monotonic() - started
+        access_log = self.settings.get('access_logger')
+        if access_log is not None:
+            access_log.log(
+                request.method, request.path, response.code, duration,
+                response.bytes_sent, self.remote_addr,
+            )
+
+        if metrics is not None:
+            metrics.observe_request(
+                match_result.re.pattern if match_result is not None else '',
+                request.method, response.code, duration,
+                stream.bytes_read, response.bytes_sent,
+            )
 
         if exc:
             logging.error(''.join(traceback.format_exception(*exc)))
 
+        return response.keep_alive
+
+    def _request_buffered(self):
+        # the whole head of the next request has come already
+        return b'\r\n\r\n' in self.reader._buffer
+
+    @asyncio.coroutine
+    def _kept_alive(self, task):
+        try:
+            return (yield from task)
+        except Exception:
+            logger.error('Pipelined request failed', exc_info=True)
+            return False
+
+    @asyncio.coroutine
+    def _finish_pipeline(self):
+        """
+        Waits for the responses to the pipelined requests.
+
+        Returns True if the connection may be used for the next request.
+        """
+        keep_alive = True
+        while self._pipeline:
+            keep_alive = yield from self._kept_alive(self._pipeline.popleft())
+        return keep_alive
+
+    def unavailable_response(self):
+        """
+        503 for requests the server has no capacity for
+        """
+        return HTTPResponse(client.SERVICE_UNAVAILABLE, {
+            'Retry-After': str(self.settings['retry_after'])
+        })
+
+    @asyncio.coroutine
+    def prepare_body(self, request, http_handler_cls):
+        """
+        Rejects too large bodies before reading them and, unless the handler
+        streams the body itself, reads it into request.raw_body
+        (multipart/form-data into request.POST and request.FILES).
+        """
+        if request.stream.too_large:
+            raise HTTPError(client.REQUEST_ENTITY_TOO_LARGE)
+
+        if (request.headers.get('Expect') or '').lower() == '100-continue':
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        if not http_handler_cls.stream_request_body:
+            # multipart bodies are parsed as they come, files are spooled
+            yield from request.read_form(self.settings['multipart_spool_size'])
+
+    @asyncio.coroutine
+    def write_stream(self, response, head_only=False):
+        """
+        Writes a response with an iterable body, chunk by chunk.
+        Waits for the transport buffer to drain after every chunk and stops
+        as soon as the client disconnects. With `head_only` (HEAD requests)
+        the body isn't iterated at all.
+
+        Returns False if the body was not sent completely.
+        """
+        body = response.body
+        completed = False
+        head = response.compose_head()
+        self.writer.write(head)
+        response.bytes_sent = len(head)
+        try:
+            if head_only:
+                yield from self.writer.drain()
+            elif hasattr(body, '__aiter__'):
+                iterator = body.__aiter__()
+                while True:
+                    try:
+                        chunk = yield from awaitable_iter(iterator.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    response.bytes_sent += yield from self._write_chunk(chunk, response.chunked)
+            else:
+                for chunk in body:
+                    response.bytes_sent += yield from self._write_chunk(chunk, response.chunked)
+
+            if response.chunked and not head_only:
+                self.writer.write(LAST_CHUNK)
+                response.bytes_sent += len(LAST_CHUNK)
+                yield from self.writer.drain()
+            completed = True
+        except ConnectionResetError:
+            pass
+        except Exception:
+            # headers are gone already, all we can do is to drop the connection
+            logging.error(traceback.format_exc())
+        finally:
+            if hasattr(body, 'aclose'):
+                yield from awaitable_iter(body.aclose())
+            elif hasattr(body, 'close'):
+                body.close()
+        return completed and response.keep_alive
+
+    @asyncio.coroutine
+    def write_file(self, response, head_only=False):
+        """
+        Writes a response with :class:`rainfall.http.FileBody`: with sendfile()
+        where the transport allows it, reading the file by chunks otherwise.
+
+        Returns False if the file was not sent completely.
+        """
+        body = response.body
+        head = response.compose_head(body.count)
+        self.writer.write(head)
+        response.bytes_sent = len(head)
+        sent = 0
+        try:
+            if head_only or not body.count:
+                yield from self.writer.drain()
+            else:
+                with open(body.path, 'rb') as f:
+                    sent = yield from self._sendfile(f, body.offset, body.count)
+                response.bytes_sent += sent
+        except ConnectionResetError:
+            return False
+        except OSError:
+            # headers are gone already, all we can do is to drop the connection
+            logging.error(traceback.format_exc())
+            return False
+        return response.keep_alive and (head_only or sent == body.count)
+
+    @asyncio.coroutine
+    def _sendfile(self, f, offset, count):
+        loop = asyncio.get_event_loop()
+        transport = self.writer.transport
+        try:
+            # python 3.7+, falls back to reading the file itself for TLS
+            return (yield from awaitable_iter(loop.sendfile(transport, f, offset, count)))
+        except (AttributeError, NotImplementedError):
+            pass
+
+        sock = transport.get_extra_info('socket')
+        if sock is None or transport.get_extra_info('sslcontext') is not None or \
+                not hasattr(os, 'sendfile') or \
+                not isinstance(loop, asyncio.selector_events.BaseSelectorEventLoop):
+            return (yield from self._copy_file(f, offset, count))
+
+        # the transport buffer must be empty before we write to the socket directly
+        low, high = transport.get_write_buffer_limits()
+        transport.set_write_buffer_limits(0)
+        try:
+            yield from self.writer.drain()
+        finally:
+            transport.set_write_buffer_limits(high, low)
+
+        # the loop doesn't let to wait for an fd of a transport, a duplicate is fine
+        fd = os.dup(sock.fileno())
+        sent = 0
+        try:
+            while sent < count:
+                try:
+                    n = os.sendfile(fd, f.fileno(), offset + sent, count - sent)
+                except (BlockingIOError, InterruptedError):
+                    yield from self._writable(loop, fd)
+                    continue
+                except (BrokenPipeError, ConnectionResetError):
+                    break
+                if not n:
+                    # the file was truncated
+                    break
+                sent += n
+        finally:
+            os.close(fd)
+        return sent
+
+    @asyncio.coroutine
+    def _writable(self, loop, fd):
+        waiter = asyncio.Future(loop=loop)
+        loop.add_writer(fd, lambda: waiter.done() or waiter.set_result(None))
+        try:
+            yield from waiter
+        finally:
+            loop.remove_writer(fd)
+
+    @asyncio.coroutine
+    def _copy_file(self, f, offset, count):
+        f.seek(offset)
+        sent = 0
+        while sent < count:
+            chunk = f.read(min(count - sent, 64 * 1024))
+            if not chunk:
+                break
+            yield from self._write_chunk(chunk, False)
+            sent += len(chunk)
+        return sent
+
+    @asyncio.coroutine
+    def _write_chunk(self, chunk, chunked):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if not chunk:
+            # an empty chunk would end the body
+            return 0
+        if chunked:
+            chunk = encode_chunk(chunk)
+        self.writer.write(chunk)
+        yield from self.writer.drain()
+        if self.state == 'CLOSED':
+            raise ConnectionResetError('Connection lost')
+        return len(chunk)
+
 
 class Application(object):
 
@@ -181,6 +816,65 @@ class Application(object):
             'port': 8888,
             'logfile_path': None,
             'template_path': None,
+            'keep_alive_timeout': 5,  # seconds an idle connection is kept
+            'keep_alive_max_requests': 100,  # requests per connection
+            'router_cache_size': 1024,  # resolved paths to remember
+            'max_body_size': 10 * 1024 * 1024,  # bytes, None for no limit
+            'max_header_size': 64 * 1024,  # bytes, request line and headers
+            'workers': 1,  # processes to fork, see rainfall.workers
+            'reuse_port': False,  # bind each worker with SO_REUSEPORT
+            'worker_shutdown_timeout': 10,  # seconds before a worker is killed
+            'run_in_executor': False,  # run regular handle() in executor_pool
+            'executor': None,  # concurrent.futures.Executor of threads, a thread pool by default
+            'executor_workers': 8,  # size of the default thread pool
+            'template_cache_path': None,  # directory for compiled templates bytecode
+            'template_auto_reload': True,  # reload changed templates, off in production
+            'template_async': False,  # jinja2 enable_async, see render_async
+            'template_precompile': True,  # compile all templates at startup
+            'template_extensions': ('html', 'htm', 'xml', 'txt', 'j2', 'jinja2'),  # what to precompile
+            'static_path': None,  # directory for rainfall.static.StaticFileHandler
+            'static_stat_ttl': 1,  # seconds a static file stat() is trusted
+            'compression': False,  # compress responses for clients accepting gzip/deflate/br
+            'compression_level': 6,  # zlib level, brotli quality
+            'compression_min_size': 1024,  # bytes, smaller bodies are sent as they are
+            'compression_types': COMPRESSIBLE_TYPES,  # content type prefixes to compress
+            'compression_executor_size': 64 * 1024,  # bytes, larger bodies are compressed in executor_pool
+            'compression_cache_size': 256,  # compressed bodies kept by ETag
+            'ws_send_queue_size': 64,  # frames queued per websocket for broadcasts
+            'ws_slow_consumer_policy': 'drop',  # drop, coalesce or disconnect, see rainfall.hub
+            'ws_max_message_size': 1024 * 1024,  # bytes, larger messages close the websocket with 1009
+            'ws_read_queue_size': 32,  # received messages waiting for on_message
+            'ws_ping_interval': 20,  # seconds between pings, None to turn off
+            'ws_ping_timeout': 20,  # seconds to wait for a pong
+            'ws_deflate': False,  # permessage-deflate for clients offering it
+            'ws_deflate_context_takeover': True,  # keep compression context between messages
+            'ws_deflate_window_bits': 15,  # LZ77 window of the server, 9..15
+            'ws_deflate_level': 6,  # zlib level of websocket messages
+            'metrics': True,  # request and connection metrics, see rainfall.metrics
+            'metrics_buckets': DEFAULT_BUCKETS,  # request latency histogram buckets, seconds
+            'metrics_loop_interval': 1,  # seconds between event loop lag checks, None to turn off
+            'access_log': True,  # write access log off the event loop, see rainfall.accesslog
+            'access_log_path': None,  # file, None means logfile_path or stderr
+            'access_log_format': 'text',  # text or json (one object per line)
+            'access_log_sample': 1.0,  # fraction of requests to log, 5xx are always logged
+            'access_log_queue_size': 10000,  # entries waiting to be written, more are dropped
+            'access_log_batch_size': 256,  # entries written at once
+            'uvloop': False,  # run on uvloop if it's installed, asyncio loop otherwise
+            'backlog': 100,  # listen() backlog, raise it for bursts of connections
+            'tcp_nodelay': None,  # set TCP_NODELAY on connections, None keeps the loop default (on)
+            'socket_sndbuf': None,  # SO_SNDBUF of connections in bytes, None keeps the system default
+            'socket_rcvbuf': None,  # SO_RCVBUF of connections in bytes, None keeps the system default
+            'shutdown_timeout': 5,  # seconds for in-flight requests on SIGTERM/SIGINT, see Application.shutdown
+            'max_connections': None,  # open connections per process, more get 503 at once, None for no limit
+            'max_requests_in_flight': None,  # requests handled at once per process, None for no limit, see rainfall.admission
+            'request_queue_size': 100,  # requests waiting for a place in a limit, more get 503
+            'request_queue_timeout': 1,  # seconds a request waits for a place, then gets 503
+            'retry_after': 1,  # Retry-After of 503 responses, seconds
+            'handler_timeout': None,  # seconds, handlers taking longer are cancelled with 503, None for no timeout
+            'pipeline_depth': 8,  # pipelined requests of a connection handled at once, 1 turns it off
+            'singleton_handlers': False,  # one instance per HTTPHandler class for all requests, see HTTPHandler.singleton
+            'multipart_spool_size': 1024 * 1024,  # bytes of an uploaded file kept in memory, the rest goes to a temporary file
+            'etag_hash': 'auto',  # hash of ETags, 'xxhash', 'blake2b', 'sha1' or a function, auto is the fastest available, see rainfall.etag
         }
 
     Example::
@@ -192,31 +886,152 @@ class Application(object):
 
     """
 
+    default_settings = {
+        'host': '127.0.0.1',
+        'port': '8888',
+        'keep_alive_timeout': 5,
+        'keep_alive_max_requests': 100,
+        'router_cache_size': 1024,
+        'max_body_size': 10 * 1024 * 1024,
+        'max_header_size': 64 * 1024,
+        'workers': 1,
+        'reuse_port': False,
+        'worker_shutdown_timeout': 10,
+        'run_in_executor': False,
+        'executor': None,
+        'executor_workers': 8,
+        'template_cache_path': None,
+        'template_auto_reload': True,
+        'template_async': False,
+        'template_precompile': True,
+        'template_extensions': ('html', 'htm', 'xml', 'txt', 'j2', 'jinja2'),
+        'static_path': None,
+        'static_stat_ttl': 1,
+        'compression': False,
+        'compression_level': 6,
+        'compression_min_size': 1024,
+        'compression_types': COMPRESSIBLE_TYPES,
+        'compression_executor_size': 64 * 1024,
+        'compression_cache_size': 256,
+        'ws_send_queue_size': 64,
+        'ws_slow_consumer_policy': 'drop',
+        'ws_max_message_size': 1024 * 1024,
+        'ws_read_queue_size': 32,
+        'ws_ping_interval': 20,
+        'ws_ping_timeout': 20,
+        'ws_deflate': False,
+        'ws_deflate_context_takeover': True,
+        'ws_deflate_window_bits': 15,
+        'ws_deflate_level': 6,
+        'metrics': True,
+        'metrics_buckets': DEFAULT_BUCKETS,
+        'metrics_loop_interval': 1,
+        'access_log': True,
+        'access_log_path': None,
+        'access_log_format': 'text',
+        'access_log_sample': 1.0,
+        'access_log_queue_size': 10000,
+        'access_log_batch_size': 256,
+        'uvloop': False,
+        'backlog': 100,
+        'tcp_nodelay': None,
+        'socket_sndbuf': None,
+        'socket_rcvbuf': None,
+        'shutdown_timeout': 5,
+        'max_connections': None,
+        'max_requests_in_flight': None,
+        'request_queue_size': 100,
+        'request_queue_timeout': 1,
+        'retry_after': 1,
+        'handler_timeout': None,
+        'pipeline_depth': 8,
+        'singleton_handlers': False,
+        'multipart_spool_size': 1024 * 1024,
+        'etag_hash': 'auto',
+    }
+
     def __init__(self, handlers, settings=None):
         """
         Creates an Application that can be started or tested
         """
         self.settings = settings or {}
 
-        if not 'host' in self.settings:
-            self.settings['host'] = '127.0.0.1'
+        for key, value in self.default_settings.items():
+            if not key in self.settings:
+                self.settings[key] = value
+
+        executor = self.settings['executor'] or ThreadPoolExecutor(
+            max_workers=self.settings['executor_workers']
+        )
+        if isinstance(executor, ProcessPoolExecutor):
+            # handlers, requests and settings can't be pickled
+            raise RainfallException('executor must run in threads, not in processes')
+        self.executor_pool = ExecutorPool(
+            executor, getattr(executor, '_max_workers', self.settings['executor_workers'])
+        )
+        self.settings['executor_pool'] = self.executor_pool
+
+        self.settings['jinja_env'] = create_environment(self.settings)
 
-        if not 'port' in self.settings:
-            self.settings['port'] = '8888'
+        self.settings['etag_hasher'] = get_hash(self.settings['etag_hash'])
 
-        self.settings['jinja_env'] = Environment(
-            loader=FileSystemLoader(self.settings.get('template_path', ''))
+        self.settings['ws_hub'] = Hub(
+            self.settings['ws_send_queue_size'], self.settings['ws_slow_consumer_policy']
         )
 
+        self.metrics = None
+        if self.settings['metrics']:
+            self.metrics = Metrics(self.settings['metrics_buckets'])
+        self.settings['metrics_registry'] = self.metrics
+
+        # created in the serving process, see _start_server
+        self.access_log = None
+        self.settings['access_logger'] = None
+
+        self.settings['compressor'] = None
+        if self.settings['compression']:
+            self.settings['compressor'] = Compressor(
+                level=self.settings['compression_level'],
+                min_size=self.settings['compression_min_size'],
+                types=self.settings['compression_types'],
+                executor_size=self.settings['compression_executor_size'],
+                cache_size=self.settings['compression_cache_size'],
+                executor_pool=self.executor_pool,
+            )
+
+        self.settings['admission'] = None
+        if self.settings['max_requests_in_flight'] or any(
+            getattr(h, 'max_in_flight', None) for h in handlers.values()
+        ):
+            self.settings['admission'] = Admission(
+                self.settings['max_requests_in_flight'],
+                self.settings['request_queue_size'],
+                self.settings['request_queue_timeout'],
+            )
+
+        # unique, in the order of the handlers dict
+        self.handler_classes = list(dict.fromkeys(handlers.values()))
 
         # configure protocol
-        RainfallProtocol._http_handlers = {
-            url: h for url, h in handlers.items() if issubclass(h, HTTPHandler)}
-        RainfallProtocol._ws_handlers = {
-            url: h for url, h in handlers.items() if issubclass(h, WSHandler)}
+        cache_size = self.settings['router_cache_size']
+        RainfallProtocol._http_router = Router({
+            url: h for url, h in handlers.items() if issubclass(h, HTTPHandler)
+        }, cache_size)
+        RainfallProtocol._ws_router = Router({
+            url: h for url, h in handlers.items() if issubclass(h, WSHandler)
+        }, cache_size)
         RainfallProtocol.settings = self.settings.copy()
+        RainfallProtocol.tcp_nodelay = self.settings['tcp_nodelay']
+        RainfallProtocol.connections = self.connections = set()
+        RainfallProtocol.draining = False
+        RainfallProtocol.handler_instances = {}
+
+        self.server = None  # asyncio server of the process, see _start_server
+        self._shutdown = None
+        self._loop_watch = None
 
-    def run(self, process_queue=None, greeting=True, loop=None, run_forever=True):
+    def run(self, process_queue=None, greeting=True, loop=None, run_forever=True,
+            workers=None):
         """
         Starts server on host and port given in settings,
         adds Ctrl-C signal handler.
@@ -226,6 +1041,10 @@ class Application(object):
         :param loop: asyncio event loop, default is asyncio.get_event_loop()
         :param run_forever: bool=True, set to False if you do not want rainfall
             to call loop.run_forever()
+        :param workers: number of processes to serve from, default is
+            settings['workers']. With more than one worker rainfall forks and
+            supervises them (see :class:`rainfall.workers.Supervisor`),
+            loop and run_forever are ignored then.
         """
         self.host = self.settings['host']
         self.port = self.settings['port']
@@ -243,11 +1062,23 @@ class Application(object):
                 format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p'
             )
 
+        if not loop and self.settings['uvloop']:
+            # before any loop is created, workers make theirs with the policy
+            install_uvloop()
+
+        workers = workers or self.settings['workers']
+        if workers > 1:
+            if greeting:
+                self._greet(self.host + ':' + self.port, logfile_path, workers)
+            Supervisor(self, workers).run(process_queue)
+            return
+
         if not loop:
             loop = asyncio.get_event_loop()
 
         if signal is not None:
-            loop.add_signal_handler(signal.SIGINT, loop.stop)
+            loop.add_signal_handler(signal.SIGTERM, self._on_stop_signal, loop)
+            loop.add_signal_handler(signal.SIGINT, self._on_stop_signal, loop)
 
         self._start_server(loop, self.host, self.port)
 
@@ -259,17 +1090,179 @@ class Application(object):
             self._greet(self.host + ':' + self.port, logfile_path)
 
         if run_forever:
+            try:
+                loop.run_forever()
+            finally:
+                self.stop_services(loop)
+
+    def _run_worker(self, sock=None, ready=None):
+        """
+        Serves in a forked worker process, with its own event loop,
+        until SIGTERM or SIGINT.
+
+        :param ready: pipe fd to tell the supervisor the worker is listening
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.add_signal_handler(signal.SIGTERM, self._on_stop_signal, loop)
+        loop.add_signal_handler(signal.SIGINT, self._on_stop_signal, loop)
+
+        self._start_server(loop, self.host, self.port, sock)
+        if ready is not None:
+            os.write(ready, b'.')
+            os.close(ready)
+        try:
             loop.run_forever()
+        finally:
+            self.stop_services(loop)
+            loop.close()
+
+    def _start_server(self, loop, host, port, sock=None):
+        self.start_services(loop)
+        backlog = self.settings['backlog']
+        if sock is not None:
+            f = loop.create_server(RainfallProtocol, sock=sock, backlog=backlog)
+        elif self.settings['reuse_port']:
+            f = loop.create_server(
+                RainfallProtocol, host, port, reuse_port=True, backlog=backlog
+            )
+        else:
+            f = loop.create_server(RainfallProtocol, host, port, backlog=backlog)
+        s = self.server = loop.run_until_complete(f)
+        for server_sock in s.sockets:
+            set_buffer_sizes(
+                server_sock, self.settings['socket_sndbuf'], self.settings['socket_rcvbuf']
+            )
+        logger.info('Event loop: {}'.format(loop_name(loop)))
+
+    def start_services(self, loop):
+        """
+        Prepares the serving process before it accepts connections:
+        setup() of the handlers, the access log thread, event loop lag checks.
+        Is called by :class:`rainfall.unittest.MemoryClient` too, which
+        serves without sockets.
+        """
+        loop.run_until_complete(self.setup_handlers())
+        if self.settings['access_log']:
+            # the writing thread is started in every worker process,
+            # after logging is configured
+            if self.access_log is None:
+                self.access_log = AccessLog.from_settings(self.settings)
+                self.settings['access_logger'] = self.access_log
+            self.access_log.start()
+        if self.metrics is not None and self.settings['metrics_loop_interval']:
+            self._loop_watch = asyncio.ensure_future(
+                self.metrics.watch_loop(self.settings['metrics_loop_interval']), loop=loop
+            )
 
-    def _start_server(self, loop, host, port):
-        f = loop.create_server(RainfallProtocol, host, port)
-        s = loop.run_until_complete(f)
+    def stop_services(self, loop):
+        """
+        Undoes :meth:`start_services` when the loop is stopped
+        """
+        if self._loop_watch is not None:
+            self._loop_watch.cancel()
+            self._loop_watch = None
+        loop.run_until_complete(self.teardown_handlers())
+        if self.access_log is not None:
+            self.access_log.stop()
+
+    @asyncio.coroutine
+    def setup_handlers(self):
+        """
+        Calls setup() of the handler classes and makes the instances
+        of singleton handlers. Is called in every serving process
+        before it starts accepting connections.
+        """
+        settings = RainfallProtocol.settings
+        for handler_cls in self.handler_classes:
+            yield from maybe_yield(handler_cls.setup, settings)
+
+        instances = {}
+        for handler_cls in self.handler_classes:
+            if not issubclass(handler_cls, HTTPHandler):
+                continue
+            singleton = handler_cls.singleton
+            if singleton is None:
+                singleton = self.settings['singleton_handlers']
+            if singleton:
+                handler = instances[handler_cls] = handler_cls(settings)
+                handler._shared = True
+        RainfallProtocol.handler_instances = instances
+
+    @asyncio.coroutine
+    def teardown_handlers(self):
+        """
+        Calls teardown() of the handler classes, in reverse order,
+        when the serving process stops.
+        """
+        RainfallProtocol.handler_instances = {}
+        settings = RainfallProtocol.settings
+        for handler_cls in reversed(self.handler_classes):
+            try:
+                yield from maybe_yield(handler_cls.teardown, settings)
+            except Exception:
+                logger.exception('{}.teardown() failed'.format(handler_cls.__name__))
+
+    @asyncio.coroutine
+    def shutdown(self, timeout=None):
+        """
+        Graceful shutdown of the server of this process:
+
+        * stops accepting connections
+        * closes idle keep-alive connections
+        * lets in-flight requests finish, their responses get Connection: close
+        * closes websockets with 1001 (going away)
+
+        Connections still open after `timeout` seconds (shutdown_timeout setting
+        by default) are aborted. Is called on SIGTERM and SIGINT.
+
+        :rtype: number of aborted connections
+        """
+        if timeout is None:
+            timeout = self.settings['shutdown_timeout']
+        RainfallProtocol.draining = True
+        if self.server is not None:
+            self.server.close()
+
+        for protocol in list(self.connections):
+            if protocol._type == 'WS' and protocol.opening_handshake.done():
+                if protocol.state == 'OPEN':
+                    asyncio.ensure_future(protocol.close(1001, 'going away'))
+            elif not protocol.in_flight:
+                # waits for a request, even the first one
+                protocol.writer.close()
+
+        if self.connections:
+            logger.info('Waiting for {} connections to close'.format(len(self.connections)))
+            yield from asyncio.wait(
+                [protocol.connection_closed for protocol in self.connections], timeout=timeout
+            )
+
+        aborted = len(self.connections)
+        if aborted:
+            logger.warning('{} connections did not close in time, aborting'.format(aborted))
+            for protocol in list(self.connections):
+                protocol.writer.transport.abort()
+        if self.server is not None:
+            yield from self.server.wait_closed()
+        return aborted
+
+    def _on_stop_signal(self, loop):
+        if self._shutdown is not None:
+            # the second signal doesn't wait
+            loop.stop()
+            return
+        logger.info('Shutting down')
+        self._shutdown = asyncio.ensure_future(self.shutdown(), loop=loop)
+        self._shutdown.add_done_callback(lambda _: loop.stop())
 
-    def _greet(self, sock_name, logfile_path):
+    def _greet(self, sock_name, logfile_path, workers=1):
         # works with print only
         print(
             TerminalColors.LIGHTBLUE, '\nRainfall is starting...', '\u2602 ',
             TerminalColors.NORMAL, '\nServing on', sock_name, '\n'
         )
+        if workers > 1:
+            print('Workers: {}'.format(workers))
         if logfile_path:
             print('Logging set to {}'.format(logfile_path))
@@ -0,0 +1,220 @@
+import zlib
+import struct
+import asyncio
+
+from websockets.exceptions import WebSocketProtocolError
+from websockets.framing import Frame, OP_CONT, OP_TEXT, OP_BINARY, read_bytes
+
+
+# websockets.framing only knows frames without extensions,
+# these are the bits of it rainfall needs with RSV1 (permessage-deflate)
+
+CONTROL_OPCODES = (0x08, 0x09, 0x0a)
+DATA_OPCODES = (OP_CONT, OP_TEXT, OP_BINARY)
+
+_EMPTY_BLOCK = b'\x00\x00\xff\xff'
+
+
+class PayloadTooBig(WebSocketProtocolError):
+    """
+    A message is larger than `ws_max_message_size`, the connection is closed with 1009
+    """
+
+
+def apply_mask(data, mask):
+    """
+    XORs data with 4 bytes mask, a whole message at once
+    """
+    length = len(data)
+    if not length:
+        return data
+    mask = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(opcode, data, rsv1=False, fin=True):
+    """
+    Serializes an unmasked (server) frame
+
+    :rtype: bytes
+    """
+    head1 = (0b10000000 if fin else 0) | (0b01000000 if rsv1 else 0) | opcode
+    length = len(data)
+    if length < 126:
+        header = struct.pack('!BB', head1, length)
+    elif length < 0x10000:
+        header = struct.pack('!BBH', head1, 126, length)
+    else:
+        header = struct.pack('!BBQ', head1, 127, length)
+    return header + data
+
+
+@asyncio.coroutine
+def read_frame(reader, mask, max_size=None, rsv1_allowed=False):
+    """
+    The same as websockets.framing.read_frame, but lets RSV1 through
+    when an extension uses it and doesn't read frames larger than `max_size`.
+
+    :rtype: (:class:`websockets.framing.Frame`, rsv1)
+    """
+    data = yield from read_bytes(reader, 2)
+    head1, head2 = struct.unpack('!BB', data)
+    fin = bool(head1 & 0b10000000)
+    rsv1 = bool(head1 & 0b01000000)
+    if head1 & 0b00110000 or (rsv1 and not rsv1_allowed):
+        raise WebSocketProtocolError("Reserved bits must be 0")
+    opcode = head1 & 0b00001111
+    if opcode not in DATA_OPCODES and opcode not in CONTROL_OPCODES:
+        raise WebSocketProtocolError("Invalid opcode")
+    if bool(head2 & 0b10000000) != mask:
+        raise WebSocketProtocolError("Incorrect masking")
+
+    length = head2 & 0b01111111
+    if length == 126:
+        data = yield from read_bytes(reader, 2)
+        length, = struct.unpack('!H', data)
+    elif length == 127:
+        data = yield from read_bytes(reader, 8)
+        length, = struct.unpack('!Q', data)
+
+    if opcode in CONTROL_OPCODES:
+        if length > 125:
+            raise WebSocketProtocolError("Control frame too long")
+        if not fin:
+            raise WebSocketProtocolError("Fragmented control frame")
+        if rsv1:
+            raise WebSocketProtocolError("Reserved bits must be 0")
+    elif max_size is not None and length > max_size:
+        raise PayloadTooBig("Frame of {} bytes".format(length))
+
+    if mask:
+        mask_bits = yield from read_bytes(reader, 4)
+    data = yield from read_bytes(reader, length)
+    if mask:
+        data = apply_mask(data, mask_bits)
+    return Frame(fin, opcode, data), rsv1
+
+
+def parse_extensions(values):
+    """
+    Parses Sec-WebSocket-Extensions header values.
+
+    :param values: list of header values
+    :rtype: list of (name, list of (param, value or None))
+    """
+    extensions = []
+    for value in values:
+        for item in value.split(','):
+            parts = [part.strip() for part in item.split(';')]
+            if not parts[0]:
+                continue
+            params = []
+            for part in parts[1:]:
+                name, sep, param_value = part.partition('=')
+                params.append((name.strip().lower(), param_value.strip().strip('"') if sep else None))
+            extensions.append((parts[0].lower(), params))
+    return extensions
+
+
+class PerMessageDeflate(object):
+    """
+    permessage-deflate extension (RFC 7692) of one connection.
+
+    :param server_no_context_takeover: compress every message from scratch,
+        costs ratio, saves the compressor memory between messages
+    :param client_no_context_takeover: the client does the same, so
+        the decompressor is not kept between messages either
+    :param window_bits: LZ77 window of the server compressor, 9..15
+    :param level: zlib compression level
+    """
+
+    def __init__(self, server_no_context_takeover=False, client_no_context_takeover=False,
+                 window_bits=15, level=6):
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.window_bits = max(window_bits, 9)  # zlib doesn't do raw deflate with 8
+        self.level = level
+        self._compressor = None
+        self._decompressor = None
+
+    def compress(self, data):
+        """
+        Compresses a whole message
+        """
+        if self._compressor is None or self.server_no_context_takeover:
+            self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, -self.window_bits)
+        data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data.endswith(_EMPTY_BLOCK):
+            data = data[:-4]
+        return data
+
+    def decompress(self, data, fin, max_size=None):
+        """
+        Decompresses a frame of a compressed message.
+
+        :param fin: True for the last frame of the message
+        :param max_size: max number of bytes to decompress
+        :raises: :class:`PayloadTooBig` if there are more
+        """
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        if fin:
+            data += _EMPTY_BLOCK
+        try:
+            result = self._decompressor.decompress(data, max_size or 0)
+        except zlib.error as exc:
+            raise WebSocketProtocolError("Invalid compressed data") from exc
+        if self._decompressor.unconsumed_tail:
+            raise PayloadTooBig("Decompressed message is too big")
+        if fin and self.client_no_context_takeover:
+            self._decompressor = None
+        return result
+
+    @classmethod
+    def negotiate(cls, header_values, context_takeover=True, window_bits=15, level=6):
+        """
+        Accepts the first permessage-deflate offer of the client
+        that rainfall is able to follow.
+
+        :param header_values: Sec-WebSocket-Extensions values of the request
+        :rtype: (:class:`PerMessageDeflate`, response header value)
+            or (None, None) if nothing was offered
+        """
+        for name, params in parse_extensions(header_values):
+            if name != 'permessage-deflate':
+                continue
+            names = [param for param, _ in params]
+            if len(set(names)) != len(names):
+                continue
+            params = dict(params)
+            if not set(params) <= {
+                'server_no_context_takeover', 'client_no_context_takeover',
+                'server_max_window_bits', 'client_max_window_bits',
+            }:
+                continue
+
+            response = ['permessage-deflate']
+            server_no_context_takeover = 'server_no_context_takeover' in params or \
+                not context_takeover
+            if server_no_context_takeover:
+                response.append('server_no_context_takeover')
+            # the server may ask the client for it at will
+            client_no_context_takeover = 'client_no_context_takeover' in params or \
+                not context_takeover
+            if client_no_context_takeover:
+                response.append('client_no_context_takeover')
+
+            bits = window_bits
+            if 'server_max_window_bits' in params:
+                offered = params['server_max_window_bits']
+                # zlib can't keep to a window of 8 bits
+                if not offered or not offered.isdigit() or not 9 <= int(offered) <= 15:
+                    continue
+                bits = min(bits, int(offered))
+                response.append('server_max_window_bits={}'.format(bits))
+            # a smaller window is fine for the decompressor of the client anyway
+
+            return cls(
+                server_no_context_takeover, client_no_context_takeover, bits, level
+            ), '; '.join(response)
+        return None, None
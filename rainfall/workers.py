@@ -0,0 +1,205 @@
+import os
+import time
+import signal
+import socket
+import logging
+
+from .utils import RainfallException
+
+
+logger = logging.getLogger(__name__)
+
+# a worker dying sooner than this after start is restarted with a delay,
+# so a broken app doesn't turn into a fork loop
+MIN_WORKER_LIFETIME = 1
+
+
+def bind_socket(host, port, backlog=100):
+    """
+    Create a listening socket to be shared by the worker processes.
+    """
+    family, type_, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )[0]
+    sock = socket.socket(family, type_, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class Supervisor(object):
+    """
+    Runs :class:`rainfall.web.Application` in several forked processes,
+    each one with its own event loop.
+
+    Workers either share one listening socket created here or, with
+    the reuse_port setting, bind their own sockets with SO_REUSEPORT.
+
+    Crashed workers are restarted, SIGTERM and SIGINT stop all of them,
+    SIGHUP restarts them one by one. The new workers are forked from
+    the supervisor, so they run the code and settings it has imported:
+    it's a restart (e.g. to free leaked memory), not a reload of new code,
+    which needs a restart of the supervisor process itself.
+
+    :param app: :class:`rainfall.web.Application` to run
+    :param workers: number of worker processes
+    """
+
+    def __init__(self, app, workers):
+        if not hasattr(os, 'fork'):
+            raise RainfallException('Workers require os.fork()')
+
+        self.app = app
+        self.workers = workers
+        self.shutdown_timeout = app.settings['worker_shutdown_timeout']
+        self.sock = None
+        self.children = {}  # pid -> start time
+        self._ready = {}  # pid -> read end of the pipe the worker reports readiness to
+        self._stopping = False
+        self._restarting = False
+
+    def run(self, process_queue=None):
+        """
+        Start workers and supervise them until stopped by a signal.
+        """
+        if not self.app.settings['reuse_port']:
+            self.sock = bind_socket(
+                self.app.settings['host'], int(self.app.settings['port']),
+                self.app.settings['backlog'],
+            )
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+
+        self.wait_ready([self.spawn() for _ in range(self.workers)])
+
+        if process_queue:
+            # used in tests for multiprocess communication
+            process_queue.put('started')
+
+        try:
+            while not self._stopping:
+                if self._restarting:
+                    self._restarting = False
+                    self.restart()
+                self.reap()
+                time.sleep(0.5)
+        finally:
+            self.stop()
+            if self.sock is not None:
+                self.sock.close()
+
+    def spawn(self):
+        """
+        Fork a new worker process, see :meth:`wait_ready`.
+        """
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(ready_w)
+            self.children[pid] = time.time()
+            self._ready[pid] = ready_r
+            logger.info('Started worker {}'.format(pid))
+            return pid
+
+        # worker process
+        os.close(ready_r)
+        status = 0
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            # a hangup of the process group is for the supervisor
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            self.app._run_worker(self.sock, ready_w)
+        except Exception:
+            logger.exception('Worker {} failed'.format(os.getpid()))
+            status = 1
+        finally:
+            os._exit(status)
+
+    def wait_ready(self, pids):
+        """
+        Wait until the workers listen (with reuse_port they bind
+        their own sockets) or exit.
+        """
+        for pid in pids:
+            ready = self._ready.pop(pid, None)
+            if ready is None:
+                continue
+            try:
+                # a byte when the worker is listening, EOF if it has died
+                os.read(ready, 1)
+            finally:
+                os.close(ready)
+
+    def reap(self):
+        """
+        Restart the workers that have exited.
+        """
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+
+            logger.warning('Worker {} exited with status {}, restarting'.format(pid, status))
+            if time.time() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            self.wait_ready([self.spawn()])
+
+    def restart(self):
+        """
+        Rolling restart: start a new worker, wait until it listens,
+        then stop an old one, so that there are always workers
+        accepting connections.
+        """
+        logger.info('Restarting workers')
+        for pid in list(self.children):
+            self.wait_ready([self.spawn()])
+            self.children.pop(pid)
+            self._terminate([pid])
+
+    def stop(self):
+        """
+        Ask all workers to stop, kill those that don't in time.
+        """
+        self._stopping = True
+        self._terminate(list(self.children))
+        self.children.clear()
+        for ready in self._ready.values():
+            os.close(ready)
+        self._ready.clear()
+
+    def _terminate(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.time() + self.shutdown_timeout
+        pids = set(pids)
+        while pids and time.time() < deadline:
+            for pid in list(pids):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        pids.discard(pid)
+                except ChildProcessError:
+                    pids.discard(pid)
+            time.sleep(0.05)
+
+        for pid in pids:
+            logger.warning('Worker {} did not stop in time, killing'.format(pid))
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_restart(self, signum, frame):
+        self._restarting = True